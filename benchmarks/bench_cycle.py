@@ -0,0 +1,285 @@
+"""
+チェック1ティック (検知を全部走らせて通知を送るまで) の所要時間を、ローカルの代役サーバ相手に測るハーネス
+
+    python benchmarks/bench_cycle.py --cycles 50
+    python benchmarks/bench_cycle.py --cycles 50 --trains 6000 --latency 0.2 --jitter 0.1 --error-rate 0.05
+    python benchmarks/bench_cycle.py --cycles 10 --scheduled      # 本番と同じく、期限が来たチェックだけを実時間で回す
+
+odpt_stub_server を同じプロセスの別スレッドで立て、synthetic_odpt の合成データ
+(JR東・都営・東武、運転見合わせ入り) を1ティックごとに1段階ずつ進めて返す。
+通知は Discord の代わりに、送信の遅れを真似るだけの偽チャンネルに送る。
+periodic_checks.run_check_cycle / send_notifications は本番 (bot.py) と同じものを使う。
+
+出すもの:
+  ティックの所要時間 (検知のみ / 通知送信込み) の p50・p95・p99
+  チェックごとの所要時間 (p50・p95・最大)
+  解析スレッド (run_in_executor) の使われ方: 同時に動いた最大数・待ち時間・稼働率
+  通知1通あたりの送信時間
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from odpt_stub_server import ODPTStubServer, StubDataset, StubConfig
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """最近順位法のパーセンタイル (値が無ければ 0)"""
+    if not values: return 0.0
+    ordered = sorted(values)
+    index = min(max(int(round(fraction * len(ordered) + 0.5)) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+
+class CycleDataset(StubDataset):
+    """ハーネスが advance() を呼ぶたびに、合成データを1段階進める"""
+
+    def __init__(self):
+        self.networks: List[Any] = []
+        self._lock = threading.Lock()
+        self._trains: List[Dict[str, Any]] = []
+        self._information: List[Dict[str, Any]] = []
+
+    def advance(self, step: int) -> None:
+        # 応答のたびに作ると代役サーバが GIL を取り合うので、ティックの外で作っておく
+        trains = [train for network in self.networks for train in network.trains_at(step)]
+        information = [item for network in self.networks for item in network.information_at(step)]
+        with self._lock:
+            self._trains, self._information = trains, information
+
+    def trains(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._trains
+
+    def information(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._information
+
+
+class FakeChannel:
+    """Discord チャンネルの代わり。送信ごとに決まった遅れ (±ゆらぎ) を入れて、かかった時間を記録する"""
+
+    def __init__(self, delay: float, jitter: float):
+        self.delay = delay
+        self.jitter = jitter
+        self.sent: List[str] = []
+        self.latencies: List[float] = []
+
+    async def send(self, content: str) -> None:
+        start = time.perf_counter()
+        await asyncio.sleep(max(self.delay + random.uniform(-self.jitter, self.jitter), 0))
+        self.sent.append(content)
+        self.latencies.append(time.perf_counter() - start)
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """解析スレッドの使われ方を数える ThreadPoolExecutor"""
+
+    def __init__(self, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix="check-worker")
+        self._count_lock = threading.Lock()
+        self.active = 0
+        self.peak_active = 0
+        self.tasks = 0
+        self.busy_seconds = 0.0
+        self.queue_waits: List[float] = []
+        self.thread_names: set = set()
+
+    def submit(self, fn, *args, **kwargs):
+        submitted = time.perf_counter()
+
+        def counted():
+            started = time.perf_counter()
+            with self._count_lock:
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                self.queue_waits.append(started - submitted)
+                self.thread_names.add(threading.current_thread().name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._count_lock:
+                    self.active -= 1
+                    self.tasks += 1
+                    self.busy_seconds += time.perf_counter() - started
+        return super().submit(counted)
+
+
+async def run_harness(args: argparse.Namespace, dataset: CycleDataset, channel: FakeChannel) -> Dict[str, Any]:
+    import clock
+    import odpt_client
+    import periodic_checks
+    import synthetic_odpt
+
+    operators = [synthetic_odpt.JR_EAST_OPERATOR, synthetic_odpt.TOEI_OPERATOR, synthetic_odpt.TOBU_OPERATOR]
+    dataset.networks = [synthetic_odpt.SyntheticNetwork(operator, args.trains, seed=args.seed) for operator in operators]
+    if args.stoppage is not None:
+        dataset.networks[0].add_stoppage("ChuoRapid", args.stoppage, resume_steps=8)
+
+    loop = asyncio.get_running_loop()
+    executor = CountingExecutor(periodic_checks.WORKER_THREADS)
+    loop.set_default_executor(executor)
+    periodic_checks._worker_pools[id(loop)] = executor # 本番と同じスレッド数のまま、数えるものに差し替える
+
+    cycles: List[Dict[str, Any]] = []
+    wall_start = time.perf_counter()
+    for step in range(args.warmup + args.cycles):
+        dataset.advance(step)
+        clock.set_virtual_time(dataset.networks[0].time_at(step)) # 遅延監視の時刻を合成データに合わせる
+        sent_before = len(channel.sent)
+        previous_report = periodic_checks.last_cycle_report
+        cycle_start = time.perf_counter()
+        if args.scheduled:
+            await asyncio.sleep(periodic_checks.seconds_until_next_due())
+            cycle_start = time.perf_counter()
+            notifications = await periodic_checks.run_due_checks(args.deadline)
+        else:
+            notifications = await periodic_checks.run_check_cycle(None, args.deadline)
+        checks_done = time.perf_counter()
+        await periodic_checks.send_notifications(channel, notifications)
+        cycle_end = time.perf_counter()
+        if step < args.warmup: continue
+        # 期限が来たチェックが無ければ、ティックの報告は作られない
+        report = periodic_checks.last_cycle_report if periodic_checks.last_cycle_report is not previous_report else {}
+        cycles.append({
+            "checks": checks_done - cycle_start,
+            "total": cycle_end - cycle_start,
+            "sent": len(channel.sent) - sent_before,
+            "stages": {name: entry for name, entry in report.get("stages", {}).items()},
+            "timed_out": list(report.get("timed_out", [])),
+        })
+    clock.use_real_time()
+    wall = time.perf_counter() - wall_start
+    await odpt_client.close_async_sessions()
+    return {"cycles": cycles, "wall": wall, "executor": executor}
+
+
+def summarize(result: Dict[str, Any], channel: FakeChannel, server: ODPTStubServer) -> Dict[str, Any]:
+    cycles = result["cycles"]
+    executor: CountingExecutor = result["executor"]
+    checks = [cycle["checks"] for cycle in cycles]
+    totals = [cycle["total"] for cycle in cycles]
+
+    stage_times: Dict[str, List[float]] = {}
+    stage_failures: Dict[str, int] = {}
+    for cycle in cycles:
+        for name, entry in cycle["stages"].items():
+            if entry.get("seconds") is not None: stage_times.setdefault(name, []).append(entry["seconds"])
+            if entry.get("status") != "ok": stage_failures[name] = stage_failures.get(name, 0) + 1
+
+    def ms(values: List[float]) -> Dict[str, float]:
+        return {"p50": round(percentile(values, 0.50) * 1000, 1), "p95": round(percentile(values, 0.95) * 1000, 1),
+                "p99": round(percentile(values, 0.99) * 1000, 1), "max": round(max(values, default=0) * 1000, 1)}
+
+    return {
+        "cycles": len(cycles),
+        "cycle_ms": ms(totals),
+        "checks_ms": ms(checks),
+        "stages_ms": {name: ms(values) for name, values in stage_times.items()},
+        "stage_failures": stage_failures,
+        "timed_out_cycles": sum(1 for cycle in cycles if cycle["timed_out"]),
+        "executor": {
+            "threads": executor._max_workers,
+            "threads_used": len(executor.thread_names),
+            "peak_active": executor.peak_active,
+            "tasks": executor.tasks,
+            "busy_seconds": round(executor.busy_seconds, 3),
+            "utilization": round(executor.busy_seconds / (executor._max_workers * result["wall"]), 3) if result["wall"] else 0,
+            "queue_wait_ms": ms(executor.queue_waits),
+        },
+        "send": {"messages": len(channel.sent), "latency_ms": ms(channel.latencies)},
+        "stub": dict(server.stats),
+    }
+
+
+def print_report(summary: Dict[str, Any]) -> None:
+    def row(name: str, values: Dict[str, float]) -> None:
+        print(f"  {name:<22}{values['p50']:>9.1f}{values['p95']:>9.1f}{values['p99']:>9.1f}{values['max']:>9.1f}")
+
+    print(f"\n--- {summary['cycles']} cycles (ms) ---")
+    print(f"  {'':<22}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    row("cycle (with sends)", summary["cycle_ms"])
+    row("checks only", summary["checks_ms"])
+    print("\n--- per stage (ms) ---")
+    for name, values in summary["stages_ms"].items():
+        row(name, values)
+    if summary["stage_failures"]:
+        print(f"  failures: {summary['stage_failures']}")
+    if summary["timed_out_cycles"]:
+        print(f"  cycles with a timed-out stage: {summary['timed_out_cycles']}")
+
+    executor = summary["executor"]
+    print("\n--- executor ---")
+    print(f"  threads {executor['threads_used']}/{executor['threads']} used, peak {executor['peak_active']} active, "
+          f"{executor['tasks']} tasks, utilization {executor['utilization'] * 100:.1f}%")
+    row("queue wait", executor["queue_wait_ms"])
+    print("\n--- notifications ---")
+    print(f"  {summary['send']['messages']} sent")
+    row("send latency", summary["send"]["latency_ms"])
+    print(f"\n--- stub --- {summary['stub']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=30, help="測るティックの数")
+    parser.add_argument("--warmup", type=int, default=2, help="測らずに回す最初のティックの数")
+    parser.add_argument("--trains", type=int, default=600, help="1事業者あたりの列車数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stoppage", type=int, default=5, help="中央快速線の運転見合わせを仕込むティック (-1 で仕込まない)")
+    parser.add_argument("--latency", type=float, default=0.05, help="代役サーバの応答の遅れ (秒)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="応答の遅れのゆらぎ (±秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="代役サーバが 5xx を返す割合")
+    parser.add_argument("--send-delay", type=float, default=0.15, help="通知1通の送信にかかる時間 (秒)")
+    parser.add_argument("--send-jitter", type=float, default=0.05)
+    parser.add_argument("--deadline", type=float, default=40.0, help="1ティックの締め切り (秒)")
+    parser.add_argument("--scheduled", action="store_true", help="期限が来たチェックだけを、実時間で待ちながら回す")
+    parser.add_argument("--real-budgets", action="store_true",
+                        help="トークン予算を本番の値 (ODPT_BUDGET_* の環境変数か既定値) のままにする (既定では外す)")
+    parser.add_argument("--json", help="結果をJSONで書き出すファイル")
+    parser.add_argument("--verbose", action="store_true", help="検知のログを表示する")
+    args = parser.parse_args()
+    if args.stoppage < 0: args.stoppage = None
+
+    dataset = CycleDataset()
+    config = StubConfig(args.latency, args.jitter, args.error_rate)
+    server = ODPTStubServer(dataset, config).start()
+    # odpt_client は import した時点で取得先とトークンを読むので、検知を import する前に設定する
+    os.environ.update(server.environment())
+    os.environ.setdefault("ODPT_TOKEN_CHALLENGE", "bench-challenge")
+    os.environ.setdefault("ODPT_TOKEN_TOEI", "bench-toei")
+    os.environ.pop("ODPT_RECORD_DIR", None)
+    if not args.real_budgets:
+        # 何十ティックも続けて回すと1分の予算をすぐ使い切るので、制限を外す (空 = 制限なし)
+        for token in ("CHALLENGE", "TOEI"):
+            for period in ("PER_MINUTE", "PER_DAY"):
+                os.environ[f"ODPT_BUDGET_{token}_{period}"] = ""
+
+    channel = FakeChannel(args.send_delay, args.send_jitter)
+    print(f"--- [BENCH] {args.cycles} cycles, {args.trains} trains/operator, stub at {server.base_url} ---", flush=True)
+    output = sys.stdout if args.verbose else open(os.devnull, "w", encoding="utf-8")
+    try:
+        with contextlib.redirect_stdout(output):
+            result = asyncio.run(run_harness(args, dataset, channel))
+    finally:
+        server.stop()
+        if output is not sys.stdout: output.close()
+
+    summary = summarize(result, channel, server)
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
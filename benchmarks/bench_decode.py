@@ -0,0 +1,137 @@
+"""
+odpt:Train のデコード方法ごとの速さとメモリを比べるベンチマーク
+
+    python benchmarks/bench_decode.py --trains 600 --repeat 20
+
+比べるもの:
+  dict+json   : これまでの方法 (json.loads で dict の配列 → MappingProxyType で包む)
+  record+json : 標準の json.loads → Train レコード
+  record+fast : odpt_records の速いデコーダ (orjson / msgspec、無ければ json) → Train レコード
+  stream      : 逐次パーサ (64KiB ずつ受け取り、1本ずつ Train レコードにする。dict の配列を作らない)
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from types import MappingProxyType
+from typing import Callable, Dict, Any, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import odpt_records
+from odpt_records import trains_from_json, train_stream_parser
+from odpt_client import STREAM_CHUNK_SIZE
+
+LINES = ["ChuoRapid", "Chuo", "Yamanote", "KeihinTohokuNegishi", "Tokaido", "Yokosuka", "SobuRapid",
+         "Keiyo", "Utsunomiya", "Takasaki", "SaikyoKawagoe", "Joban", "Musashino", "Nambu", "Yokohama"]
+STATIONS = ["Tokyo", "Kanda", "Ochanomizu", "Yotsuya", "Shinjuku", "Nakano", "Mitaka", "Tachikawa",
+            "Hachioji", "Takao", "Shinagawa", "Yokohama", "Omiya", "Ueno", "Chiba", "Funabashi"]
+
+
+def make_payload(num_trains: int, seed: int = 1) -> bytes:
+    """本物のJR東 odpt:Train に近い形 (使わない項目も含む) のJSONを作る"""
+    rng = random.Random(seed)
+    trains: List[Dict[str, Any]] = []
+    for i in range(num_trains):
+        line = rng.choice(LINES)
+        stations = [f"odpt.Station:JR-East.{line}.{name}" for name in STATIONS]
+        trains.append({
+            "@id": f"urn:ucode:_00001C000000000000010000030{i:05d}",
+            "@type": "odpt:Train",
+            "dc:date": "2025-01-01T10:00:00+09:00",
+            "dct:valid": "2025-01-01T10:01:00+09:00",
+            "@context": "http://vocab.odpt.org/context_odpt_Train.jsonld",
+            "owl:sameAs": f"odpt.Train:JR-East.{line}.{i}M",
+            "odpt:delay": rng.choice([0, 0, 0, 60, 120, 300, 900]),
+            "odpt:railway": f"odpt.Railway:JR-East.{line}",
+            "odpt:operator": "odpt.Operator:JR-East",
+            "odpt:toStation": rng.choice([None, rng.choice(stations)]),
+            "odpt:trainType": rng.choice(["odpt.TrainType:JR-East.Local", "odpt.TrainType:JR-East.Rapid"]),
+            "odpt:fromStation": rng.choice(stations),
+            "odpt:trainNumber": f"{i}M",
+            "odpt:railDirection": rng.choice(["odpt.RailDirection:Inbound", "odpt.RailDirection:Outbound"]),
+            "odpt:originStation": [rng.choice(stations)],
+            "odpt:carComposition": rng.choice([10, 15]),
+            "odpt:destinationStation": [rng.choice(stations)],
+            "odpt:trainInformationText": {"ja": "", "en": ""},
+        })
+    return json.dumps(trains, ensure_ascii=False).encode("utf-8")
+
+
+def decode_dicts(body: bytes) -> Any:
+    return tuple(MappingProxyType(train) for train in json.loads(body) if isinstance(train, dict))
+
+
+def decode_records_stdlib(body: bytes) -> Any:
+    return tuple(trains_from_json(json.loads(body)))
+
+
+def decode_records_fast(body: bytes) -> Any:
+    return tuple(trains_from_json(odpt_records.loads(body)))
+
+
+def decode_stream(body: bytes) -> Any:
+    parser = train_stream_parser()
+    records: List[Any] = []
+    for start in range(0, len(body), STREAM_CHUNK_SIZE):
+        records.extend(parser.feed(body[start:start + STREAM_CHUNK_SIZE]))
+    records.extend(parser.close())
+    return tuple(records)
+
+
+def measure(decode: Callable[[bytes], Any], body: bytes, repeat: int) -> Dict[str, float]:
+    # --- 時間 (メモリ計測の影響を受けないよう、別々に測る) ---
+    decode(body) # 暖機
+    timings: List[float] = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        decode(body)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    # --- メモリ (デコード中の最大と、結果を持ち続けるのに必要な量) ---
+    gc.collect()
+    tracemalloc.start()
+    result = decode(body)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {
+        "median_ms": timings[len(timings) // 2] * 1000,
+        "min_ms": timings[0] * 1000,
+        "peak_kib": peak / 1024,
+        "retained_kib": retained / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trains", type=int, nargs="+", default=[600, 5000], help="1回分の列車数")
+    parser.add_argument("--repeat", type=int, default=20, help="時間を測る回数")
+    args = parser.parse_args()
+
+    candidates = [
+        ("dict+json", decode_dicts),
+        ("record+json", decode_records_stdlib),
+        (f"record+{odpt_records.JSON_BACKEND}", decode_records_fast),
+        ("stream", decode_stream),
+    ]
+    print(f"JSON backend: {odpt_records.JSON_BACKEND}")
+    for num_trains in args.trains:
+        body = make_payload(num_trains)
+        print(f"\n--- {num_trains} trains ({len(body) / 1024:.0f} KiB) ---")
+        print(f"{'path':<16}{'median ms':>12}{'min ms':>10}{'peak KiB':>12}{'retained KiB':>14}")
+        for name, decode in candidates:
+            stats = measure(decode, body, args.repeat)
+            print(f"{name:<16}{stats['median_ms']:>12.2f}{stats['min_ms']:>10.2f}"
+                  f"{stats['peak_kib']:>12.0f}{stats['retained_kib']:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+1本ごとの判定処理 (非定期検知・遅延監視) の速さとメモリを測り、保存してある基準と比べるベンチマーク
+
+    python benchmarks/bench_detectors.py                      # 基準と比べる
+    python benchmarks/bench_detectors.py --save-baseline      # 今の結果を基準として保存する
+    python benchmarks/bench_detectors.py --trains 1000 --only jr_irregular --check
+
+測るもの (データは synthetic_odpt で作った、毎回同じ合成スナップショット):
+  jr_irregular:<路線>  : jr_east_detector.process_irregularities (路線ごとの専門家を通る)
+  toei_irregular       : toei_detector.process_toei_irregularities
+  jr_delay / toei_delay / tobu_delay : 遅延監視の1サイクル分の更新 (運転見合わせを1件仕込む)
+  jr_delay:calm など   : 同じく、ほかの列車はほぼ定刻の日 (NumPy があれば delay_tracker の一括モードを通る)
+  jr_irregular:cycle   : check_jr_east_irregularities を続けて回す (全路線、通知済みは持ち越す)
+  jr_irregular:delta   : 同じく、前回との差分 (snapshot_diff) を付けて。差分を作る時間も含む
+  jr_delay:delta など  : 遅延監視に、作ってある差分を渡す (差分を作るのは非定期検知の方なので、時間に含めない)。
+                         乱れて追跡中が多い回は delay_tracker が差分を使わずに全部なめるので、jr_delay などと同じになる
+
+1本あたりの時間 (µs、最速の回と中央値) と、1本あたりの最大メモリ (tracemalloc のピーク) を出す。
+基準より tolerance 倍以上遅い/大きいものは REGRESSION と表示し、--check のときは終了コード1で終わる。
+遅延監視の一括モードは環境変数 DELAY_WATCH_BATCH=off で止められる (1本ずつの処理と比べるとき)。
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Any, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import clock
+import delay_tracker
+import snapshot_diff
+import synthetic_odpt
+import train_snapshot
+import jr_east_detector
+import toei_detector
+import jr_east_delay_watcher
+import toei_delay_watcher
+import tobu_delay_watcher
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_detectors.json")
+
+# 専門家ごとに1路線ずつ (最後の Nambu は専門家を通らない普通の判定)
+SPECIALIST_LINES = [
+    ("ChuoRapid", "check_chuo_line_train"),
+    ("Chuo", "check_co_line_train"),
+    ("Tokaido", "check_tokaido_line_train"),
+    ("Keiyo", "check_boso_train"),
+    ("Utsunomiya", "check_tohoku_train"),
+    ("Yokosuka", "check_suka_line_train"),
+    ("Nambu", "generic"),
+]
+
+# ケースの間で持ち越さないように、各回の前に空にするモジュールの状態
+_STATE = [
+    (jr_east_detector, ["notified_trains"]),
+    (toei_detector, ["notified_trains"]),
+    (jr_east_delay_watcher, ["tracked_delayed_trains", "line_cooldown_tracker",
+                             "line_resumption_notified", "line_prediction_cooldown_tracker"]),
+    (toei_delay_watcher, ["tracked_delayed_trains", "line_cooldown_tracker"]),
+    (tobu_delay_watcher, ["tracked_delayed_trains", "line_cooldown_tracker"]),
+]
+
+
+def reset_state() -> None:
+    for module, names in _STATE:
+        for name in names:
+            getattr(module, name).clear()
+
+
+def _line_config(lines: List[Dict[str, Any]], suffix: str) -> Dict[str, Any]:
+    return next(config for config in lines if config["id"].split(".")[-1] == suffix)
+
+
+def irregular_case(network: synthetic_odpt.SyntheticNetwork, process: Callable, config: Dict[str, Any]) -> Callable[[int], Any]:
+    """非定期検知。通知済みを毎回空にして、メッセージ作りまで含めて測る"""
+    trains = tuple(train for train in network.records_at(0) if train.railway == config["id"])
+
+    def run(_: int) -> Any:
+        jr_east_detector.notified_trains.clear()
+        toei_detector.notified_trains.clear()
+        return process(trains, config)
+    return run
+
+
+def toei_irregular_case(network: synthetic_odpt.SyntheticNetwork) -> Callable[[int], Any]:
+    by_line = [(config, tuple(train for train in network.records_at(0) if train.railway == config["id"]))
+               for config in toei_detector.TOEI_LINES_TO_MONITOR]
+
+    def run(_: int) -> Any:
+        toei_detector.notified_trains.clear()
+        return [toei_detector.process_toei_irregularities(trains, config) for config, trains in by_line]
+    return run
+
+
+def cycle_case(network: synthetic_odpt.SyntheticNetwork, check: Callable[[Any], Any], cycles: int, diff: str = "") -> Callable[[int], Any]:
+    """
+    i 回目には i 番目のスナップショットを渡す (状態は前の回から続く)。
+    diff="lazy" なら本番と同じく前回との差分を付けて渡し (作るのは check の中で使われたとき)、
+    diff="built" なら差分を作ってから渡す (作る時間は含めない)
+    """
+    snapshots = [train_snapshot.snapshot_from_json(network.operator, network.trains_at(step), network.time_at(step), step)
+                 for step in range(cycles)]
+    if diff == "built":
+        for step, snapshot in enumerate(snapshots):
+            snapshot_diff.defer(snapshot, snapshots[step - 1] if step else None)
+            snapshot_diff.changes_of(snapshot)
+
+    def run(cycle: int) -> Any:
+        clock.set_virtual_time(network.time_at(cycle))
+        snapshot = snapshots[cycle]
+        if diff == "lazy":
+            # 前回分の差分が作られる前に次を付けると前回分は捨てられるので、渡す直前に付ける
+            snapshot_diff.defer(snapshot, snapshots[cycle - 1] if cycle else None)
+        return check(snapshot)
+    return run
+
+
+def measure(run: Callable[[int], Any], num_trains: int, repeat: int) -> Dict[str, float]:
+    reset_state()
+    with contextlib.redirect_stdout(io.StringIO()): # 検知のログは測る対象に入れない
+        run(0) # 暖機
+        timings: List[float] = []
+        for cycle in range(1, repeat + 1):
+            gc.collect()
+            start = time.perf_counter()
+            run(cycle)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+        gc.collect()
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        result = run(repeat + 1)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = sys.getallocatedblocks() - blocks_before
+        del result
+
+    return {
+        "us_per_train": timings[0] * 1e6 / num_trains, # 最速の回 (他の処理の割り込みに左右されにくい)
+        "median_us_per_train": timings[len(timings) // 2] * 1e6 / num_trains,
+        "peak_bytes_per_train": peak / num_trains,
+        "retained_blocks": blocks,
+    }
+
+
+def build_cases(num_trains: int, repeat: int) -> List[Tuple[str, Callable[[], Callable[[int], Any]]]]:
+    """(名前, 測る関数を作る関数)。データは使う直前に作る (10000本だと大きいので)"""
+    cycles = repeat + 2
+    cases: List[Tuple[str, Callable[[], Callable[[int], Any]]]] = []
+    for suffix, _ in SPECIALIST_LINES:
+        def make(suffix: str = suffix) -> Callable[[int], Any]:
+            network = synthetic_odpt.SyntheticNetwork(num_trains=num_trains, line_mix={suffix: 1}, irregular_rate=0.05)
+            return irregular_case(network, jr_east_detector.process_irregularities,
+                                  _line_config(jr_east_detector.JR_LINES_TO_MONITOR, suffix))
+        cases.append((f"jr_irregular:{suffix}", make))
+    cases.append(("toei_irregular", lambda: toei_irregular_case(
+        synthetic_odpt.SyntheticNetwork(synthetic_odpt.TOEI_OPERATOR, num_trains, irregular_rate=0.05))))
+    for suffix, diff in ((":cycle", ""), (":delta", "lazy")):
+        cases.append((f"jr_irregular{suffix}", lambda diff=diff: cycle_case(
+            synthetic_odpt.SyntheticNetwork(num_trains=num_trains, irregular_rate=0.05),
+            jr_east_detector.check_jr_east_irregularities, cycles, diff)))
+
+    def delay_network(operator: str, railway: str, distribution: str) -> synthetic_odpt.SyntheticNetwork:
+        network = synthetic_odpt.SyntheticNetwork(operator, num_trains, delay_distribution=distribution)
+        network.add_stoppage(railway, 1, followers=10)
+        return network
+    for suffix, distribution, diff in (("", "disrupted", ""), (":calm", "punctual", ""),
+                                       (":delta", "disrupted", "built"), (":calm:delta", "punctual", "built")):
+        cases.append((f"jr_delay{suffix}", lambda distribution=distribution, diff=diff: cycle_case(
+            delay_network(synthetic_odpt.JR_EAST_OPERATOR, "ChuoRapid", distribution),
+            lambda snapshot: jr_east_delay_watcher.check_delay_increase({}, snapshot), cycles, diff)))
+        cases.append((f"toei_delay{suffix}", lambda distribution=distribution, diff=diff: cycle_case(
+            delay_network(synthetic_odpt.TOEI_OPERATOR, "Asakusa", distribution), toei_delay_watcher.check_toei_delay_increase, cycles, diff)))
+        cases.append((f"tobu_delay{suffix}", lambda distribution=distribution, diff=diff: cycle_case(
+            delay_network(synthetic_odpt.TOBU_OPERATOR, "Tojo", distribution), tobu_delay_watcher.check_tobu_delay_increase, cycles, diff)))
+    return cases
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(path): return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("results", {})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trains", type=int, nargs="+", default=[100, 1000, 10000], help="1スナップショットの列車数")
+    parser.add_argument("--repeat", type=int, default=7, help="時間を測る回数 (基準との比較には最速の回を使う)")
+    parser.add_argument("--only", help="名前がこれで始まるケースだけ測る")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準のJSONファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準として保存する")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="基準の何倍を超えたら REGRESSION とするか")
+    parser.add_argument("--check", action="store_true", help="REGRESSION があれば終了コード1で終わる")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results: Dict[str, Dict[str, float]] = {}
+    regressions: List[str] = []
+    print(f"delay batch: {delay_tracker.get_stats()['batch']}")
+    print(f"{'case':<28}{'trains':>8}{'µs/train':>11}{'median':>9}{'B/train':>10}{'blocks':>9}{'vs base':>10}")
+    for num_trains in args.trains:
+        for name, make in build_cases(num_trains, args.repeat):
+            if args.only and not name.startswith(args.only): continue
+            stats = measure(make(), num_trains, args.repeat)
+            key = f"{name}@{num_trains}"
+            results[key] = {metric: round(value, 3) for metric, value in stats.items()}
+
+            comparison = ""
+            base = baseline.get(key)
+            if base:
+                ratio = stats["us_per_train"] / base["us_per_train"] if base["us_per_train"] else 1.0
+                memory_ratio = stats["peak_bytes_per_train"] / base["peak_bytes_per_train"] if base["peak_bytes_per_train"] else 1.0
+                comparison = f"{ratio:.2f}x"
+                if ratio > args.tolerance or memory_ratio > args.tolerance:
+                    comparison += " REGRESSION"
+                    regressions.append(key)
+            print(f"{name:<28}{num_trains:>8}{stats['us_per_train']:>11.2f}{stats['median_us_per_train']:>9.2f}{stats['peak_bytes_per_train']:>10.0f}"
+                  f"{stats['retained_blocks']:>9}{comparison:>10}", flush=True)
+        gc.collect()
+    clock.use_real_time()
+
+    if args.save_baseline:
+        merged = dict(baseline)
+        merged.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": merged}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nsaved baseline to {args.baseline}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        if args.check: sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,22 +9,20 @@ load_dotenv()
 # --- これ以降に、他のimport文を続ける ---
 import nextcord as discord
 import asyncio
-from flask import Flask
+from flask import Flask, jsonify
 from threading import Thread
 import unicodedata # ★★★ これが抜けてる ★★★
 from datetime import datetime
 
-from jr_east_detector import check_jr_east_irregularities
-from tama_monorail_info_detector import check_tama_monorail_info
-from tokyo_metro_detector import check_tokyo_metro_info
-
-from toei_delay_watcher import check_toei_delay_increase
-from toei_detector import check_toei_irregularities
-from jr_east_info_detector import check_jr_east_info
-from jr_east_delay_watcher import check_delay_increase
-from tobu_delay_watcher import check_tobu_delay_increase
-from jr_destination_predictor import check_destination_predictions 
-from toei_info_detector import check_toei_info, get_current_official_info as get_current_toei_official_info
+from toei_info_detector import get_current_official_info as get_current_toei_official_info
+import odpt_client
+import train_snapshot
+import periodic_checks
+import last_good
+import train_information
+import notified_store
+import detector_state
+import delay_tracker
 
 
 load_dotenv()
@@ -36,6 +34,24 @@ NOTIFICATION_CHANNEL_ID = int(os.getenv('NOTIFICATION_CHANNEL_ID'))
 app = Flask('')
 @app.route('/')
 def home(): return "Bot is alive!"
+@app.route('/status')
+def status():
+    # ODPTへの接続の使い回し状況などを確認するための窓口
+    return jsonify({
+        "connections": odpt_client.get_connection_stats(),
+        "breakers": odpt_client.get_breaker_stats(),
+        "budgets": odpt_client.get_budget_stats(), # トークンごとの呼び出し回数 (直近1分・今日) と予算の残り
+        "last_cycle": periodic_checks.last_cycle_report,
+        "schedule": periodic_checks.get_schedule_stats(),
+        "freshness": train_snapshot.get_freshness_stats(),
+        "not_modified": odpt_client.get_not_modified_stats(),
+        "last_good": last_good.get_stats(), # 取得に失敗したときに代用する前回データと、その古さ
+        "train_information": train_information.get_stats(), # メトロ・都営・多摩モノ運行情報のまとめ取り
+        "recorder": odpt_client.get_recorder_stats(), # 応答の録画 (ODPT_RECORD_DIR 設定時のみ)
+        "notified": notified_store.get_stats(), # 非定期検知の通知済みの記録 (件数・期限切れ・運行日)
+        "state": detector_state.get_stats(), # 検知の状態の保存 (回数・大きさ) と、起動時の復元にかかった時間
+        "delay_watch": delay_tracker.get_stats(), # 遅延監視の追跡数と、NumPy の一括モードで見た回数
+    })
 def run(): app.run(host='0.0.0.0', port=8080)
 def keep_alive():
     t = Thread(target=run)
@@ -47,11 +63,17 @@ intents.guilds = True
 intents.messages = True
 bot = discord.Client(intents=intents)
 
+_periodic_task = None # 動いている periodic_check (再接続のたびに on_ready が来ても、ループは1つだけ)
+
 # --- on_ready イベントに目印を追加 ---
 @bot.event
 async def on_ready():
+    global _periodic_task
     print(f"--- [2] EVENT: on_ready - Logged in as {bot.user} ---", flush=True)
-    bot.loop.create_task(periodic_check())
+    if _periodic_task is not None and not _periodic_task.done():
+        print("--- [3] TASK: periodic_check is already running (reconnected). ---", flush=True)
+        return
+    _periodic_task = bot.loop.create_task(periodic_check())
     print("--- [3] TASK: periodic_check has been created. ---", flush=True)
 
 # --- periodic_check 関数に目印を追加 ---
@@ -62,64 +84,13 @@ async def periodic_check():
         print(f"エラー: チャンネルID {NOTIFICATION_CHANNEL_ID} が見つかりません。")
         return
 
+    detector_state.restore() # 最初のティックの前に、前回までの検知の状態を戻す
     while not bot.is_closed():
-        all_notifications = []
-        official_info = {}
-
-        # 1. JR東 非定期
-        jr_messages = await bot.loop.run_in_executor(None, check_jr_east_irregularities)
-        if jr_messages: all_notifications.extend(jr_messages)
-
-        # 2. JR東 運行情報
-        result = await bot.loop.run_in_executor(None, check_jr_east_info)
-        if result:
-            jr_info_messages, official_info = result # ★ 戻り値を2つ受け取る
-            if jr_info_messages:
-                all_notifications.extend(jr_info_messages)
-        # (もし result が None (失敗) だったら、official_info は空のまま)
-        
-        # 3. 都営 非定期
-        toei_messages = await bot.loop.run_in_executor(None, check_toei_irregularities)
-        if toei_messages: all_notifications.extend(toei_messages)
-
-        # 4. 多摩モノ 運行情報
-        tama_message = await bot.loop.run_in_executor(None, check_tama_monorail_info)
-        if tama_message: all_notifications.append(tama_message)
-
-        # 5. 東京メトロ 運行情報
-        metro_messages = await bot.loop.run_in_executor(None, check_tokyo_metro_info)
-        if metro_messages: all_notifications.extend(metro_messages)
-
-        # 6. JR東日本 遅延増加監視
-        delay_watcher_messages = await bot.loop.run_in_executor(None, check_delay_increase, official_info)
-        if delay_watcher_messages:
-            all_notifications.extend(delay_watcher_messages)
-        
-        # 7. 都営 遅延増加監視 
-        toei_delay_messages = await bot.loop.run_in_executor(None, check_toei_delay_increase)
-        if toei_delay_messages:
-            all_notifications.extend(toei_delay_messages)
-
-        # 8. 東武 遅延増加監視 ---
-        tobu_delay_messages = await bot.loop.run_in_executor(None, check_tobu_delay_increase)
-        if tobu_delay_messages:
-            all_notifications.extend(tobu_delay_messages)
-
-        #9. JR 行先変更予測 ---
-        dest_pred_messages = await bot.loop.run_in_executor(None, check_destination_predictions)
-        if dest_pred_messages:
-            all_notifications.extend(dest_pred_messages)
-
-        if all_notifications:
-            for msg in all_notifications:
-                await channel.send(msg)
-        await asyncio.sleep(12)
-
-        #10. 都営 運行情報 ---
-        toei_result = await bot.loop.run_in_executor(None, check_toei_info)
-        if toei_result:
-            toei_info_messages, toei_official_info = toei_result
-            if toei_info_messages: all_notifications.extend(toei_info_messages)
+        # 期限が来たチェックだけを同時に実行 (周期はチェックごとに periodic_checks で登録)
+        all_notifications = await periodic_checks.run_due_checks()
+        await periodic_checks.send_notifications(channel, all_notifications)
+        await detector_state.save_if_due()
+        await asyncio.sleep(periodic_checks.seconds_until_next_due())
 
 # (Botの起動部分は変更なし)
 keep_alive()
@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from typing import Dict, Any, Optional
+
+import requests
+
+# ---------------------------------------------------------------
+# ▼▼▼ 取得先ごとのサーキットブレーカー ▼▼▼
+# ---------------------------------------------------------------
+# api-challenge.odpt.org が不調なときに、JR系の検知が毎サイクル
+# 30〜45秒のタイムアウトまで粘り続けないようにする。
+# 失敗が続いたら「開」にして、しばらくは通信せずにすぐ失敗を返す。
+# 待ち時間は開くたびに倍々 (ゆらぎ付き) で延ばし、時間が来たら
+# 1本だけ様子見 (半開) を通して、成功すれば元に戻す。
+
+# --- 設定値 ---
+FAILURE_THRESHOLD = 3   # 連続でこれだけ失敗したら開く
+BASE_BACKOFF = 15.0     # 1回目に開いたときの待ち時間 (秒)
+MAX_BACKOFF = 300.0     # 待ち時間の上限 (秒)
+JITTER = 0.2            # 待ち時間のゆらぎ (±20%)。複数の取得先が同時に再開しないように
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """ブレーカーが開いているので通信しなかった (既存の except RequestException で受けられる)"""
+
+
+class CircuitBreaker:
+    """1つの取得先 (ホスト × エンドポイント × トークン) のブレーカー"""
+    __slots__ = ("name", "state", "failures", "open_count", "retry_at", "probe_in_flight",
+                 "rejected", "last_error", "_lock")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0          # 連続失敗回数
+        self.open_count = 0        # 閉じてから何回続けて開いたか (待ち時間の倍数に使う)
+        self.retry_at = 0.0        # 開いている間、次に様子見してよい時刻 (time.monotonic)
+        self.probe_in_flight = False
+        self.rejected = 0          # 開いていたので通さなかった回数
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def before_request(self) -> None:
+        """通信の前に呼ぶ。通してはいけなければ CircuitOpenError を投げる。"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now >= self.retry_at:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+                print(f"--- [BREAKER] {self.name}: half-open, sending a probe ---", flush=True)
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True # 様子見は1本だけ
+                return
+            self.rejected += 1
+            wait = max(self.retry_at - now, 0)
+        raise CircuitOpenError(f"circuit open for {self.name} (retry in {wait:.0f}s)")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"--- [BREAKER] {self.name}: closed (recovered) ---", flush=True)
+            self.state = CLOSED
+            self.failures = 0
+            self.open_count = 0
+            self.probe_in_flight = False
+
+    def record_failure(self, error: Any) -> None:
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)[:200]
+            if self.state == HALF_OPEN or self.failures >= FAILURE_THRESHOLD:
+                self._open()
+
+    def release(self) -> None:
+        """成功とも失敗とも言えずに終わった (キャンセルなど) とき。様子見の枠だけ返す。"""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def _open(self) -> None:
+        backoff = min(BASE_BACKOFF * (2 ** self.open_count), MAX_BACKOFF)
+        backoff *= random.uniform(1 - JITTER, 1 + JITTER)
+        self.open_count += 1
+        self.state = OPEN
+        self.probe_in_flight = False
+        self.retry_at = time.monotonic() + backoff
+        print(f"--- [BREAKER] {self.name}: OPEN for {backoff:.0f}s after {self.failures} failures ({self.last_error}) ---", flush=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "open_count": self.open_count,
+                "retry_in": round(max(self.retry_at - time.monotonic(), 0), 1) if self.state == OPEN else 0,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+            }
+
+
+def is_breaker_failure(error: BaseException) -> bool:
+    """取得先の不調とみなす失敗か (タイムアウト・接続失敗・5xx・429)。トークン間違いなどは数えない。"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        if error.response is None: return True
+        return is_breaker_status(error.response.status_code)
+    return False
+
+
+def is_breaker_status(status: int) -> bool:
+    return status >= 500 or status == 429
@@ -0,0 +1,38 @@
+import time as _time
+from datetime import datetime, tzinfo
+from typing import Optional
+
+# ---------------------------------------------------------------
+# ▼▼▼ 時計 (本番は実時間、再生時は仮想時間) ▼▼▼
+# ---------------------------------------------------------------
+# 検知のクールダウンや古い記録の掃除は「今の時刻」で決まる。
+# 録画した通信を再生するとき (replay.py) は、録画時の取得時刻を
+# 仮想の「今」として進めるので、検知側は time.time() / datetime.now() の
+# 代わりにここを読む。仮想時間を設定していなければ実時間そのまま。
+
+_virtual_now: Optional[float] = None
+
+
+def time() -> float:
+    """今のUNIX時刻 (仮想時間を使っていればそちら)"""
+    return _time.time() if _virtual_now is None else _virtual_now
+
+
+def now(tz: Optional[tzinfo] = None) -> datetime:
+    """datetime.now(tz) の代わり"""
+    return datetime.fromtimestamp(time(), tz)
+
+
+def set_virtual_time(timestamp: float) -> None:
+    """仮想時間に切り替えて、指定の時刻にする (以後は set するまで止まったまま)"""
+    global _virtual_now
+    _virtual_now = timestamp
+
+
+def use_real_time() -> None:
+    global _virtual_now
+    _virtual_now = None
+
+
+def is_virtual() -> bool:
+    return _virtual_now is not None
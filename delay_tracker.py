@@ -0,0 +1,366 @@
+import os
+from itertools import repeat
+from operator import attrgetter
+from typing import Dict, Any, List, Optional
+
+import clock
+import snapshot_diff
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# ---------------------------------------------------------------
+# ▼▼▼ 遅延監視の共通エンジン (JR・都営・東武で同じ追跡処理を使う) ▼▼▼
+# ---------------------------------------------------------------
+# 「同じ場所で遅延が増え続ける列車」を追う流れ (追跡開始 → 増えたら数える →
+# 動いた/回復したらリセット → 見かけなくなったら掃除) は3つの監視で同じなので、ここにまとめる。
+# 追跡中の列車は辞書ではなく __slots__ の小さな記録で持ち、スナップショットは1回なめるだけ。
+# 事業者ごとの違い (通知の判定と文章、公式情報との突き合わせ、集団遅延の分析、折返し予測) は
+# DelayTracker を継承して on_* を上書きして差し込む。
+# 前回見たスナップショットからの差分 (snapshot_diff) が作ってあり、列車が多くて追跡中の列車が少ない回は、
+# 追跡中・変化した列車だけを見る (_update_changes)。乱れて追跡中が多い回や小さい回は、全部なめる方が速い。
+# 差分が無い回は、NumPy が入っていれば大きなスナップショットは一括モードで見る (_update_batch)。
+
+# --- 設定値 (各監視モジュールから上書きして使う) ---
+DELAY_THRESHOLD_SECONDS = 3 * 60    # これ以上遅れている列車を追跡する
+CLEANUP_THRESHOLD_SECONDS = 15 * 60 # これだけ見かけなかった追跡は捨てる
+BATCH_MODE = os.getenv('DELAY_WATCH_BATCH', "auto") # "auto": NumPy が入っていれば一括モード / "off": 使わない
+BATCH_MIN_TRAINS = 2000             # これより少ない回は1本ずつ見る方が速い
+BATCH_MAX_CANDIDATE_SHARE = 0.25    # 閾値を超える列車がこの割合より多い回も1本ずつ見る
+BATCH_SAMPLE_STEP = 16              # その割合は、この本数に1本の抜き取りで見積もる
+DELTA_MIN_TRAINS = 1000             # 差分だけ見るのは、この本数以上の回だけ (小さい回は路線ごとの手間の方がかさむ)
+DELTA_MAX_TRACKED_SHARE = 0.1       # 追跡中 (+追跡し直し) がこの割合より多い回は、差分があっても全部なめる
+
+_train_number = attrgetter("train_number")
+_delay = attrgetter("delay")
+
+
+def batch_enabled() -> bool:
+    return numpy is not None and BATCH_MODE != "off"
+
+
+_trackers: Dict[str, "DelayTracker"] = {}
+
+
+def get_stats() -> Dict[str, Any]:
+    """/status 用。一括モードが使えるかと、監視ごとの追跡数・どちらで見た回数"""
+    return {
+        "batch": "numpy" if batch_enabled() else "off",
+        "trackers": {name: tracker.snapshot() for name, tracker in list(_trackers.items())},
+    }
+
+
+class TrackedTrain:
+    """追跡中の1本 (旗は通知の種類ごと。使わない事業者では False のまま)"""
+    __slots__ = ("line_id", "last_location_id", "last_delay", "consecutive_increase_count",
+                 "last_seen_time", "tracking_start_time", "direction",
+                 "notified_initial", "is_main_culprit", "notified_escalated",
+                 "notified_resumed", "notified_predicted")
+
+    def __init__(self, line_id: str, location_id: str, delay: int, now: float, direction: Optional[str] = None):
+        self.line_id = line_id
+        self.last_location_id = location_id
+        self.last_delay = delay
+        self.consecutive_increase_count = 1
+        self.last_seen_time = now
+        self.tracking_start_time = now # 監視開始時刻 (発生時刻の推定に使う)
+        self.direction = direction
+        self.notified_initial = False
+        self.is_main_culprit = False
+        self.notified_escalated = False
+        self.notified_resumed = False
+        self.notified_predicted = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        """保存用 (detector_state)"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TrackedTrain":
+        """to_dict() したもの (と、以前の辞書形式の保存) から戻す。足りない項目は新規追跡と同じ値"""
+        record = cls(data["line_id"], data["last_location_id"], data["last_delay"], data["last_seen_time"], data.get("direction"))
+        for name in cls.__slots__:
+            if name in data and data[name] is not None: setattr(record, name, data[name])
+        return record
+
+    def __repr__(self) -> str:
+        return f"TrackedTrain({self.to_dict()!r})"
+
+
+class DelayCycle:
+    """1回の process() の間だけ使う入れ物 (フックに渡す)"""
+    __slots__ = ("snapshot", "now", "messages", "context")
+
+    def __init__(self, snapshot: Any, now: float, context: Any):
+        self.snapshot = snapshot
+        self.now = now
+        self.messages: List[str] = []
+        self.context = context
+
+
+class DelayTracker:
+    """
+    1事業者分の追跡エンジン。process(snapshot) でスナップショットを1回なめ、通知メッセージのリストを返す。
+    追跡中の列車は self.tracked (列番 → TrackedTrain)。各監視モジュールはこれを tracked_delayed_trains として公開する。
+    """
+
+    def __init__(self, name: str, delay_threshold: int = DELAY_THRESHOLD_SECONDS, cleanup_seconds: float = CLEANUP_THRESHOLD_SECONDS):
+        self.name = name
+        self.delay_threshold = delay_threshold
+        self.cleanup_seconds = cleanup_seconds
+        self.tracked: Dict[str, TrackedTrain] = {}
+        self.batch_cycles = 0   # 一括モードで見た回数
+        self.python_cycles = 0  # 1本ずつ見た回数 (小さい回・乱れが大きい回・同じ列番がある回)
+        self.delta_cycles = 0   # 差分だけ見た回数
+        # --- 差分で見るための記録 ---
+        self._generation: Optional[int] = None # 最後に見終えたスナップショットの差分の generation
+        self._tracked_count = 0                # そのときの追跡数 (外から入れ替えられたら全部見直す)
+        self._retrack: set = set()             # 前回、閾値以上なのに追跡にならなかった列番 (「動いた」でリセットした・駅が無かった)
+        _trackers[name] = self
+        # --- 一括モードの表 (追跡中の列番ごとに1行。中身は tracked の記録の写し) ---
+        self._slot_of: Dict[str, int] = {}        # 列番 → 行
+        self._free_slots: List[int] = []
+        self._location_code: Dict[str, int] = {}  # 駅ID → 番号 (配列で比べられるように)
+        self._slot_location: Any = None           # 行ごとの last_location_id の番号
+        self._slot_delay: Any = None              # 行ごとの last_delay
+        self._slots_valid = False                 # 前回も一括モードで、表が tracked と合っているか
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"tracked": len(self.tracked), "batch_cycles": self.batch_cycles, "python_cycles": self.python_cycles,
+                "delta_cycles": self.delta_cycles}
+
+    # --- フック (事業者ごとに上書きする。どれも通知は cycle.messages に足す) ---
+    def on_start(self, cycle: DelayCycle, train_number: str, record: TrackedTrain) -> None:
+        """新しく追跡を始めた"""
+
+    def on_increase(self, cycle: DelayCycle, train_number: str, record: TrackedTrain, train: Any) -> None:
+        """同じ場所で遅延が増えた (カウントと last_delay は更新済み)"""
+
+    def on_stable(self, cycle: DelayCycle, train_number: str, record: TrackedTrain, train: Any) -> None:
+        """同じ場所で遅延が横ばい or 微減"""
+
+    def on_reset(self, cycle: DelayCycle, train_number: str, record: TrackedTrain, train: Any, moved: bool, recovered: bool) -> None:
+        """動いた or 遅延が回復した (この後、追跡から外す)"""
+
+    def on_expire(self, cycle: DelayCycle, train_number: str, record: TrackedTrain) -> None:
+        """しばらく見かけなかった (この後、追跡から外す)"""
+
+    # --- 本体 ---
+    def process(self, snapshot: Any, context: Any = None) -> List[str]:
+        cycle = DelayCycle(snapshot, clock.time(), context) # 再生時は仮想時間
+        trains = snapshot.trains
+        # 途中で失敗したら、次の回は差分を使わずに全部見る
+        generation, self._generation = self._generation, None
+        retrack, self._retrack = self._retrack, set()
+        changes = snapshot_diff.changes_since(snapshot, generation, compute=False) # 作るより1本ずつ見る方が安いので、作ってあるときだけ
+        if (changes is not None and changes.complete and len(self.tracked) == self._tracked_count
+                and len(trains) >= DELTA_MIN_TRAINS
+                and len(self.tracked) + len(retrack) <= len(trains) * DELTA_MAX_TRACKED_SHARE):
+            self._update_changes(cycle, trains, changes, retrack)
+        elif len(trains) >= BATCH_MIN_TRAINS and batch_enabled():
+            self._update_batch(cycle, trains)
+        else:
+            self._update(cycle, trains)
+        self._cleanup(cycle)
+        self._generation = snapshot_diff.generation_of(snapshot)
+        self._tracked_count = len(self.tracked)
+        return cycle.messages
+
+    def _update(self, cycle: DelayCycle, trains: Any) -> None:
+        """1本ずつ順に見る"""
+        self.python_cycles += 1
+        self._visit(cycle, trains)
+
+    def _update_changes(self, cycle: DelayCycle, trains: Any, changes: "snapshot_diff.SnapshotDiff", retrack: set) -> None:
+        """
+        差分だけ見る。1本ずつ見たときに何か起きるのは「追跡中」か「閾値以上」の列車だけで、
+        遅延が変わっていない閾値以上の列車は、前回の時点で追跡中になっている
+        (例外は前回リセットしたものと駅が無くて飛ばしたもの = retrack)。なので 追跡中 + retrack +
+        出現・遅延の変化のうち閾値以上 の列車を、元の並び順で _visit に渡せば結果は同じになる。
+        """
+        self.delta_cycles += 1
+        threshold = self.delay_threshold
+        rows = changes.rows
+        candidates = {row for row in map(rows.get, self.tracked) if row is not None}
+        candidates.update(row for row in map(rows.get, retrack) if row is not None)
+        for line_changes in changes.railways.values():
+            for changed in (line_changes.appeared, line_changes.delay_changed):
+                candidates.update(rows[train.train_number] for train in changed if train.delay >= threshold)
+        self._visit(cycle, [trains[row] for row in sorted(candidates)])
+
+    def _visit(self, cycle: DelayCycle, trains: Any) -> None:
+        """渡された列車を1本ずつ順に見る"""
+        self._slots_valid = False # 一括モードの表は更新しないので、次に使うときは作り直す
+        now = cycle.now
+        tracked = self.tracked
+        threshold = self.delay_threshold
+
+        for train in trains:
+            train_number = train.train_number
+            line_id = train.railway
+            location_id = train.to_station or train.from_station
+            delay = train.delay
+            if not (train_number and line_id and location_id):
+                if train_number and delay >= threshold: self._retrack.add(train_number)
+                continue
+
+            record = tracked.get(train_number)
+            if record is None:
+                # ▼▼▼ 新規追跡 ▼▼▼
+                if delay >= threshold:
+                    record = tracked[train_number] = TrackedTrain(line_id, location_id, delay, now, train.rail_direction)
+                    self.on_start(cycle, train_number, record)
+                continue
+
+            moved = location_id != record.last_location_id
+            recovered = delay < threshold
+            if moved or recovered:
+                # ▼▼▼ リセット ▼▼▼
+                self.on_reset(cycle, train_number, record, train, moved, recovered)
+                del tracked[train_number]
+                if not recovered: self._retrack.add(train_number)
+            elif delay > record.last_delay:
+                # ▼▼▼ 遅延増加 ▼▼▼
+                record.consecutive_increase_count += 1
+                record.last_delay = delay
+                record.last_seen_time = now
+                if train.rail_direction: record.direction = train.rail_direction
+                self.on_increase(cycle, train_number, record, train)
+            else:
+                record.last_seen_time = now
+                self.on_stable(cycle, train_number, record, train)
+
+    def _update_batch(self, cycle: DelayCycle, trains: Any) -> None:
+        """
+        NumPy で一括に見る。遅延と「追跡中か」を配列にして、追跡中でもなく閾値にも届かない列車
+        (ふだんはほとんど全部) を Python を通さずに落とし、残った行だけ配列の比較で
+        リセット / 増加 / 横ばいに分けてから、元の並び順でフックを呼ぶ (結果は _update と同じ)。
+        """
+        count = len(trains)
+        threshold = self.delay_threshold
+        sample = numpy.fromiter(map(_delay, trains[::BATCH_SAMPLE_STEP]), dtype=numpy.float64)
+        if numpy.count_nonzero(sample >= threshold) > len(sample) * BATCH_MAX_CANDIDATE_SHARE:
+            # 大規模な乱れで閾値を超える列車が多い回は、どのみち大半を Python で見るので1本ずつの方が速い
+            self._update(cycle, trains)
+            return
+        delays = numpy.fromiter(map(_delay, trains), dtype=numpy.float64, count=count)
+        above = delays >= threshold
+        numbers = list(map(_train_number, trains))
+        row_of = dict(zip(numbers, range(count)))
+        if len(row_of) != count:
+            # 同じ列番が2回出てくる回は、前の行の結果を後の行が見るので1本ずつ順に見る
+            self._update(cycle, trains)
+            return
+        tracked = self.tracked
+        if not self._slots_valid or self._slot_of.keys() != tracked.keys():
+            self._rebuild_slots() # 外から入れ替えられた (復元・1本ずつの回の後など)
+        self.batch_cycles += 1
+        now = cycle.now
+
+        # --- 追跡中の列車がどの行にいるか (追跡中の本数だけ Python で引く) ---
+        slots = numpy.full(count, -1, dtype=numpy.intp)
+        present = [(row, slot) for row, slot in zip(map(row_of.get, self._slot_of), self._slot_of.values()) if row is not None]
+        if present:
+            present_rows, present_slots = zip(*present)
+            slots[list(present_rows)] = present_slots
+        rows = numpy.flatnonzero(above | (slots >= 0))
+        if not len(rows): return
+
+        # --- 残った行だけ分類する ---
+        candidates = [trains[row] for row in rows.tolist()]
+        locations = [train.to_station or train.from_station for train in candidates]
+        location_code = self._location_code
+        codes = numpy.fromiter(map(location_code.get, locations, repeat(-1)), dtype=numpy.intp, count=len(rows))
+        row_slots = slots[rows]
+        row_delays = delays[rows]
+        is_tracked = row_slots >= 0
+        safe_slots = numpy.where(is_tracked, row_slots, 0)
+        moved = is_tracked & (codes != self._slot_location[safe_slots])
+        recovered = is_tracked & (row_delays < threshold)
+        increased = is_tracked & ~moved & ~recovered & (row_delays > self._slot_delay[safe_slots])
+
+        # 配列への書き込みは最後にまとめて行う (分類は上で済んでいるので、ループの途中では読まない)
+        written_slots: List[int] = []
+        written_codes: List[int] = []
+        written_delays: List[float] = []
+        slot_of = self._slot_of
+        free_slots = self._free_slots
+        for train, location_id, code, slot, is_moved, is_recovered, is_increased in zip(
+                candidates, locations, codes.tolist(), row_slots.tolist(), moved.tolist(), recovered.tolist(), increased.tolist()):
+            train_number = train.train_number
+            if not (train_number and train.railway and location_id):
+                if train_number and train.delay >= threshold: self._retrack.add(train_number)
+                continue
+            if slot < 0:
+                # ▼▼▼ 新規追跡 ▼▼▼
+                record = tracked[train_number] = TrackedTrain(train.railway, location_id, train.delay, now, train.rail_direction)
+                if not free_slots: self._grow_slots()
+                slot = slot_of[train_number] = free_slots.pop()
+                if code < 0:
+                    code = location_code.setdefault(location_id, len(location_code))
+                written_slots.append(slot); written_codes.append(code); written_delays.append(train.delay)
+                self.on_start(cycle, train_number, record)
+                continue
+
+            record = tracked[train_number]
+            if is_moved or is_recovered:
+                # ▼▼▼ リセット ▼▼▼
+                self.on_reset(cycle, train_number, record, train, is_moved, is_recovered)
+                del tracked[train_number]
+                free_slots.append(slot_of.pop(train_number))
+                if not is_recovered: self._retrack.add(train_number)
+            elif is_increased:
+                # ▼▼▼ 遅延増加 ▼▼▼
+                record.consecutive_increase_count += 1
+                record.last_delay = train.delay
+                record.last_seen_time = now
+                if train.rail_direction: record.direction = train.rail_direction
+                written_slots.append(slot); written_codes.append(code); written_delays.append(train.delay)
+                self.on_increase(cycle, train_number, record, train)
+            else:
+                record.last_seen_time = now
+                self.on_stable(cycle, train_number, record, train)
+
+        if written_slots:
+            self._slot_location[written_slots] = written_codes
+            self._slot_delay[written_slots] = written_delays
+
+    # --- 一括モードの表の管理 ---
+    def _rebuild_slots(self) -> None:
+        size = max(64, 2 * len(self.tracked))
+        self._slot_of = {}
+        self._free_slots = list(range(size - 1, -1, -1))
+        self._slot_location = numpy.full(size, -1, dtype=numpy.intp)
+        self._slot_delay = numpy.zeros(size, dtype=numpy.float64)
+        location_code = self._location_code
+        for train_number, record in self.tracked.items():
+            slot = self._slot_of[train_number] = self._free_slots.pop()
+            self._slot_location[slot] = location_code.setdefault(record.last_location_id, len(location_code))
+            self._slot_delay[slot] = record.last_delay
+        self._slots_valid = True
+
+    def _grow_slots(self) -> None:
+        """行が足りなくなったら倍に広げる"""
+        size = len(self._slot_delay)
+        self._slot_location = numpy.concatenate([self._slot_location, numpy.full(size, -1, dtype=numpy.intp)])
+        self._slot_delay = numpy.concatenate([self._slot_delay, numpy.zeros(size, dtype=numpy.float64)])
+        self._free_slots.extend(range(2 * size - 1, size - 1, -1))
+
+    def _release_slot(self, train_number: str) -> None:
+        slot = self._slot_of.pop(train_number, None)
+        if slot is not None: self._free_slots.append(slot)
+
+    def _cleanup(self, cycle: DelayCycle) -> None:
+        """古い記録の掃除"""
+        # 今回見かけた追跡は last_seen_time = now になっているので、
+        # 「今回見かけた列番」の集合を作らなくても時刻だけで見分けられる
+        tracked = self.tracked
+        now = cycle.now
+        cleanup_seconds = self.cleanup_seconds
+        expired = [train_number for train_number, record in tracked.items() if now - record.last_seen_time > cleanup_seconds]
+        for train_number in expired:
+            self.on_expire(cycle, train_number, tracked[train_number])
+            del tracked[train_number]
+            self._release_slot(train_number)
@@ -0,0 +1,185 @@
+import asyncio
+import atexit
+import importlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import notified_store
+from delay_tracker import TrackedTrain
+
+# ---------------------------------------------------------------
+# ▼▼▼ 検知の状態の保存と復元 (再起動しても同じ通知を出し直さない) ▼▼▼
+# ---------------------------------------------------------------
+# 遅延監視の追跡中の列車・クールダウン、運行情報の前回の文章、通知済みの記録などは
+# モジュールの変数にしか無いので、再起動すると全部消えて、続いている見合わせや
+# 走っている非定期列車を最初から通知し直していた。
+# ティックの後に一定間隔でまとめて1つのJSONファイルに書き (一時ファイルに書いてから
+# 置き換えるので、途中で落ちても壊れたファイルは残らない)、起動して最初のティックの前に戻す。
+
+# --- 設定値 ---
+STATE_FILE = os.getenv('DETECTOR_STATE_FILE', "detector_state.json") # 空にすると保存も復元もしない
+SAVE_INTERVAL = 30.0          # 保存の間隔 (秒)
+TRANSIENT_MAX_AGE = 15 * 60   # 追跡中の列車などは、これより古い保存からは戻さない (秒)
+RESTORE_TIME_BUDGET = 1.0     # 復元にかかってよい時間 (秒)。超えたら警告を出す
+
+FORMAT_VERSION = 1
+
+# (保存名, モジュール, 変数名, 古い保存からは戻さないか)
+# 追跡中の列車や「再開を通知した」旗は、しばらく止まっていた後だと実態と合わないので
+# TRANSIENT_MAX_AGE 以内の保存からしか戻さない。前回の文章やクールダウンは時刻付きなのでいつでも戻す。
+STATE_VARIABLES: List[Tuple[str, str, str, bool]] = [
+    ("jr_info.statuses", "jr_east_info_detector", "last_jr_east_statuses", False),
+    ("toei_info.statuses", "toei_info_detector", "last_toei_statuses", False),
+    ("metro_info.statuses", "tokyo_metro_detector", "last_metro_statuses", False),
+    ("tama_info.status", "tama_monorail_info_detector", "last_tama_monorail_status", False),
+    ("jr_delay.tracked", "jr_east_delay_watcher", "tracked_delayed_trains", True),
+    ("jr_delay.cooldown", "jr_east_delay_watcher", "line_cooldown_tracker", False),
+    ("jr_delay.resumption_notified", "jr_east_delay_watcher", "line_resumption_notified", True),
+    ("jr_delay.prediction_cooldown", "jr_east_delay_watcher", "line_prediction_cooldown_tracker", False),
+    ("toei_delay.tracked", "toei_delay_watcher", "tracked_delayed_trains", True),
+    ("toei_delay.cooldown", "toei_delay_watcher", "line_cooldown_tracker", False),
+    ("tobu_delay.tracked", "tobu_delay_watcher", "tracked_delayed_trains", True),
+    ("tobu_delay.cooldown", "tobu_delay_watcher", "line_cooldown_tracker", False),
+    ("dest_prediction.notified", "jr_destination_predictor", "notified_predictions", False),
+]
+# 値が delay_tracker.TrackedTrain の辞書 (保存するときは to_dict() した辞書にする)
+TRACKED_TRAIN_VARIABLES = {"jr_delay.tracked", "toei_delay.tracked", "tobu_delay.tracked"}
+NOTIFIED_KEY = "notified" # notified_store の記録 (運行日と期限は notified_store 側で見る)
+
+_restored = False         # 復元を試みるまでは保存しない (空の状態で上書きしないように)
+_last_saved = 0.0
+_save_lock = threading.Lock()
+_stats: Dict[str, Any] = {"file": STATE_FILE, "saves": 0, "save_errors": 0}
+
+
+def _copy_item(item: Any) -> Any:
+    if isinstance(item, TrackedTrain): return item.to_dict()
+    return dict(item) if isinstance(item, dict) else item
+
+
+def collect() -> Dict[str, Any]:
+    """今の状態を保存用の辞書にする (値はそのままJSONにできるものだけ)"""
+    variables: Dict[str, Any] = {}
+    for name, module_name, attribute, _ in STATE_VARIABLES:
+        module = importlib.import_module(module_name)
+        value = getattr(module, attribute)
+        # 解析スレッドがまだ書き換えている最中でも壊れないように、浅くコピーしてから渡す
+        variables[name] = {key: _copy_item(item) for key, item in list(value.items())} if isinstance(value, dict) else value
+    return {
+        "version": FORMAT_VERSION,
+        "saved_at": time.time(),
+        "variables": variables,
+        NOTIFIED_KEY: notified_store.export_all(),
+    }
+
+
+def write_atomically(path: str, payload: Dict[str, Any]) -> int:
+    """一時ファイルに書いて fsync してから置き換える。書いたバイト数を返す。"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    directory = os.path.dirname(os.path.abspath(path))
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    try:
+        # 置き換えたこと (ディレクトリの中身) も書き切る。できないOSでは諦める
+        descriptor = os.open(directory, os.O_RDONLY)
+        try: os.fsync(descriptor)
+        finally: os.close(descriptor)
+    except OSError:
+        pass
+    return len(body)
+
+
+def save(path: Optional[str] = None) -> bool:
+    """今の状態を保存する (復元を試みる前は何もしない)"""
+    global _last_saved
+    path = path or STATE_FILE
+    if not path or not _restored: return False
+    with _save_lock:
+        try:
+            size = write_atomically(path, collect())
+        except (OSError, TypeError, ValueError, RuntimeError) as e:
+            _stats["save_errors"] += 1
+            print(f"--- [STATE] ERROR: could not save detector state: {e!r}", flush=True)
+            return False
+        _last_saved = time.monotonic()
+        _stats.update(saves=_stats["saves"] + 1, last_saved_at=time.time(), bytes=size)
+    return True
+
+
+async def save_if_due() -> None:
+    """ティックの後に呼ぶ。SAVE_INTERVAL ごとに、書き込みは解析スレッドで行う"""
+    if not STATE_FILE or not _restored: return
+    if time.monotonic() - _last_saved < SAVE_INTERVAL: return
+    await asyncio.get_running_loop().run_in_executor(None, save)
+
+
+def _apply(module_name: str, attribute: str, value: Any) -> None:
+    module = importlib.import_module(module_name)
+    current = getattr(module, attribute)
+    if isinstance(current, dict) and isinstance(value, dict):
+        current.clear() # 他のモジュールが同じ辞書を持っていても効くように、入れ物はそのまま
+        current.update(value)
+    elif isinstance(value, type(current)):
+        setattr(module, attribute, value)
+
+
+def restore(path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    起動して最初のティックの前に呼ぶ。かかった時間などを返す (/status にも出る)。
+    2回目以降は何もしない (動いている状態を、古い保存で巻き戻さないように)。
+    """
+    global _restored, _last_saved
+    if _restored:
+        print("--- [STATE] restore skipped: state was already restored in this process ---", flush=True)
+        return _stats.get("restore", {"status": "already restored"})
+    path = path or STATE_FILE
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"restored": [], "skipped": []}
+    _restored = True
+    _last_saved = time.monotonic()
+    if not path or not os.path.exists(path):
+        result["status"] = "no saved state"
+    else:
+        try:
+            with open(path, "rb") as f:
+                payload = json.loads(f.read())
+            if payload.get("version") != FORMAT_VERSION: raise ValueError(f"unknown version {payload.get('version')}")
+            age = max(time.time() - payload["saved_at"], 0.0)
+            variables = payload.get("variables", {})
+            for name, module_name, attribute, transient in STATE_VARIABLES:
+                if name not in variables: continue
+                if transient and age > TRANSIENT_MAX_AGE:
+                    result["skipped"].append(name)
+                    continue
+                value = variables[name]
+                if name in TRACKED_TRAIN_VARIABLES:
+                    value = {key: TrackedTrain.from_dict(item) for key, item in value.items()}
+                _apply(module_name, attribute, value)
+                result["restored"].append(name)
+            notified_store.load_all(payload.get(NOTIFIED_KEY, {}))
+            result.update(status="ok", age=round(age, 1))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # 壊れていたら捨てて最初から (次の保存で上書きされる)
+            result["status"] = f"ignored: {e!r}"
+    seconds = time.perf_counter() - start
+    result["seconds"] = round(seconds, 4)
+    _stats["restore"] = result
+    print(f"--- [STATE] restore from {path or '-'}: {result['status']} in {seconds * 1000:.1f}ms "
+          f"({len(result['restored'])} restored, {len(result['skipped'])} skipped as too old) ---", flush=True)
+    if seconds > RESTORE_TIME_BUDGET:
+        print(f"--- [STATE] WARNING: restore took {seconds:.2f}s (budget {RESTORE_TIME_BUDGET:g}s) ---", flush=True)
+    return result
+
+
+def get_stats() -> Dict[str, Any]:
+    return dict(_stats)
+
+
+atexit.register(save) # 普通に終了するときも最新の状態を残す
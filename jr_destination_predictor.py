@@ -1,10 +1,15 @@
 import os
+import odpt_client
 import requests
 import re
 import time
-from typing import Dict, Any, List, Optional
+import clock
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple, Set
 from datetime import datetime, timezone, timedelta # ★ 曜日と日付の確認に必要
 import traceback
+import snapshot_diff
+from train_snapshot import get_train_snapshot, get_train_snapshot_async, JR_EAST_OPERATOR
 
 # --- 共通データのインポート ---
 try:
@@ -15,7 +20,7 @@ except ImportError:
     TRAIN_TYPE_NAMES = {'odpt.TrainType:JR-East.Rapid': '快速'} # 仮定義
 
 API_TOKEN = os.getenv('ODPT_TOKEN_CHALLENGE')
-API_ENDPOINT = "https://api-challenge.odpt.org/api/v4/odpt:Train" # 在線情報のエンドポイント
+API_ENDPOINT = f"{odpt_client.CHALLENGE_API_BASE}/odpt:Train" # 在線情報のエンドポイント
 JST = timezone(timedelta(hours=+9)) # 日本時間
 
 # --- 予測済みの通知を記録する辞書 ---
@@ -23,21 +28,38 @@ JST = timezone(timedelta(hours=+9)) # 日本時間
 # 値: UNIXタイムスタンプ (古い記録を掃除するため)
 notified_predictions: Dict[str, float] = {}
 
+# --- 前回ルールに当たった列番 (遅延・行先が変わっていなくても毎回見直す。通知済みのキーは日付ごとなので) ---
+# それ以外の列車は、前回からの差分で出現・遅延・種別や行先の変化があったものだけ見る
+_matching_trains: Set[str] = set()
+_matching_generation: Optional[int] = None # どのスナップショットまで見たか (snapshot_diff の generation)
+
 # --- 設定値 ---
 PREDICTION_DELAY_THRESHOLD = 30 * 60 # 30分 (1800秒)
 
+CHUO_RAPID_LINE_ID = "odpt.Railway:JR-East.ChuoRapid" # 予測の対象路線
+
+
+def _changed_trains(train_data, changes) -> List[Any]:
+    """前回ルールに当たった列車と、ルールの結果が変わりうる列車 (出現・遅延や行先の変化) だけを並び順で返す"""
+    positions = changes.positions
+    for train in changes.vanished: _matching_trains.discard(train.train_number)
+    targets = {positions[train_number] for train_number in _matching_trains if train_number in positions}
+    for changed in (changes.appeared, changes.delay_changed, changes.retyped):
+        targets.update(positions[train.train_number] for train in changed)
+    return [train_data[position] for position in sorted(targets)]
+
 # --- メイン関数 ---
 # --- メイン関数 (お試しルール追加版) ---
-def check_destination_predictions() -> Optional[List[str]]:
+def check_destination_predictions(snapshot=None) -> Optional[List[str]]:
     """
     特定の条件を満たした列車の行先変更を予測し、通知メッセージのリストを返す。
     """
-    global notified_predictions
+    global notified_predictions, _matching_generation
     notification_messages: List[str] = []
-    current_time = time.time()
+    current_time = clock.time() # 再生時は仮想時間
     
     # --- 曜日と日付を取得 ---
-    now_jst = datetime.now(JST)
+    now_jst = clock.now(JST)
     today_weekday = now_jst.weekday() # 0=月, 1=火, ..., 5=土, 6=日
     today_date_str = now_jst.strftime('%Y-%m-%d')
     
@@ -46,17 +68,24 @@ def check_destination_predictions() -> Optional[List[str]]:
     is_holiday = today_weekday >= 5
 
     try:
-        # 1. 中央線快速の在線データを取得
-        params = {"odpt:railway": "odpt.Railway:JR-East.ChuoRapid", "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=45)
-        response.raise_for_status()
-        train_data = response.json()
-        if not isinstance(train_data, list): return None
+        # 1. 中央線快速の在線データを取得 (サイクル共通のスナップショットから切り出す)
+        if snapshot is None:
+            snapshot = get_train_snapshot(JR_EAST_OPERATOR)
+        if snapshot is None: return None
+        if snapshot.unchanged: return [] # 前回からデータが更新されていない
+        train_data = snapshot.for_railway(CHUO_RAPID_LINE_ID)
+        changes = snapshot_diff.changes_since(snapshot, _matching_generation)
+        _matching_generation = None # 途中で失敗したら、次の回は全部見直す
+        line_changes = changes.for_railway(CHUO_RAPID_LINE_ID) if changes is not None else None
+        if line_changes is not None:
+            train_data = _changed_trains(train_data, line_changes)
+        else:
+            _matching_trains.clear() # 前回からの差分が無い (初回・列番の重なりなど) ので全部見る
 
         for train in train_data:
-            train_number: Optional[str] = train.get("odpt:trainNumber")
-            current_delay: int = train.get("odpt:delay", 0)
-            dest_station_id_list: Optional[List[str]] = train.get("odpt:destinationStation")
+            train_number: Optional[str] = train.train_number
+            current_delay: int = train.delay
+            dest_station_id_list: Optional[Tuple[str, ...]] = train.destination_station
             
             if not all([train_number, dest_station_id_list]): continue
             
@@ -84,6 +113,9 @@ def check_destination_predictions() -> Optional[List[str]]:
                 new_destination_jp = "四方津"
             # ▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲
 
+            if prediction_key: _matching_trains.add(train_number)
+            else: _matching_trains.discard(train_number)
+
             # --- 3. 通知作成 ---
             if prediction_key and prediction_key not in notified_predictions:
                 try:
@@ -129,6 +161,7 @@ def check_destination_predictions() -> Optional[List[str]]:
         for key in keys_to_remove:
             del notified_predictions[key]
 
+        _matching_generation = snapshot_diff.generation_of(snapshot)
         return notification_messages
 
     except requests.exceptions.RequestException as req_err:
@@ -137,4 +170,11 @@ def check_destination_predictions() -> Optional[List[str]]:
     except Exception as e:
         print(f"--- [DEST PRED] ERROR: Unexpected error: {e}", flush=True)
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+async def check_destination_predictions_async() -> Optional[List[str]]:
+    # 通信はイベントループ上で待ち、判定処理だけをスレッドに回す
+    snapshot = await get_train_snapshot_async(JR_EAST_OPERATOR)
+    if snapshot is None: return None
+    if snapshot.unchanged: return []
+    return await asyncio.get_running_loop().run_in_executor(None, check_destination_predictions, snapshot)
\ No newline at end of file
@@ -1,10 +1,16 @@
 import os
+import odpt_client
 import requests
 import re
 import time
+import clock
+import last_good
+import asyncio
 import traceback # エラーの詳細表示のためにインポート
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timezone, timedelta
+from train_snapshot import get_train_snapshot, get_train_snapshot_async, JR_EAST_OPERATOR
+from delay_tracker import DelayTracker, TrackedTrain
 JST = timezone(timedelta(hours=+9))
 
 # --- 共通データのインポート ---
@@ -28,10 +34,8 @@ except ImportError:
      RAIL_DIRECTION_NAMES = {}
 
 API_TOKEN = os.getenv('ODPT_TOKEN_CHALLENGE')
-API_ENDPOINT = "https://api-challenge.odpt.org/api/v4/odpt:Train" # 在線情報のエンドポイント
+API_ENDPOINT = f"{odpt_client.CHALLENGE_API_BASE}/odpt:Train" # 在線情報のエンドポイント
 
-# --- 監視対象の列車情報を保持する辞書 ---
-tracked_delayed_trains: Dict[str, Dict[str, Any]] = {}
 # --- 路線ごとの通知クールダウン用辞書 ---
 line_cooldown_tracker: Dict[str, float] = {}
 # --- 路線ごとの「再開通知済み」フラグ ---
@@ -77,7 +81,7 @@ def _analyze_group_delay(line_id: str, line_name_jp: str, all_trains_on_line: Li
     
     station_delay_map: Dict[int, List[Dict[str, Any]]] = {}
     for train in all_trains_on_line:
-        location_id = train.get("odpt:toStation") or train.get("odpt:fromStation")
+        location_id = train.to_station or train.from_station
         if not location_id: continue
         station_en = location_id.split('.')[-1]
         station_jp = STATION_DICT.get(station_en, station_en)
@@ -96,9 +100,9 @@ def _analyze_group_delay(line_id: str, line_name_jp: str, all_trains_on_line: Li
         is_delayed_station = False
         if trains_at_this_station:
             for train in trains_at_this_station:
-                train_number = train.get("odpt:trainNumber")
-                if train_number in tracked_delayed_trains and \
-                   tracked_delayed_trains[train_number]["consecutive_increase_count"] >= GROUP_ANALYSIS_THRESHOLD:
+                train_number = train.train_number
+                record = tracked_delayed_trains.get(train_number)
+                if record is not None and record.consecutive_increase_count >= GROUP_ANALYSIS_THRESHOLD:
                     is_delayed_station = True; break
         if is_delayed_station:
             grace_count = 0
@@ -123,17 +127,18 @@ def _analyze_group_delay(line_id: str, line_name_jp: str, all_trains_on_line: Li
     suspicious_train_numbers: List[str] = []
 
     for train in main_cluster["trains"]:
-        if train.get("odpt:railDirection"): directions_set.add(train["odpt:railDirection"])
-        if train.get("odpt:delay", 0) > max_delay: max_delay = train.get("odpt:delay", 0)
-        train_number = train.get("odpt:trainNumber")
-        if train_number in tracked_delayed_trains:
-            count = tracked_delayed_trains[train_number]["consecutive_increase_count"]
+        if train.rail_direction: directions_set.add(train.rail_direction)
+        if train.delay > max_delay: max_delay = train.delay
+        train_number = train.train_number
+        record = tracked_delayed_trains.get(train_number)
+        if record is not None:
+            count = record.consecutive_increase_count
             if count >= GROUP_ANALYSIS_THRESHOLD:
                  suspicious_train_numbers.append(train_number)
             if count > main_culprit_count:
                 main_culprit_count = count
                 main_culprit_train_number = train_number
-                cause_location_id = train.get("odpt:toStation") or train.get("odpt:fromStation")
+                cause_location_id = train.to_station or train.from_station
 
     direction_text = "上下線"
     if "odpt.RailDirection:Inbound" in directions_set and "odpt.RailDirection:Outbound" in directions_set: direction_text = "上下線"
@@ -185,270 +190,212 @@ def _get_resume_prediction_text(line_id: str, line_info: Dict[str, Any], max_del
             return f"\n運転再開予測 {predicted_time_str}頃"
     return ""
 
-# --- メイン関数 (全機能・統合版) ---
-def check_delay_increase(official_info: Dict[str, Dict[str, Any]]) -> Optional[List[str]]:
-    global tracked_delayed_trains, line_cooldown_tracker, line_resumption_notified
-    notification_messages: List[str] = []
-    current_time = time.time()
-    trains_found_this_cycle: set = set()
+def _event_time_text(record: TrackedTrain) -> str:
+    """発生時刻 (監視開始の3分前と仮定) の「HH:MM頃、」"""
+    if not record.tracking_start_time: return ""
+    event_timestamp = record.tracking_start_time - 180 # 3分(180秒)前と仮定
+    return datetime.fromtimestamp(event_timestamp, JST).strftime('%H:%M頃、')
 
-    try:
-        # 1. 列車在線データを取得
-        params = {"odpt:operator": "odpt.Operator:JR-East", "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=45)
-        response.raise_for_status()
-        train_data = response.json()
-        if not isinstance(train_data, list): return None
-
-        # 2. 路線ごとの全列車リストと、最大遅延を集計
-        all_trains_by_line: Dict[str, List[Dict[str, Any]]] = {}
-        max_delay_by_line: Dict[str, int] = {} # ★★★ ここで定義 ★★★
-        for train in train_data:
-            line_id = train.get("odpt:railway")
-            if not line_id: continue
-            if line_id not in all_trains_by_line: all_trains_by_line[line_id] = []
-            all_trains_by_line[line_id].append(train)
-            current_delay = train.get("odpt:delay", 0)
-            if current_delay > max_delay_by_line.get(line_id, 0):
-                max_delay_by_line[line_id] = current_delay
-        
-        # (独立した予測ループは削除)
-
-        # 3.「不審遅延」ロジック (追跡リスト更新)
-        for train in train_data:
-            train_number: Optional[str] = train.get("odpt:trainNumber")
-            current_delay: int = train.get("odpt:delay", 0)
-            line_id: Optional[str] = train.get("odpt:railway")
-            current_location_id: Optional[str] = train.get("odpt:toStation") or train.get("odpt:fromStation")
-            current_direction: Optional[str] = train.get("odpt:railDirection")
-            if not all([train_number, line_id, current_location_id]): continue
-            if train_number is None: continue
-            trains_found_this_cycle.add(train_number)
-
-            if train_number in tracked_delayed_trains:
-                tracking_info = tracked_delayed_trains[train_number]
-                moved = current_location_id != tracking_info["last_location_id"]
-                recovered = current_delay < DELAY_THRESHOLD_SECONDS
-
-                # ▼▼▼ リセット処理 (「主犯」が動いた時だけ通知) ▼▼▼
-                if moved or recovered:
-                    if tracking_info.get("is_main_culprit", False) and not line_resumption_notified.get(line_id, False):
-                        line_name_jp = JR_LINE_NAMES.get(line_id, line_id.split('.')[-1])
-                        line_train_list = all_trains_by_line.get(line_id, [])
-                        analysis_result = _analyze_group_delay(line_id, line_name_jp, line_train_list)
-                        range_text = STATION_DICT.get(tracking_info["last_location_id"].split('.')[-1], "不明な場所")
-                        
-                        if analysis_result: # まだ一部が遅れている
-                            message = (
-                                f"【{line_name_jp} 一部列車運転再開】\n"
-                                f"{STATION_DICT.get(tracking_info['last_location_id'].split('.')[-1], '不明な場所')}駅付近の列車は動き出しましたが、"
-                                f"現在も{analysis_result['range_text']}の{analysis_result['direction_text']}で停止中の列車があります。(最大{analysis_result['max_delay_minutes']}分遅れ)"
-                            )
-                        else: # 完全復旧
-                            message = (
-                                f"【{line_name_jp} 運転再開】\n"
-                                f"{range_text}駅付近のトラブルは解消した模様です。運転を順次再開しました。"
-                            )
-                        notification_messages.append(message)
-                        line_resumption_notified[line_id] = True # ★「完全再開」の時だけ旗を立てる
-                    
-                    if moved: print(f"--- [DELAY WATCH] Train {train_number}: Reset (moved).", flush=True)
-                    if recovered: print(f"--- [DELAY WATCH] Train {train_number}: Reset (delay recovered).", flush=True)
-                    del tracked_delayed_trains[train_number]
-                
-                # ▼▼▼ 遅延増加処理 ▼▼▼
-                elif current_delay > tracking_info["last_delay"]:
-                    tracking_info["consecutive_increase_count"] += 1
-                    tracking_info["last_delay"] = current_delay
-                    tracking_info["last_seen_time"] = current_time
-                    if current_direction: tracking_info["direction"] = current_direction
-                    count = tracking_info["consecutive_increase_count"]
-                    print(f"--- [DELAY WATCH] Train {train_number}: Count {count} at {current_location_id}", flush=True)
-                    
-                    line_name_jp = JR_LINE_NAMES.get(line_id, line_id.split('.')[-1])
-                    location_name_en = current_location_id.split('.')[-1]
-                    location_name_jp = STATION_DICT.get(location_name_en, location_name_en)
-
-                    # --- 最初の通知判定 (カウント5) ---
-                    if count >= INITIAL_NOTICE_THRESHOLD and not tracking_info.get("notified_initial", False):
-                        line_info = official_info.get(line_id, {})
-                        current_official_status = line_info.get("odpt:trainInformationStatus", {}).get("ja")
-                        
-                        if current_official_status == "運転見合わせ":
-                            print(f"--- [DELAY WATCH] Train {train_number}: Skipping initial notice (Official status is '運転見合わせ').", flush=True)
-                            tracking_info["notified_initial"] = True # ★公式発表済みなら、旗1だけ立てる
+
+def _log_stale_official_info(train_number: str, official_info: Dict[str, Any], status: Optional[str]) -> None:
+    """公式情報の取得に失敗して前回の発表で判定するときは、その古さをログに残す"""
+    age = last_good.age_of(official_info)
+    if age: print(f"--- [DELAY WATCH] Train {train_number}: judging with official info from {age:.0f}s ago (status={status}).", flush=True)
+
+
+class JREastDelayTracker(DelayTracker):
+    """
+    JRの通知判定。公式情報が「運転見合わせ」なら黙り、路線全体の集団遅延を分析して
+    1通にまとめ、「主犯」の列車だけが継続通知と再開通知を出す。
+    cycle.context は check_delay_increase に渡された公式情報 (路線ID → odpt:TrainInformation)。
+    取得に失敗して前回の発表で代用しているときは last_good.StaleDict で、age に古さ (秒) が付いている。
+    """
+
+    def on_start(self, cycle, train_number, record):
+        print(f"--- [DELAY WATCH] Train {train_number}: Start tracking (Delay={record.last_delay}s at {record.last_location_id}).", flush=True)
+
+    def on_stable(self, cycle, train_number, record, train):
+        print(f"--- [DELAY WATCH] Train {train_number}: Delay stable/decreased at {record.last_location_id}. Continuing track.", flush=True)
+
+    # ▼▼▼ リセット処理 (「主犯」が動いた時だけ通知) ▼▼▼
+    def on_reset(self, cycle, train_number, record, train, moved, recovered):
+        line_id = record.line_id
+        if record.is_main_culprit and not line_resumption_notified.get(line_id, False):
+            line_name_jp = JR_LINE_NAMES.get(line_id, line_id.split('.')[-1])
+            line_train_list = cycle.snapshot.by_railway.get(line_id, [])
+            analysis_result = _analyze_group_delay(line_id, line_name_jp, line_train_list)
+            range_text = STATION_DICT.get(record.last_location_id.split('.')[-1], "不明な場所")
+
+            if analysis_result: # まだ一部が遅れている
+                message = (
+                    f"【{line_name_jp} 一部列車運転再開】\n"
+                    f"{range_text}駅付近の列車は動き出しましたが、"
+                    f"現在も{analysis_result['range_text']}の{analysis_result['direction_text']}で停止中の列車があります。(最大{analysis_result['max_delay_minutes']}分遅れ)"
+                )
+            else: # 完全復旧
+                message = (
+                    f"【{line_name_jp} 運転再開】\n"
+                    f"{range_text}駅付近のトラブルは解消した模様です。運転を順次再開しました。"
+                )
+            cycle.messages.append(message)
+            line_resumption_notified[line_id] = True # ★「完全再開」の時だけ旗を立てる
+
+        if moved: print(f"--- [DELAY WATCH] Train {train_number}: Reset (moved).", flush=True)
+        if recovered: print(f"--- [DELAY WATCH] Train {train_number}: Reset (delay recovered).", flush=True)
+
+    # ▼▼▼ 遅延増加処理 ▼▼▼
+    def on_increase(self, cycle, train_number, record, train):
+        official_info = cycle.context
+        count = record.consecutive_increase_count
+        line_id = record.line_id
+        current_location_id = record.last_location_id
+        current_delay = train.delay
+        current_time = cycle.now
+        print(f"--- [DELAY WATCH] Train {train_number}: Count {count} at {current_location_id}", flush=True)
+
+        line_name_jp = JR_LINE_NAMES.get(line_id, line_id.split('.')[-1])
+        location_name_en = current_location_id.split('.')[-1]
+        location_name_jp = STATION_DICT.get(location_name_en, location_name_en)
+
+        # --- 最初の通知判定 (カウント5) ---
+        if count >= INITIAL_NOTICE_THRESHOLD and not record.notified_initial:
+            line_info = official_info.get(line_id, {})
+            current_official_status = line_info.get("odpt:trainInformationStatus", {}).get("ja")
+            _log_stale_official_info(train_number, official_info, current_official_status)
+
+            if current_official_status == "運転見合わせ":
+                print(f"--- [DELAY WATCH] Train {train_number}: Skipping initial notice (Official status is '運転見合わせ').", flush=True)
+                record.notified_initial = True # ★公式発表済みなら、旗1だけ立てる
+            else:
+                cooldown_key = line_id
+                if line_id == "odpt.Railway:JR-East.Chuo":
+                    cooldown_key = "JR-East.Chuo.Takao" if location_name_jp == "高尾" else "JR-East.Chuo.Other"
+
+                last_notification_time = line_cooldown_tracker.get(cooldown_key, 0)
+                if current_time - last_notification_time > COOLDOWN_SECONDS:
+                    line_train_list = cycle.snapshot.by_railway.get(line_id, [])
+                    analysis_result = _analyze_group_delay(line_id, line_name_jp, line_train_list)
+
+                    # ★ デフォルト本文を定義
+                    message_body = f"{line_name_jp}は、{location_name_jp}駅付近で何らかの事象の影響で、運転を見合わせています。(最大{int(current_delay / 60)}分遅れ)"
+
+                    if analysis_result:
+                        status_to_check = line_info.get("odpt:trainInformationText", {}).get("ja", "")
+
+                        # ★ 1. まず、分析官が推測した「場所」をデフォルトとして使う
+                        location_text = analysis_result['cause_station_jp'] + "で" # 「で」を付ける
+                        cause_text = "何らかの事象" # デフォルト原因
+
+                        # ★ 2. 正規表現で、もっと正確な「場所」と「原因」を探す
+                        reason_match = re.search(r'(.+?(?:駅|駅間))で(?:の)?(.+?)の影響で', status_to_check)
+                        if reason_match:
+                            location_part = reason_match.group(1).strip(); cause = reason_match.group(2).strip()
+                            actual_location = re.split(r'[、\s]', location_part)[-1] if location_part else location_part
+                            location_text = f"{actual_location}での" # ★ 場所を上書き
+                            cause_text = cause # ★ 原因を上書き
                         else:
-                            cooldown_key = line_id
-                            if line_id == "odpt.Railway:JR-East.Chuo":
-                                cooldown_key = "JR-East.Chuo.Takao" if location_name_jp == "高尾" else "JR-East.Chuo.Other"
-                            
-                            last_notification_time = line_cooldown_tracker.get(cooldown_key, 0)
-                            if current_time - last_notification_time > COOLDOWN_SECONDS:
-                                line_train_list = all_trains_by_line.get(line_id, [])
-                                analysis_result = _analyze_group_delay(line_id, line_name_jp, line_train_list)
-                                
-                                # ★ デフォルト本文を定義
-                                message_body = f"{line_name_jp}は、{location_name_jp}駅付近で何らかの事象の影響で、運転を見合わせています。(最大{int(current_delay / 60)}分遅れ)"
-                                # ★ 発生時刻を計算
-                                event_time_str = ""
-                                tracking_start_time = tracking_info.get("tracking_start_time")
-                                if tracking_start_time:
-                                    event_timestamp = tracking_start_time - 180 # 3分(180秒)前と仮定
-                                    event_time_dt = datetime.fromtimestamp(event_timestamp, JST)
-                                    event_time_str = event_time_dt.strftime('%H:%M頃、')
-                                
-                                if analysis_result:
-                                    status_to_check = line_info.get("odpt:trainInformationText", {}).get("ja", "")
-                                    
-                                    # ▼▼▼▼▼ ここからが修正箇所 ▼▼▼▼▼
-                                    # ★ 1. まず、分析官が推測した「場所」をデフォルトとして使う
-                                    location_text = analysis_result['cause_station_jp'] + "で" # 「で」を付ける
-                                    cause_text = "何らかの事象" # デフォルト原因
-                                    
-                                    # ★ 2. 正規表現で、もっと正確な「場所」と「原因」を探す
-                                    reason_match = re.search(r'(.+?(?:駅|駅間))で(?:の)?(.+?)の影響で', status_to_check)
-                                    if reason_match:
-                                        location_part = reason_match.group(1).strip(); cause = reason_match.group(2).strip()
-                                        actual_location = re.split(r'[、\s]', location_part)[-1] if location_part else location_part
-                                        location_text = f"{actual_location}での" # ★ 場所を上書き
-                                        cause_text = cause # ★ 原因を上書き
-                                    else:
-                                        official_cause_text = line_info.get("odpt:trainInformationCause", {}).get("ja")
-                                        if official_cause_text: 
-                                            cause_text = official_cause_text # ★ 原因だけ上書き
-                                    
-                                    # ★ 3. 発生時刻を計算
-                                    event_time_str = ""
-                                    tracking_start_time = tracking_info.get("tracking_start_time")
-                                    if tracking_start_time:
-                                        event_timestamp = tracking_start_time - 180
-                                        event_time_dt = datetime.fromtimestamp(event_timestamp, JST)
-                                        event_time_str = event_time_dt.strftime('%H:%M頃、')
-                                    
-                                    # ★ 4. 本文を組み立てる (location_text は空にならない)
-                                    message_body = (
-                                        f"{event_time_str}{location_text}{cause_text}の影響で、"
-                                        f"{analysis_result['range_text']}の{analysis_result['direction_text']}で運転を見合わせています。"
-                                        f"(最大{analysis_result['max_delay_minutes']}分遅れ)"
-                                    )
-                                
-                                max_delay_seconds = max_delay_by_line.get(line_id, 0)
-                                prediction_text = _get_resume_prediction_text(line_id, line_info, max_delay_seconds, current_time)
-                                message = f"【{line_name_jp} 運転見合わせ】\n{message_body}{prediction_text}"
-                                
-                                notification_messages.append(message)
-                                line_cooldown_tracker[cooldown_key] = current_time
-                                line_resumption_notified[line_id] = False
-                                
-                                if analysis_result: # 分析成功時のみ旗を立てる
-                                    main_culprit_num = analysis_result["main_culprit_train_number"]
-                                    for train_num in analysis_result["suspicious_train_numbers"]:
-                                        if train_num in tracked_delayed_trains:
-                                            tracked_delayed_trains[train_num]["notified_initial"] = True # 旗1
-                                            if train_num == main_culprit_num:
-                                                tracked_delayed_trains[train_num]["is_main_culprit"] = True # 旗2
-                                else:
-                                    tracking_info["notified_initial"] = True # 分析失敗でも、トリガーになったやつには旗1を立てる
-
-                                print(f"--- [DELAY WATCH] !!! GROUP NOTICE SENT for {cooldown_key} !!!", flush=True)
-                            else:
-                                print(f"--- [DELAY WATCH] Train {train_number}: Initial threshold reached, but area {cooldown_key} is in cooldown.", flush=True)
-                                tracking_info["notified_initial"] = True # ★ クールダウンでも旗は立てる
-                    
-                    # --- 再通知 (カウント10) ---
-                    # ★★★「主犯」だけが継続通知をトリガーする ★★★
-                    if count >= ESCALATION_NOTICE_THRESHOLD and tracking_info.get("is_main_culprit", False) and not tracking_info.get("notified_escalated", False):
-                         line_info = official_info.get(line_id, {})
-                         current_official_status = line_info.get("odpt:trainInformationStatus", {}).get("ja")
-
-                         if current_official_status == "運転見合わせ":
-                             tracking_info["notified_escalated"] = True
-                         else:
-                             analysis_result = _analyze_group_delay(line_id, line_name_jp, all_trains_by_line.get(line_id, []))
-                             
-                             # ★ 発生時刻を計算
-                             event_time_str = ""
-                             tracking_start_time = tracking_info.get("tracking_start_time")
-                             if tracking_start_time:
-                                 event_timestamp = tracking_start_time - 180 
-                                 event_time_dt = datetime.fromtimestamp(event_timestamp, JST)
-                                 event_time_str = event_time_dt.strftime('%H:%M頃、')
-                             
-                             location_text = f"{location_name_jp}駅付近での" # ★ 最後の手段の場所
-                             cause_text = "何らかの事象" # デフォルト原因
-                             message_body = f"{line_name_jp}は、{event_time_str}{location_text}{cause_text}の対処が長引いている可能性があります。(最大{int(current_delay / 60)}分遅れ)"
-
-                             if analysis_result:
-                                 status_to_check = line_info.get("odpt:trainInformationText", {}).get("ja", "")
-                                 
-                                 # ★ 2. 分析官の推測場所をセット
-                                 location_text = analysis_result['cause_station_jp'] + "で"
-                                 
-                                 reason_match = re.search(r'(.+?(?:駅|駅間))で(?:の)?(.+?)の影響で', status_to_check)
-                                 if reason_match:
-                                     location_part = reason_match.group(1).strip(); cause = reason_match.group(2).strip()
-                                     actual_location = re.split(r'[、\s]', location_part)[-1] if location_part else location_part
-                                     location_text = f"{actual_location}での" # ★ 場所を上書き
-                                     cause_text = cause # ★ 原因を上書き
-                                 else:
-                                     official_cause_text = line_info.get("odpt:trainInformationCause", {}).get("ja")
-                                     if official_cause_text: 
-                                         cause_text = official_cause_text
-                                 
-                                 message_body = (
-                                     f"{event_time_str}{cause_text}の対処が長引いている影響で、"
-                                     f"{analysis_result['range_text']}の{analysis_result['direction_text']}で運転を見合わせています。"
-                                     f"(最大{analysis_result['max_delay_minutes']}分遅れ)"
-                                 )
-                             else:
-                                 message_body = f"{line_name_jp}は、{event_time_str}{location_name_jp}駅付近でのトラブル対応が長引いている可能性があります。(最大{int(current_delay / 60)}分遅れ)"
-
-                             max_delay_seconds = max_delay_by_line.get(line_id, 0)
-                             prediction_text = _get_resume_prediction_text(line_id, line_info, max_delay_seconds, current_time)
-                             message = f"【{line_name_jp} 運転見合わせ[継続]】\n{message_body}{prediction_text}"
-                             
-                             notification_messages.append(message)
-                             tracking_info["notified_escalated"] = True
-                             print(f"--- [DELAY WATCH] !!! ESCALATION NOTICE SENT for line {line_name_jp} !!!", flush=True)
-
-                else: # 遅延が横ばい or 微減
-                    tracking_info["last_seen_time"] = current_time
-                    print(f"--- [DELAY WATCH] Train {train_number}: Delay stable/decreased at {current_location_id}. Continuing track.", flush=True)
-            
-            # ▼▼▼ 新規追跡処理 ▼▼▼
-            elif current_delay >= DELAY_THRESHOLD_SECONDS:
-                 print(f"--- [DELAY WATCH] Train {train_number}: Start tracking (Delay={current_delay}s at {current_location_id}).", flush=True)
-                 tracked_delayed_trains[train_number] = {
-                     "line_id": line_id, "last_location_id": current_location_id,
-                     "last_delay": current_delay, "consecutive_increase_count": 1,
-                     "last_seen_time": current_time, 
-                     "tracking_start_time": current_time, # ★ 「監視開始時刻」を記録
-                     "direction": current_direction,
-                     "notified_initial": False, "is_main_culprit": False,
-                     "notified_escalated": False, "notified_resumed": False 
-                 }
-        
-        # --- 4. 古い記録の掃除 ---
-        trains_to_remove = [
-            train_num for train_num, info in tracked_delayed_trains.items()
-            if train_num not in trains_found_this_cycle and current_time - info["last_seen_time"] > CLEANUP_THRESHOLD_SECONDS
-        ]
-        for train_num in trains_to_remove:
-            info = tracked_delayed_trains[train_num]
-            if info.get("is_main_culprit", False) and not line_resumption_notified.get(info["line_id"], False):
-                line_id = info["line_id"]
-                line_name_jp = JR_LINE_NAMES.get(line_id, line_id.split('.')[-1])
-                location_name_jp = STATION_DICT.get(info["last_location_id"].split('.')[-1], info["last_location_id"].split('.')[-1])
-                
-                message = f"【{line_name_jp} 運転再開】\n{location_name_jp}駅付近で停止していた列車の情報が更新されなくなりました。運転を再開した可能性があります。"
-                notification_messages.append(message)
-                line_resumption_notified[line_id] = True
-            
-            
-            del tracked_delayed_trains[train_num]
-
-
-        return notification_messages
+                            official_cause_text = line_info.get("odpt:trainInformationCause", {}).get("ja")
+                            if official_cause_text:
+                                cause_text = official_cause_text # ★ 原因だけ上書き
+
+                        # ★ 3. 本文を組み立てる (location_text は空にならない)
+                        message_body = (
+                            f"{_event_time_text(record)}{location_text}{cause_text}の影響で、"
+                            f"{analysis_result['range_text']}の{analysis_result['direction_text']}で運転を見合わせています。"
+                            f"(最大{analysis_result['max_delay_minutes']}分遅れ)"
+                        )
+
+                    max_delay_seconds = cycle.snapshot.max_delay_by_railway.get(line_id, 0)
+                    prediction_text = _get_resume_prediction_text(line_id, line_info, max_delay_seconds, current_time)
+                    message = f"【{line_name_jp} 運転見合わせ】\n{message_body}{prediction_text}"
+
+                    cycle.messages.append(message)
+                    line_cooldown_tracker[cooldown_key] = current_time
+                    line_resumption_notified[line_id] = False
+
+                    if analysis_result: # 分析成功時のみ旗を立てる
+                        main_culprit_num = analysis_result["main_culprit_train_number"]
+                        for train_num in analysis_result["suspicious_train_numbers"]:
+                            suspicious = self.tracked.get(train_num)
+                            if suspicious is not None:
+                                suspicious.notified_initial = True # 旗1
+                                if train_num == main_culprit_num:
+                                    suspicious.is_main_culprit = True # 旗2
+                    else:
+                        record.notified_initial = True # 分析失敗でも、トリガーになったやつには旗1を立てる
+
+                    print(f"--- [DELAY WATCH] !!! GROUP NOTICE SENT for {cooldown_key} !!!", flush=True)
+                else:
+                    print(f"--- [DELAY WATCH] Train {train_number}: Initial threshold reached, but area {cooldown_key} is in cooldown.", flush=True)
+                    record.notified_initial = True # ★ クールダウンでも旗は立てる
+
+        # --- 再通知 (カウント10) ---
+        # ★★★「主犯」だけが継続通知をトリガーする ★★★
+        if count >= ESCALATION_NOTICE_THRESHOLD and record.is_main_culprit and not record.notified_escalated:
+            line_info = official_info.get(line_id, {})
+            current_official_status = line_info.get("odpt:trainInformationStatus", {}).get("ja")
+            _log_stale_official_info(train_number, official_info, current_official_status)
+
+            if current_official_status == "運転見合わせ":
+                record.notified_escalated = True
+            else:
+                analysis_result = _analyze_group_delay(line_id, line_name_jp, cycle.snapshot.by_railway.get(line_id, []))
+                event_time_str = _event_time_text(record)
+                cause_text = "何らかの事象" # デフォルト原因
+
+                if analysis_result:
+                    status_to_check = line_info.get("odpt:trainInformationText", {}).get("ja", "")
+                    reason_match = re.search(r'(.+?(?:駅|駅間))で(?:の)?(.+?)の影響で', status_to_check)
+                    if reason_match:
+                        cause_text = reason_match.group(2).strip() # ★ 原因を上書き
+                    else:
+                        official_cause_text = line_info.get("odpt:trainInformationCause", {}).get("ja")
+                        if official_cause_text:
+                            cause_text = official_cause_text
+
+                    message_body = (
+                        f"{event_time_str}{cause_text}の対処が長引いている影響で、"
+                        f"{analysis_result['range_text']}の{analysis_result['direction_text']}で運転を見合わせています。"
+                        f"(最大{analysis_result['max_delay_minutes']}分遅れ)"
+                    )
+                else:
+                    message_body = f"{line_name_jp}は、{event_time_str}{location_name_jp}駅付近でのトラブル対応が長引いている可能性があります。(最大{int(current_delay / 60)}分遅れ)"
+
+                max_delay_seconds = cycle.snapshot.max_delay_by_railway.get(line_id, 0)
+                prediction_text = _get_resume_prediction_text(line_id, line_info, max_delay_seconds, current_time)
+                message = f"【{line_name_jp} 運転見合わせ[継続]】\n{message_body}{prediction_text}"
+
+                cycle.messages.append(message)
+                record.notified_escalated = True
+                print(f"--- [DELAY WATCH] !!! ESCALATION NOTICE SENT for line {line_name_jp} !!!", flush=True)
+
+    # --- 古い記録の掃除 (「主犯」が消えたら再開とみなす) ---
+    def on_expire(self, cycle, train_number, record):
+        line_id = record.line_id
+        if record.is_main_culprit and not line_resumption_notified.get(line_id, False):
+            line_name_jp = JR_LINE_NAMES.get(line_id, line_id.split('.')[-1])
+            location_name_jp = STATION_DICT.get(record.last_location_id.split('.')[-1], record.last_location_id.split('.')[-1])
+
+            message = f"【{line_name_jp} 運転再開】\n{location_name_jp}駅付近で停止していた列車の情報が更新されなくなりました。運転を再開した可能性があります。"
+            cycle.messages.append(message)
+            line_resumption_notified[line_id] = True
+
+
+_tracker = JREastDelayTracker("jr_delay", DELAY_THRESHOLD_SECONDS, CLEANUP_THRESHOLD_SECONDS)
+# --- 監視対象の列車情報を保持する辞書 (列番 → delay_tracker.TrackedTrain。分析官も読む) ---
+tracked_delayed_trains: Dict[str, TrackedTrain] = _tracker.tracked
+
+# --- メイン関数 (全機能・統合版) ---
+def check_delay_increase(official_info: Dict[str, Dict[str, Any]], snapshot=None) -> Optional[List[str]]:
+    try:
+        # 1. 列車在線データを取得 (サイクル共通のスナップショット)
+        if snapshot is None:
+            snapshot = get_train_snapshot(JR_EAST_OPERATOR)
+        if snapshot is None: return None
+        if snapshot.unchanged: return [] # 前回からデータが更新されていない
+        # 2.「不審遅延」ロジック (追跡リスト更新・通知判定・古い記録の掃除は delay_tracker の共通エンジン)
+        #   路線ごとの全列車リストと最大遅延は、受信しながら集計済みのもの (snapshot.by_railway など) を使う
+        return _tracker.process(snapshot, official_info)
 
     except requests.exceptions.RequestException as req_err:
         print(f"--- [DELAY WATCH] ERROR: Network error: {req_err}", flush=True)
@@ -456,4 +403,11 @@ def check_delay_increase(official_info: Dict[str, Dict[str, Any]]) -> Optional[L
     except Exception as e:
         print(f"--- [DELAY WATCH] ERROR: Unexpected error: {e}", flush=True)
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+async def check_delay_increase_async(official_info: Dict[str, Dict[str, Any]]) -> Optional[List[str]]:
+    # 通信はイベントループ上で待ち、追跡処理だけをスレッドに回す
+    snapshot = await get_train_snapshot_async(JR_EAST_OPERATOR)
+    if snapshot is None: return None
+    if snapshot.unchanged: return []
+    return await asyncio.get_running_loop().run_in_executor(None, check_delay_increase, official_info, snapshot)
\ No newline at end of file
@@ -1,6 +1,10 @@
 import os
-import requests
+import odpt_client
 import re
+import asyncio
+import notified_store
+import snapshot_diff
+from train_snapshot import get_train_snapshot, get_train_snapshot_async, JR_EAST_OPERATOR
 from chuo_line_specialist import check_chuo_line_train
 from co_line_specialist import check_co_line_train
 from tokaido_line_specialist import check_tokaido_line_train
@@ -9,7 +13,7 @@ from tohoku_specialist import check_tohoku_train
 from suka_specialist import check_suka_line_train
 
 API_TOKEN = os.getenv('ODPT_TOKEN_CHALLENGE')
-API_ENDPOINT = "https://api-challenge.odpt.org/api/v4/odpt:Train"
+API_ENDPOINT = f"{odpt_client.CHALLENGE_API_BASE}/odpt:Train"
 
 STATION_DICT = {
     # --- JR山手線 ---
@@ -841,17 +845,21 @@ HEBIKUBO_TARGET_LINES = {
     "odpt.Railway:JR-East.SotetsuDirect", 
 }
 
-notified_trains = set()
+notified_trains = notified_store.get_store("jr_irregular") # 運行日 (4時切り替え) ごと、期限と上限付き
 
-def fetch_train_data(line_config):
-    try:
-        params = {"odpt:railway": line_config["id"], "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=30)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"--- [FETCH] {line_config['name']}のデータ取得中にエラー発生: {e}", flush=True)
+# 専門家が「非定期」と判定した列車の記録 (路線 → 列番 → 判定)。判定は種別・行先などだけで決まるので、
+# 前回からの差分でそれらが変わっていない列車は、専門家を通さずにこれを使う
+_irregular_verdicts = {}
+_verdicts_generation = None # 記録がどのスナップショットまでのものか (snapshot_diff の generation)
+
+def fetch_train_data(line_config, snapshot=None):
+    # ★ 路線ごとにAPIを叩かず、サイクル共通のスナップショットから切り出す
+    if snapshot is None:
+        snapshot = get_train_snapshot(JR_EAST_OPERATOR)
+    if snapshot is None:
+        print(f"--- [FETCH] {line_config['name']}のデータ取得中にエラー発生: snapshot unavailable", flush=True)
         return None
+    return snapshot.for_railway(line_config["id"])
 
 def _is_yamanote_line_train_irregular(train, line_config):
     """山手線の列車を専門的に判定する"""
@@ -874,176 +882,241 @@ def _is_yamanote_line_train_irregular(train, line_config):
     # 戻り値: (非定期か?, 表示名)
     return not is_allowed, direction_jp
 
-def process_irregularities(train_data, line_config):
-    irregular_messages = []
-    for train in train_data:
-        # まず基本情報を取得
-        train_type_id = train.get("odpt:trainType")
-        train_number = train.get("odpt:trainNumber")
-        line_id = line_config['id'] # 路線IDを先に取得
-        
-        # 必要な基本情報がなければスキップ
-        if not all([train_type_id, train_number, line_id]): continue
-        
-        # 行き先リストを取得
-        dest_station_id_list = train.get("odpt:destinationStation")
-
-        is_irregular = False
-        train_type_jp = TRAIN_TYPE_NAMES.get(train_type_id, train_type_id) # デフォルト種別名
-        dest_station_jp = "" # 行き先表示名を初期化
-        notification_id = "" # 通知IDを初期化
-        dest_station_en = "" # 英語の行き先名も初期化
-
-        # ▼▼▼▼▼ 蛇窪ロマンルート ▼▼▼▼▼
-        if line_id in HEBIKUBO_TARGET_LINES and dest_station_id_list is None:
-            print(f"--- [HEBIKUBO?] Train {train_number} on {line_id} has None destination. Possible Hebikubo! ---", flush=True)
+def _judge_train(train, line_config):
+    """
+    専門家の判定。(非定期か, 種別名, 英語の行先, 表示用の行先) を返す。判定の対象外なら None。
+    列番・種別・行先・方向・両数だけで決まる (場所や遅延には依存しない)。
+    """
+    # まず基本情報を取得
+    train_type_id = train.train_type
+    train_number = train.train_number
+    line_id = line_config['id'] # 路線IDを先に取得
+    
+    # 必要な基本情報がなければスキップ
+    if not all([train_type_id, train_number, line_id]): return None
+    
+    # 行き先リストを取得
+    dest_station_id_list = train.destination_station
+
+    is_irregular = False
+    train_type_jp = TRAIN_TYPE_NAMES.get(train_type_id, train_type_id) # デフォルト種別名
+    dest_station_jp = "" # 行き先表示名を初期化
+    notification_id = "" # 通知IDを初期化
+    dest_station_en = "" # 英語の行き先名も初期化
+
+    # ▼▼▼▼▼ 蛇窪ロマンルート ▼▼▼▼▼
+    if line_id in HEBIKUBO_TARGET_LINES and dest_station_id_list is None:
+        print(f"--- [HEBIKUBO?] Train {train_number} on {line_id} has None destination. Possible Hebikubo! ---", flush=True)
+        is_irregular = True
+        dest_station_jp = "蛇窪信号場" # 表示名を直接設定
+        notification_id = f"{train_number}_Hebikubo" # 特別な通知ID
+        # このルートでは dest_station_en は使わない
+
+    # ▼▼▼ 通常ルート ▼▼▼
+    else:
+        if not dest_station_id_list: return None
+    
+    dest_station_en = dest_station_id_list[-1].split('.')[-1].strip()
+    display_dest_en = dest_station_en
+    notification_id = f"{train_number}_{dest_station_en}"
+    
+    is_irregular = False
+    train_type_jp = TRAIN_TYPE_NAMES.get(train_type_id, train_type_id) 
+    line_id = line_config['id']
+
+
+    # 【現場監督の判断】
+    if line_config['id'] == 'odpt.Railway:JR-East.ChuoRapid':
+        is_irregular, train_type_jp = check_chuo_line_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
+    elif line_config['id'] == 'odpt.Railway:JR-East.Chuo':
+        is_irregular, train_type_jp = check_co_line_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
+    elif line_config['id'] == 'odpt.Railway:JR-East.Tokaido':
+        is_irregular, train_type_jp, display_dest_en = check_tokaido_line_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
+    elif line_config['id'] == 'odpt.Railway:JR-East.Keiyo':
+        is_irregular, train_type_jp = check_boso_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
+    elif line_config['id'] == 'odpt.Railway:JR-East.SobuRapid':
+        is_irregular, train_type_jp = check_boso_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
+    elif line_config['id'] == 'odpt.Railway:JR-East.Yokosuka':
+        is_irregular, train_type_jp = check_suka_line_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
+    elif line_config['id'] == 'odpt.Railway:JR-East.Utsunomiya':
+        is_irregular, train_type_jp = check_tohoku_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
+    elif line_config['id'] == 'odpt.Railway:JR-East.Takasaki':
+        is_irregular, train_type_jp = check_tohoku_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
+    elif line_config['id'] == 'odpt.Railway:JR-East.Yamanote':
+        is_irregular, train_type_jp = _is_yamanote_line_train_irregular(train, line_config)
+
+    
+    else: # それ以外の路線
+        current_trip = (train_type_id, dest_station_en)
+        if current_trip not in line_config.get("regular_trips", {}):
             is_irregular = True
-            dest_station_jp = "蛇窪信号場" # 表示名を直接設定
-            notification_id = f"{train_number}_Hebikubo" # 特別な通知ID
-            # このルートでは dest_station_en は使わない
+        train_type_jp = TRAIN_TYPE_NAMES.get(train_type_id, train_type_id)
+    
 
-        # ▼▼▼ 通常ルート ▼▼▼
-        else:
-            if not dest_station_id_list: continue
-        
-        dest_station_en = dest_station_id_list[-1].split('.')[-1].strip()
-        display_dest_en = dest_station_en
-        notification_id = f"{train_number}_{dest_station_en}"
-        
-        is_irregular = False
-        train_type_jp = TRAIN_TYPE_NAMES.get(train_type_id, train_type_id) 
-        line_id = line_config['id']
-
-
-        # 【現場監督の判断】
-        if line_config['id'] == 'odpt.Railway:JR-East.ChuoRapid':
-            is_irregular, train_type_jp = check_chuo_line_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
-        elif line_config['id'] == 'odpt.Railway:JR-East.Chuo':
-            is_irregular, train_type_jp = check_co_line_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
-        elif line_config['id'] == 'odpt.Railway:JR-East.Tokaido':
-            is_irregular, train_type_jp, display_dest_en = check_tokaido_line_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
-        elif line_config['id'] == 'odpt.Railway:JR-East.Keiyo':
-            is_irregular, train_type_jp = check_boso_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
-        elif line_config['id'] == 'odpt.Railway:JR-East.SobuRapid':
-            is_irregular, train_type_jp = check_boso_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
-        elif line_config['id'] == 'odpt.Railway:JR-East.Yokosuka':
-            is_irregular, train_type_jp = check_suka_line_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
-        elif line_config['id'] == 'odpt.Railway:JR-East.Utsunomiya':
-            is_irregular, train_type_jp = check_tohoku_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
-        elif line_config['id'] == 'odpt.Railway:JR-East.Takasaki':
-            is_irregular, train_type_jp = check_tohoku_train(train, line_config.get("regular_trips", set()), TRAIN_TYPE_NAMES)
-        elif line_config['id'] == 'odpt.Railway:JR-East.Yamanote':
-            is_irregular, train_type_jp = _is_yamanote_line_train_irregular(train, line_config)
+    return is_irregular, train_type_jp, dest_station_en, display_dest_en
 
+def _notify_irregular(train, line_config, verdict, irregular_messages):
+    """非定期と判定した列車について、場所による例外を見てから、まだ通知していなければ通知を作る"""
+    is_irregular, train_type_jp, dest_station_en, display_dest_en = verdict
+    train_type_id = train.train_type
+    train_number = train.train_number
+    line_id = line_config['id']
+    notification_id = f"{train_number}_{dest_station_en}"
+
+    if is_irregular and line_id == "odpt.Railway:JR-East.Keiyo":
+        from_station_id = train.get("odpt:fromStation")
+        to_station_id = train.get("odpt:toStation")
+        direction = train.get("odpt:railDirection")
         
-        else: # それ以外の路線
-            current_trip = (train_type_id, dest_station_en)
-            if current_trip not in line_config.get("regular_trips", {}):
-                is_irregular = True
-            train_type_jp = TRAIN_TYPE_NAMES.get(train_type_id, train_type_id)
-        
-        if is_irregular and line_id == "odpt.Railway:JR-East.Keiyo":
+        # 条件: 蘇我駅に停車中 / Outbound / 列番末尾が A or Y
+        if from_station_id and "Soga" in from_station_id and not to_station_id and \
+           direction and "Outbound" in direction and \
+           train_number: # train_numberがNoneでないことを確認
+             last_char = train_number[-1].upper() # 末尾の文字を大文字で取得
+             if last_char == 'A':
+                 print(f"--- [KEIYO OVERRIDE] Train {train_number}: Overriding line name to Sotobo Line at Soga. ---", flush=True)
+                 line_name_jp = "外房線" # 表示名を上書き
+             elif last_char == 'Y':
+                 print(f"--- [KEIYO OVERRIDE] Train {train_number}: Overriding line name to Uchibo Line at Soga. ---", flush=True)
+                 line_name_jp = "内房線" # 表示名を上書き
+
+    if is_irregular and line_id == "odpt.Railway:JR-East.KeihinTohokuNegishi":
+        direction = train.get("odpt:railDirection")
+        current_location_id = train.get("odpt:toStation") or train.get("odpt:fromStation")
+
+        # 条件: 快速 / 南行 / 浜松町以南 / 鶴見or東神奈川行き
+        if train_type_id == 'odpt.TrainType:JR-East.Rapid' and \
+           direction and "Southbound" in direction and \
+           current_location_id and \
+           dest_station_en in ['Tsurumi', 'Higashi-Kanagawa']:
+            try:
+                hamamatsucho_index = KEIHIN_TOHOKU_STATIONS.index('浜松町')
+                current_station_name_en = current_location_id.split('.')[-1]
+                # 駅名辞書(STATION_DICT)を使って日本語名に変換
+                current_station_name_jp = STATION_DICT.get(current_station_name_en, "")
+
+                if current_station_name_jp and current_station_name_jp in KEIHIN_TOHOKU_STATIONS:
+                     current_index = KEIHIN_TOHOKU_STATIONS.index(current_station_name_jp)
+                     # 浜松町のインデックスより大きければ（南にいれば）見逃す
+                     if current_index > hamamatsucho_index:
+                         print(f"--- [K-TOHOKU SKIP] Train {train_number}: Skipping notification for Rapid to {dest_station_en} south of Hamamatsucho.", flush=True)
+                         is_irregular = False # ★★★ 通知対象から除外 ★★★
+            except (ValueError, IndexError, KeyError):
+                 # 駅名が見つからない or インデックスエラーなどの場合は何もしない (is_irregular は True のまま)
+                 print(f"--- [K-TOHOKU SKIP] Warning: Could not determine location for skip check on {train_number}. Station ID: {current_location_id}", flush=True)
+                 pass
+            
+    is_special_name_from_specialist = train_type_jp not in TRAIN_TYPE_NAMES.values() and train_type_jp != train_type_id
+
+    if is_irregular and notification_id and notification_id not in notified_trains:
+        try:
+            line_name_jp = line_config.get("name", "?")
+
+            if not is_special_name_from_specialist:
+         # ルール1: 特定路線の Local は「普通」
+                if train_type_id == 'odpt.TrainType:JR-East.Local' and \
+            line_id in ['odpt.Railway:JR-East.Takasaki', 
+                         'odpt.Railway:JR-East.Utsunomiya',
+                         'odpt.Railway:JR-East.ShonanShinjuku', 
+                         'odpt.Railway:JR-East.Yokosuka', 
+                         'odpt.Railway:JR-East.Tokaido']:
+                    train_type_jp = "普通"
+         
+         # ルール2: 特定路線の SpecialRapid は「ホリデー快速」
+                elif train_type_id == 'odpt.TrainType:JR-East.SpecialRapid' and \
+              line_id in ['odpt.Railway:JR-East.ChuoRapid', 
+                          'odpt.Railway:JR-East.Ome']:
+                    train_type_jp = "ホリデー快速"
+         # 他にもルールがあれば elif で追加
+
+
+            if "." in display_dest_en:
+                parts = display_dest_en.split('.')
+                dest_station_jp = "・".join([STATION_DICT.get(part, part) for part in parts])
+            else:
+                dest_station_jp = STATION_DICT.get(dest_station_en, dest_station_en)
+            location_text = ""
             from_station_id = train.get("odpt:fromStation")
             to_station_id = train.get("odpt:toStation")
-            direction = train.get("odpt:railDirection")
-            
-            # 条件: 蘇我駅に停車中 / Outbound / 列番末尾が A or Y
-            if from_station_id and "Soga" in from_station_id and not to_station_id and \
-               direction and "Outbound" in direction and \
-               train_number: # train_numberがNoneでないことを確認
-                 last_char = train_number[-1].upper() # 末尾の文字を大文字で取得
-                 if last_char == 'A':
-                     print(f"--- [KEIYO OVERRIDE] Train {train_number}: Overriding line name to Sotobo Line at Soga. ---", flush=True)
-                     line_name_jp = "外房線" # 表示名を上書き
-                 elif last_char == 'Y':
-                     print(f"--- [KEIYO OVERRIDE] Train {train_number}: Overriding line name to Uchibo Line at Soga. ---", flush=True)
-                     line_name_jp = "内房線" # 表示名を上書き
-
-        if is_irregular and line_id == "odpt.Railway:JR-East.KeihinTohokuNegishi":
-            direction = train.get("odpt:railDirection")
-            current_location_id = train.get("odpt:toStation") or train.get("odpt:fromStation")
-
-            # 条件: 快速 / 南行 / 浜松町以南 / 鶴見or東神奈川行き
-            if train_type_id == 'odpt.TrainType:JR-East.Rapid' and \
-               direction and "Southbound" in direction and \
-               current_location_id and \
-               dest_station_en in ['Tsurumi', 'Higashi-Kanagawa']:
-                try:
-                    hamamatsucho_index = KEIHIN_TOHOKU_STATIONS.index('浜松町')
-                    current_station_name_en = current_location_id.split('.')[-1]
-                    # 駅名辞書(STATION_DICT)を使って日本語名に変換
-                    current_station_name_jp = STATION_DICT.get(current_station_name_en, "")
-
-                    if current_station_name_jp and current_station_name_jp in KEIHIN_TOHOKU_STATIONS:
-                         current_index = KEIHIN_TOHOKU_STATIONS.index(current_station_name_jp)
-                         # 浜松町のインデックスより大きければ（南にいれば）見逃す
-                         if current_index > hamamatsucho_index:
-                             print(f"--- [K-TOHOKU SKIP] Train {train_number}: Skipping notification for Rapid to {dest_station_en} south of Hamamatsucho.", flush=True)
-                             is_irregular = False # ★★★ 通知対象から除外 ★★★
-                except (ValueError, IndexError, KeyError):
-                     # 駅名が見つからない or インデックスエラーなどの場合は何もしない (is_irregular は True のまま)
-                     print(f"--- [K-TOHOKU SKIP] Warning: Could not determine location for skip check on {train_number}. Station ID: {current_location_id}", flush=True)
-                     pass
-                
-        is_special_name_from_specialist = train_type_jp not in TRAIN_TYPE_NAMES.values() and train_type_jp != train_type_id
-
-        if is_irregular and notification_id and notification_id not in notified_trains:
-            try:
-                line_name_jp = line_config.get("name", "?")
-
-                if not is_special_name_from_specialist:
-             # ルール1: 特定路線の Local は「普通」
-                    if train_type_id == 'odpt.TrainType:JR-East.Local' and \
-                line_id in ['odpt.Railway:JR-East.Takasaki', 
-                             'odpt.Railway:JR-East.Utsunomiya',
-                             'odpt.Railway:JR-East.ShonanShinjuku', 
-                             'odpt.Railway:JR-East.Yokosuka', 
-                             'odpt.Railway:JR-East.Tokaido']:
-                        train_type_jp = "普通"
-             
-             # ルール2: 特定路線の SpecialRapid は「ホリデー快速」
-                    elif train_type_id == 'odpt.TrainType:JR-East.SpecialRapid' and \
-                  line_id in ['odpt.Railway:JR-East.ChuoRapid', 
-                              'odpt.Railway:JR-East.Ome']:
-                        train_type_jp = "ホリデー快速"
-             # 他にもルールがあれば elif で追加
-
-
-                if "." in display_dest_en:
-                    parts = display_dest_en.split('.')
-                    dest_station_jp = "・".join([STATION_DICT.get(part, part) for part in parts])
-                else:
-                    dest_station_jp = STATION_DICT.get(dest_station_en, dest_station_en)
-                location_text = ""
-                from_station_id = train.get("odpt:fromStation")
-                to_station_id = train.get("odpt:toStation")
-                if to_station_id and from_station_id:
-                    from_jp = STATION_DICT.get(from_station_id.split('.')[-1], from_station_id.split('.')[-1])
-                    to_jp = STATION_DICT.get(to_station_id.split('.')[-1], to_station_id.split('.')[-1])
-                    location_text = f"{from_jp}→{to_jp}を走行中"
-                elif from_station_id:
-                    from_jp = STATION_DICT.get(from_station_id.split('.')[-1], from_station_id.split('.')[-1])
-                    location_text = f"{from_jp}に停車中"
-                delay_minutes = round(train.get("odpt:delay", 0) / 60)
-                delay_text = f"遅延:{delay_minutes}分" if delay_minutes > 0 else "定刻"
-                message_line1 = f"[{line_name_jp}] {train_type_jp} {dest_station_jp}行き"
-                # location_textが存在し、かつ遅延がある場合のみ遅延情報を追記
-                location_text_with_delay = f"{location_text} ({delay_text})" if location_text and delay_text else location_text
-                message_line2 = location_text_with_delay
-                message_line3 = f"列番:{train_number}" # 列番のみ                
-                final_message = f"{message_line1}\n{message_line2}\n{message_line3}" if message_line2 else f"{message_line1}\n{message_line3}"
-                irregular_messages.append(final_message)
-                notified_trains.add(notification_id)
-            except Exception as e:
-                print(f"--- [NOTIFICATION ERROR] Failed to create message for Train {train_number}. Error: {e}", flush=True)
+            if to_station_id and from_station_id:
+                from_jp = STATION_DICT.get(from_station_id.split('.')[-1], from_station_id.split('.')[-1])
+                to_jp = STATION_DICT.get(to_station_id.split('.')[-1], to_station_id.split('.')[-1])
+                location_text = f"{from_jp}→{to_jp}を走行中"
+            elif from_station_id:
+                from_jp = STATION_DICT.get(from_station_id.split('.')[-1], from_station_id.split('.')[-1])
+                location_text = f"{from_jp}に停車中"
+            delay_minutes = round(train.get("odpt:delay", 0) / 60)
+            delay_text = f"遅延:{delay_minutes}分" if delay_minutes > 0 else "定刻"
+            message_line1 = f"[{line_name_jp}] {train_type_jp} {dest_station_jp}行き"
+            # location_textが存在し、かつ遅延がある場合のみ遅延情報を追記
+            location_text_with_delay = f"{location_text} ({delay_text})" if location_text and delay_text else location_text
+            message_line2 = location_text_with_delay
+            message_line3 = f"列番:{train_number}" # 列番のみ                
+            final_message = f"{message_line1}\n{message_line2}\n{message_line3}" if message_line2 else f"{message_line1}\n{message_line3}"
+            irregular_messages.append(final_message)
+            notified_trains.add(notification_id)
+        except Exception as e:
+            print(f"--- [NOTIFICATION ERROR] Failed to create message for Train {train_number}. Error: {e}", flush=True)
 
+def process_irregularities(train_data, line_config, verdicts=None, changes=None):
+    """
+    1路線分の非定期列車の通知を返す。verdicts (列番 → 判定) を渡すと、非定期と判定した列車をそこに記録する。
+    さらに changes (verdicts を作ったスナップショットからの snapshot_diff.RailwayChanges) も渡すと、
+    出現した列車と種別・行先などが変わった列車だけ専門家に判定し直し、それ以外の非定期列車は記録を使う。
+    """
+    irregular_messages = []
+    if changes is None:
+        if verdicts is not None: verdicts.clear()
+        for train in train_data:
+            verdict = _judge_train(train, line_config)
+            if verdict is None or not verdict[0]: continue
+            if verdicts is not None: verdicts[train.train_number] = verdict
+            _notify_irregular(train, line_config, verdict, irregular_messages)
+        return irregular_messages
+
+    # 消えた列車の記録は捨てて、判定し直す列車と非定期と判定済みの列車だけを元の並び順に見る
+    # (定期の列車は、変化が無ければ何もしないので飛ばしてよい)
+    for train in changes.vanished: verdicts.pop(train.train_number, None)
+    positions = changes.positions
+    rejudge = {positions[train.train_number] for train in changes.appeared}
+    rejudge.update(positions[train.train_number] for train in changes.retyped)
+    targets = rejudge.union(positions[train_number] for train_number in verdicts if train_number in positions)
+    for position in sorted(targets):
+        train = train_data[position]
+        if position in rejudge:
+            verdict = _judge_train(train, line_config)
+            if verdict is None or not verdict[0]:
+                verdicts.pop(train.train_number, None)
+                continue
+            verdicts[train.train_number] = verdict
+        else:
+            verdict = verdicts[train.train_number]
+        _notify_irregular(train, line_config, verdict, irregular_messages)
     return irregular_messages
 
-def check_jr_east_irregularities():
+def check_jr_east_irregularities(snapshot=None):
+    global _verdicts_generation
     all_irregular_trains = []
+    if snapshot is None:
+        snapshot = get_train_snapshot(JR_EAST_OPERATOR)
+    if snapshot is None: return None
+    if snapshot.unchanged: return all_irregular_trains # 前回からデータが更新されていない
+    # 前回見たスナップショットからの差分があれば、専門家は変化のあった列車にだけ使う
+    changes = snapshot_diff.changes_since(snapshot, _verdicts_generation)
+    _verdicts_generation = None # 途中で失敗したら、次の回は全部判定し直す
     for line_config in JR_LINES_TO_MONITOR:
-        train_data = fetch_train_data(line_config)
+        train_data = fetch_train_data(line_config, snapshot)
         if train_data is not None:
-            irregular_list = process_irregularities(train_data, line_config)
+            verdicts = _irregular_verdicts.setdefault(line_config["id"], {})
+            line_changes = changes.for_railway(line_config["id"]) if changes is not None else None
+            irregular_list = process_irregularities(train_data, line_config, verdicts, line_changes)
             all_irregular_trains.extend(irregular_list)
-    return all_irregular_trains
\ No newline at end of file
+    _verdicts_generation = snapshot_diff.generation_of(snapshot)
+    return all_irregular_trains
+
+async def check_jr_east_irregularities_async():
+    # 通信はイベントループ上で待ち、判定処理だけをスレッドに回す
+    snapshot = await get_train_snapshot_async(JR_EAST_OPERATOR)
+    if snapshot is None: return None
+    if snapshot.unchanged: return []
+    return await asyncio.get_running_loop().run_in_executor(None, check_jr_east_irregularities, snapshot)
\ No newline at end of file
@@ -1,12 +1,15 @@
 import os
 import requests
+import odpt_client
+from odpt_records import TrainInformation, train_informations_from_json
 import re
+import asyncio
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 import unicodedata
 
 API_TOKEN = os.getenv('ODPT_TOKEN_CHALLENGE')
-API_ENDPOINT = "https://api-challenge.odpt.org/api/v4/odpt:TrainInformation"
+API_ENDPOINT = f"{odpt_client.CHALLENGE_API_BASE}/odpt:TrainInformation"
 
 
 RAIL_DIRECTION_NAMES = {
@@ -333,6 +336,7 @@ JR_LINE_PREDICTION_DATA = {
 # ▼▼▼ 2つのグローバル変数の名前を変更 ▼▼▼
 last_jr_east_statuses = {}
 current_official_info: Dict[str, Dict[str, Any]] = {} # ★名前変更 (statuses -> info)
+_last_official_info: Dict[str, Dict[str, Any]] = {} # 前回返した official_info (中身が同じだったときに返す)
 
 NORMAL_STATUS_KEYWORDS = ["平常", "遅れ", "運転を再開", "運休します","お知らせ","昼間"]
 # ---------------------------------------------------------------
@@ -356,25 +360,25 @@ def _find_nearest_hub(station_list: List[str], hubs: set, start_index: int, dire
     return None
 
 # --- メイン関数 (ロジック共通化・最終版) ---
-def check_jr_east_info() -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]]: # ★ 戻り値をタプルに変更
-    global last_jr_east_statuses
+def check_jr_east_info(info_data: Any = None) -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]]: # ★ 戻り値をタプルに変更
+    global last_jr_east_statuses, _last_official_info
     notification_messages: List[str] = []
     
     # ★ ホワイトボードは、この関数の中だけで使う「ローカル変数」にする
     current_official_info: Dict[str, Dict[str, Any]] = {} 
     
     try:
-        params = {"odpt:operator": "odpt.Operator:jre-is", "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=30)
-        response.raise_for_status()
-        try: info_data: Any = response.json()
-        except requests.exceptions.JSONDecodeError as json_err: return None, {} # ★ 失敗時は空の辞書を返す
+        if info_data is None: # ★ asyncio版から渡されていなければ、ここで取得する
+            params = {"odpt:operator": "odpt.Operator:jre-is", "acl:consumerKey": API_TOKEN}
+            try: info_data = odpt_client.get_json(API_ENDPOINT, params=params, timeout=30, if_changed=True)
+            except requests.exceptions.JSONDecodeError as json_err: return None, {} # ★ 失敗時は空の辞書を返す
+        # 前回とまったく同じ中身なら、辞書を作り直さずに前回の結果をそのまま使う
+        if info_data is odpt_client.NOT_MODIFIED: return [], _last_official_info
         if not isinstance(info_data, list): return None, {}
 
-        info_dict: Dict[str, Dict[str, Any]] = {}
-        for item in info_data:
-             if isinstance(item, dict) and item.get("odpt:railway") and isinstance(item.get("odpt:trainInformationText"), dict) and item.get("odpt:trainInformationText", {}).get("ja"):
-                 info_dict[item["odpt:railway"]] = item
+        info_dict: Dict[str, TrainInformation] = {}
+        for item in train_informations_from_json(info_data): # 路線と日本語の文章がそろったものだけ
+            info_dict[item.railway] = item
 
         for line_id, line_info in info_dict.items():
             if line_id not in JR_LINE_PREDICTION_DATA: continue
@@ -760,6 +764,7 @@ def check_jr_east_info() -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]
                         final_message = f"{title}\n{reason_text}"
                         notification_messages.append(final_message)
         
+        _last_official_info = current_official_info
         return notification_messages, current_official_info
 
     except requests.exceptions.RequestException as req_err: 
@@ -769,8 +774,21 @@ def check_jr_east_info() -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]
         import traceback
         print(f"--- [JR INFO] ERROR: An unexpected error occurred in check_jr_east_info: {e}", flush=True)
         traceback.print_exc()
+        # 同じ中身が次に来ても NOT_MODIFIED にせず、もう一度解析する
+        odpt_client.forget_body(API_ENDPOINT, {"odpt:operator": "odpt.Operator:jre-is"})
         return None, {}
 
 # --- 遅延検知にステータスを渡すための関数 ---
 def get_current_official_info() -> Dict[str, Dict[str, Any]]:
-    return current_official_info
\ No newline at end of file
+    return current_official_info
+
+async def check_jr_east_info_async() -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]]:
+    # 通信はイベントループ上で待ち、解析処理だけをスレッドに回す
+    try:
+        params = {"odpt:operator": "odpt.Operator:jre-is", "acl:consumerKey": API_TOKEN}
+        info_data = await odpt_client.get_json_async(API_ENDPOINT, params=params, timeout=30, if_changed=True)
+    except requests.exceptions.RequestException as req_err:
+        print(f"--- [JR INFO] ERROR: Network error: {req_err}", flush=True)
+        return None, {}
+    if info_data is odpt_client.NOT_MODIFIED: return check_jr_east_info(info_data) # スレッドに回すまでもない
+    return await asyncio.get_running_loop().run_in_executor(None, check_jr_east_info, info_data)
\ No newline at end of file
@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Dict, Any, Optional
+
+# ---------------------------------------------------------------
+# ▼▼▼ 取得先ごとの「最後に取れたデータ」置き場 ▼▼▼
+# ---------------------------------------------------------------
+# 取得に失敗したサイクルは、これまで検知が None を返して何も残らなかった。
+# 取得先ごとに最後に成功したデータを取っておき、古くても構わない利用者
+# (JR遅延監視の公式発表チェック、/status など) には「何秒前のデータか」を
+# 添えて渡す。古すぎるものは渡さない。
+
+# --- 設定値 ---
+MAX_STALE_AGE = 600.0 # これより古いデータは渡さない (秒)
+
+
+class StaleEntry:
+    """最後に取れたデータと、その時刻"""
+    __slots__ = ("key", "value", "stored_at")
+
+    def __init__(self, key: str, value: Any, stored_at: float):
+        self.key = key
+        self.value = value
+        self.stored_at = stored_at
+
+    @property
+    def age(self) -> float:
+        """何秒前に取れたデータか"""
+        return max(time.time() - self.stored_at, 0.0)
+
+
+class StaleDict(dict):
+    """前回のデータで代用した辞書。中身は普通の dict と同じで、age (何秒前に取れたデータか) が付いている"""
+    __slots__ = ("age",)
+
+    def __init__(self, value: Dict[Any, Any], age: float):
+        super().__init__(value)
+        self.age = age
+
+
+def age_of(value: Any) -> float:
+    """StaleDict なら何秒前のデータか、今回取れたデータなら 0"""
+    return getattr(value, "age", 0.0)
+
+
+_entries: Dict[str, StaleEntry] = {}
+_served_counts: Dict[str, int] = {} # 古いデータで代用した回数
+_lock = threading.Lock()
+
+
+def remember(key: str, value: Any, stored_at: Optional[float] = None) -> None:
+    """取得に成功したら呼ぶ"""
+    if stored_at is None: stored_at = time.time()
+    with _lock:
+        _entries[key] = StaleEntry(key, value, stored_at)
+
+
+def recall(key: str, max_age: float = MAX_STALE_AGE) -> Optional[StaleEntry]:
+    """取得に失敗したときに呼ぶ。max_age 以内のデータがあれば返す (無ければ None)。"""
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None: return None
+        age = entry.age
+        if age > max_age:
+            print(f"--- [LAST GOOD] {key}: last good data is {age:.0f}s old, too stale to use ---", flush=True)
+            return None
+        _served_counts[key] = _served_counts.get(key, 0) + 1
+    print(f"--- [LAST GOOD] {key}: fetch failed, using data from {age:.0f}s ago ---", flush=True)
+    return entry
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        return {
+            key: {
+                "stored_at": entry.stored_at,
+                "age": round(entry.age, 1),
+                "served_stale": _served_counts.get(key, 0),
+            }
+            for key, entry in _entries.items()
+        }
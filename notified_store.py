@@ -0,0 +1,172 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, Optional, Tuple
+
+import clock
+
+# ---------------------------------------------------------------
+# ▼▼▼ 通知済みの記録 (運行日ごと・期限と上限付き) ▼▼▼
+# ---------------------------------------------------------------
+# 非定期検知の「通知済み」(f"{列番}_{行先}") は、これまで set に足すだけだった。
+# 何週間も動かすと増え続けるうえ、同じ列番・行先が翌日も走ると通知されなかった。
+# ここでは運行日 (日本時間の4時で切り替え) が変わったら全部忘れ、
+# 一定時間見かけなかったものと、上限を超えた古いものも忘れる。
+# 検知側からは今までどおり `in` / add で使える。
+
+JST = timezone(timedelta(hours=+9)) # 日本時間
+
+# --- 設定値 ---
+DAY_BOUNDARY_HOUR = 4        # 運行日の切り替え (日本時間のこの時刻。終電〜始発の間)
+ENTRY_TTL = 6 * 60 * 60      # 最後に見かけてからこれだけ経ったら忘れる (秒)。1本の列車が走り続ける時間より長く
+MAX_ENTRIES = 5000           # 覚えておく上限。超えたら見かけたのが古いものから忘れる
+
+
+def operating_day(timestamp: Optional[float] = None) -> str:
+    """その時刻が属する運行日 (4時より前は前日扱い)"""
+    if timestamp is None: timestamp = clock.time()
+    moment = datetime.fromtimestamp(timestamp, JST) - timedelta(hours=DAY_BOUNDARY_HOUR)
+    return moment.strftime('%Y-%m-%d')
+
+
+def _operating_day_range(timestamp: float) -> Tuple[float, float]:
+    """その時刻が属する運行日の始まりと終わり (UNIX時刻)"""
+    moment = datetime.fromtimestamp(timestamp, JST) - timedelta(hours=DAY_BOUNDARY_HOUR)
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(hours=DAY_BOUNDARY_HOUR)
+    return start.timestamp(), (start + timedelta(days=1)).timestamp()
+
+
+class NotifiedStore:
+    """
+    通知済みの記録。`key in store` で調べ、store.add(key) で覚える。
+    調べて見つかったものは「見かけた」ことにして期限を延ばす (走り続けている列車を忘れないように)。
+    """
+    __slots__ = ("name", "ttl", "max_entries", "_entries", "_day", "_day_start", "_day_end",
+                 "added", "expired", "evicted", "rollovers", "_lock")
+
+    def __init__(self, name: str, ttl: float = ENTRY_TTL, max_entries: int = MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, float]" = OrderedDict() # キー → 最後に見かけた時刻 (古い順)
+        self._day = ""
+        self._day_start = self._day_end = 0.0 # 今の運行日の範囲 (毎回日付を計算しないように)
+        self.added = 0
+        self.expired = 0     # 期限切れで忘れた数
+        self.evicted = 0     # 上限を超えて忘れた数
+        self.rollovers = 0   # 運行日の切り替えで全部忘れた回数
+        self._lock = threading.Lock()
+
+    def _roll(self, now: float) -> None:
+        if self._day_start <= now < self._day_end: return
+        day = operating_day(now)
+        self._day_start, self._day_end = _operating_day_range(now)
+        if day == self._day: return
+        if self._entries:
+            self.rollovers += 1
+            print(f"--- [NOTIFIED] {self.name}: operating day {day} started, forgetting {len(self._entries)} entries ---", flush=True)
+            self._entries.clear()
+        self._day = day
+
+    def _expire(self, now: float) -> None:
+        entries = self._entries
+        while entries:
+            key, seen_at = next(iter(entries.items()))
+            if now - seen_at < self.ttl: break
+            del entries[key]
+            self.expired += 1
+
+    def __contains__(self, key: Any) -> bool:
+        now = clock.time()
+        with self._lock:
+            self._roll(now)
+            seen_at = self._entries.get(key)
+            if seen_at is None: return False
+            if now - seen_at >= self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                return False
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key: str) -> None:
+        now = clock.time()
+        with self._lock:
+            self._roll(now)
+            self._expire(now)
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            self.added += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def export(self) -> Dict[str, Any]:
+        """保存用 (detector_state)。見かけた時刻の古い順"""
+        with self._lock:
+            return {"day": self._day, "entries": [[key, seen_at] for key, seen_at in self._entries.items()]}
+
+    def load(self, data: Dict[str, Any]) -> None:
+        """export() したものを戻す。運行日が変わっていれば、_roll で捨てられる"""
+        with self._lock:
+            self._entries = OrderedDict((key, float(seen_at)) for key, seen_at in data.get("entries", []))
+            self._day = data.get("day", "")
+            self._day_start = self._day_end = 0.0
+            self._roll(clock.time())
+            self._expire(clock.time())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(clock.time())
+            return {
+                "size": len(self._entries),
+                "operating_day": self._day,
+                "added": self.added,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "rollovers": self.rollovers,
+                "ttl": self.ttl,
+                "max_entries": self.max_entries,
+            }
+
+
+_stores: Dict[str, NotifiedStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name: str) -> NotifiedStore:
+    """名前ごとに1つの記録を返す (検知モジュールごとに1つ)"""
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            store = _stores[name] = NotifiedStore(name)
+        return store
+
+
+def export_all() -> Dict[str, Dict[str, Any]]:
+    with _stores_lock:
+        stores = list(_stores.values())
+    return {store.name: store.export() for store in stores}
+
+
+def load_all(data: Dict[str, Dict[str, Any]]) -> None:
+    for name, stored in data.items():
+        get_store(name).load(stored)
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    with _stores_lock:
+        stores = list(_stores.values())
+    return {store.name: store.snapshot() for store in stores}
@@ -0,0 +1,426 @@
+import os
+import time
+import hashlib
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple, Iterator, AsyncIterator
+from urllib.parse import urlsplit, parse_qs, parse_qsl
+
+import aiohttp
+import requests
+import odpt_records
+import request_budget
+import response_recorder
+from request_budget import BudgetExceededError, TokenBudget
+from circuit_breaker import CircuitBreaker, is_breaker_failure, is_breaker_status
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# ---------------------------------------------------------------
+# ▼▼▼ ODPT 共通HTTPクライアント ▼▼▼
+# ---------------------------------------------------------------
+# 各検知モジュールが毎回 requests.get すると、そのたびに TCP+TLS の
+# ハンドシェイクが発生する。ここで「ホスト × トークン」ごとに
+# keep-alive のセッションを1本ずつ持ち、全員で使い回す。
+
+TOKEN_CHALLENGE = os.getenv('ODPT_TOKEN_CHALLENGE') # JR東日本・東武用
+TOKEN_TOEI = os.getenv('ODPT_TOKEN_TOEI')           # 都営・メトロ・多摩モノ用
+
+# 接続先。負荷試験のときは、環境変数でローカルの代役サーバ (odpt_stub_server.py) に向ける
+CHALLENGE_API_BASE = os.getenv('ODPT_CHALLENGE_API_BASE', "https://api-challenge.odpt.org/api/v4").rstrip("/") # JR東日本・東武用
+API_BASE = os.getenv('ODPT_API_BASE', "https://api.odpt.org/api/v4").rstrip("/")                                   # 都営・メトロ・多摩モノ用
+
+# --- 設定値 ---
+POOL_MAXSIZE = 4 # 1セッションあたりの同時接続数の上限
+STREAM_CHUNK_SIZE = 64 * 1024 # 逐次受信するときの1回分の大きさ (バイト)
+
+
+class _CountingAdapter(HTTPAdapter):
+    """実際に張ったTCP接続の数と、送ったリクエストの数を数えるアダプタ"""
+
+    def __init__(self, *args, **kwargs):
+        self.num_requests = 0
+        self.num_connections = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        class _CountingHTTPConnection(HTTPConnection):
+            def connect(self):
+                adapter.num_connections += 1
+                super().connect()
+
+        class _CountingHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                adapter.num_connections += 1
+                super().connect()
+
+        class _CountingHTTPPool(HTTPConnectionPool):
+            ConnectionCls = _CountingHTTPConnection
+
+        class _CountingHTTPSPool(HTTPSConnectionPool):
+            ConnectionCls = _CountingHTTPSConnection
+
+        self.poolmanager.pool_classes_by_scheme = {"http": _CountingHTTPPool, "https": _CountingHTTPSPool}
+
+    def send(self, request, *args, **kwargs):
+        self.num_requests += 1
+        return super().send(request, *args, **kwargs)
+
+
+class _NotModified:
+    """前回とまったく同じ中身だったことを表す目印 (if_changed=True のときだけ返る)"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "NOT_MODIFIED"
+
+    def __bool__(self):
+        return False
+
+
+NOT_MODIFIED = _NotModified()
+
+
+# キー: (ホスト名, トークン)
+_sessions: Dict[Tuple[str, Optional[str]], requests.Session] = {}
+_adapters: Dict[Tuple[str, Optional[str]], _CountingAdapter] = {}
+_sessions_lock = threading.Lock()
+
+# asyncio版 (aiohttp) のセッション。イベントループに紐づくので、ループも一緒に覚えておく
+_async_sessions: Dict[Tuple[str, Optional[str]], Tuple[asyncio.AbstractEventLoop, aiohttp.ClientSession]] = {}
+_async_stats: Dict[Tuple[str, Optional[str]], Dict[str, int]] = {}
+
+# ブレーカー。キー: (ホスト名, パス, トークン)
+_breakers: Dict[Tuple[str, str, Optional[str]], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+# 取得先 (トークン抜きのURL+パラメータ) ごとの、前回の中身のハッシュ
+_body_hashes: Dict[str, bytes] = {}
+_not_modified_counts: Dict[str, int] = {}
+
+
+def _token_label(token: Optional[str]) -> str:
+    """統計表示用のトークン名 (トークン本体は絶対に表に出さない)"""
+    if token is None: return "none"
+    if token == TOKEN_CHALLENGE: return "challenge"
+    if token == TOKEN_TOEI: return "toei"
+    return "other"
+
+
+def _extract_token(url: str, params: Optional[Dict[str, Any]]) -> Optional[str]:
+    if params and params.get("acl:consumerKey"):
+        return params["acl:consumerKey"]
+    # URLにクエリで直書きされている場合 (多摩モノ方式)
+    query = parse_qs(urlsplit(url).query)
+    values = query.get("acl:consumerKey")
+    return values[0] if values else None
+
+
+def get_session(url: str, token: Optional[str]) -> requests.Session:
+    """ホストとトークンの組み合わせごとに、使い回し用のセッションを返す"""
+    host = urlsplit(url).netloc
+    key = (host, token)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = _CountingAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+            _adapters[key] = adapter
+            print(f"--- [ODPT CLIENT] New session for {host} ({_token_label(token)}) ---", flush=True)
+    return session
+
+
+def get_breaker(url: str, token: Optional[str]) -> CircuitBreaker:
+    """ホスト × エンドポイント × トークン ごとのブレーカーを返す"""
+    parts = urlsplit(url)
+    key = (parts.netloc, parts.path, token)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(f"{parts.netloc}{parts.path} ({_token_label(token)})")
+    return breaker
+
+
+def get_token_budget(token: Optional[str]) -> TokenBudget:
+    """トークンごとのリクエスト予算を返す"""
+    return request_budget.get_budget(_token_label(token))
+
+
+@contextmanager
+def _circuit(url: str, token: Optional[str]) -> Iterator[CircuitBreaker]:
+    """
+    ブロックの中の通信の成否をブレーカーに伝える。開いていれば通信せずに CircuitOpenError、
+    トークンの予算を使い切っていれば BudgetExceededError。
+    取得先の不調 (タイムアウト・接続失敗・5xx・429) だけを失敗として数える。
+    """
+    breaker = get_breaker(url, token)
+    breaker.before_request()
+    try:
+        get_token_budget(token).acquire()
+    except BudgetExceededError as e:
+        print(f"--- [ODPT CLIENT] {e} ---", flush=True)
+        breaker.release() # 通信していないので、ブレーカーには何も数えさせない
+        raise
+    try:
+        yield breaker
+    except requests.exceptions.RequestException as e:
+        if is_breaker_failure(e): breaker.record_failure(e)
+        else: breaker.record_success() # 4xx や中身の異常は、取得先そのものは生きている
+        raise
+    except GeneratorExit:
+        # iter_chunks を利用者が途中で閉じた (中身が読めなかったなど)。ステータスを見た後なので、取得先は応答している
+        breaker.record_success()
+        raise
+    except BaseException:
+        breaker.release() # キャンセルなど。成否は分からないので様子見の枠だけ返す
+        raise
+    else:
+        breaker.record_success()
+
+
+def _record(url: str, params: Optional[Dict[str, Any]], status: int, body: Optional[bytes],
+            fetched_at: float, started: float) -> None:
+    """録画中 (ODPT_RECORD_DIR 設定時) なら応答を録画係に渡す。録画しないなら何もしない。"""
+    recorder = response_recorder.get_recorder()
+    if recorder is not None:
+        recorder.record(url, params, status, body, fetched_at, time.monotonic() - started)
+
+
+def _raise_for_breaker_status(response: requests.Response) -> None:
+    if is_breaker_status(response.status_code):
+        response.raise_for_status()
+
+
+def get(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 30,
+        headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    """requests.get の代わりに使う。例外も requests と同じものがそのまま飛ぶ (ブレーカーが開いていれば CircuitOpenError)。"""
+    token = _extract_token(url, params)
+    session = get_session(url, token)
+    try:
+        with _circuit(url, token):
+            fetched_at, started = time.time(), time.monotonic()
+            response = session.get(url, params=params, timeout=timeout, headers=headers)
+            _record(url, params, response.status_code, response.content, fetched_at, started)
+            _raise_for_breaker_status(response) # 5xx/429 はブレーカーに失敗として数えさせる
+    except requests.exceptions.HTTPError as e:
+        if e.response is None: raise
+        return e.response # 呼び出し側には、これまで通りステータスを見ずに返す
+    return response
+
+
+def _body_key(url: str, params: Optional[Dict[str, Any]]) -> str:
+    """前回の中身と比べるためのキー。トークンは含めない。"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "acl:consumerKey"]
+    query += [(k, str(v)) for k, v in (params or {}).items() if k != "acl:consumerKey" and v is not None]
+    return f"{parts.netloc}{parts.path}?" + "&".join(f"{k}={v}" for k, v in sorted(query))
+
+
+def _decode_if_changed(key: str, body: bytes, if_changed: bool) -> Any:
+    """中身が前回と同じなら NOT_MODIFIED、違えば (あるいは比較しないなら) JSONを読んで返す"""
+    digest = hashlib.blake2b(body, digest_size=16).digest() if if_changed else None
+    if if_changed and _body_hashes.get(key) == digest:
+        _not_modified_counts[key] = _not_modified_counts.get(key, 0) + 1
+        return NOT_MODIFIED
+    try:
+        data = odpt_records.loads(body) # orjson / msgspec が入っていればそちらで読む
+    except odpt_records.JSON_DECODE_ERRORS as e:
+        raise requests.exceptions.JSONDecodeError(str(e), "", 0) from e
+    if if_changed:
+        _body_hashes[key] = digest # 読めた中身だけ覚える (処理に失敗したら、利用者が forget_body で忘れさせる)
+    return data
+
+
+def forget_body(url: str, params: Optional[Dict[str, Any]] = None) -> None:
+    """
+    if_changed=True で受け取った中身の処理に失敗したときに呼ぶ。
+    次に同じ中身が来ても NOT_MODIFIED にせず、もう一度渡す (失敗した更新を取りこぼさないように)。
+    """
+    _body_hashes.pop(_body_key(url, params), None)
+
+
+def get_json(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 30,
+             headers: Optional[Dict[str, str]] = None, if_changed: bool = False) -> Any:
+    """
+    get() して raise_for_status と JSONデコードまで済ませた結果を返す。
+    if_changed=True なら、前回とバイト単位で同じ中身のときはデコードせずに NOT_MODIFIED を返す。
+    """
+    response = get(url, params=params, timeout=timeout, headers=headers)
+    response.raise_for_status()
+    return _decode_if_changed(_body_key(url, params), response.content, if_changed)
+
+
+def iter_chunks(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 30,
+                headers: Optional[Dict[str, str]] = None, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """レスポンス本体を丸ごと持たずに、届いた分から少しずつ返す"""
+    token = _extract_token(url, params)
+    session = get_session(url, token)
+    recorder = response_recorder.get_recorder()
+    with _circuit(url, token):
+        fetched_at, started = time.time(), time.monotonic()
+        with session.get(url, params=params, timeout=timeout, headers=headers, stream=True) as response:
+            if response.status_code >= 400: _record(url, params, response.status_code, None, fetched_at, started)
+            response.raise_for_status()
+            chunks = [] if recorder is not None else None # 録画するときだけ、本体をつなげて残しておく
+            for chunk in response.iter_content(chunk_size):
+                if chunks is not None: chunks.append(chunk)
+                yield chunk
+            if recorder is not None:
+                recorder.record(url, params, response.status_code, b"".join(chunks), fetched_at, time.monotonic() - started)
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """取得先ごとのブレーカーの状態 (監視用)"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def get_budget_stats() -> Dict[str, Dict[str, Any]]:
+    """トークンごとの呼び出し回数と予算の残り (監視用)"""
+    return request_budget.get_stats()
+
+
+def get_recorder_stats() -> Optional[Dict[str, Any]]:
+    """応答の録画の状況 (録画していなければ None)"""
+    return response_recorder.get_stats()
+
+
+def get_not_modified_stats() -> Dict[str, int]:
+    """取得先ごとに、中身が前回と同じで処理を省略できた回数"""
+    return dict(_not_modified_counts)
+
+
+def get_connection_stats() -> Dict[str, Dict[str, int]]:
+    """
+    ホスト・トークンごとの接続再利用状況を返す。
+    reused = リクエスト数 - 新規に張った接続数
+    """
+    stats: Dict[str, Dict[str, int]] = {}
+    with _sessions_lock:
+        items = list(_adapters.items())
+
+    for (host, token), adapter in items:
+        stats[f"{host} ({_token_label(token)})"] = {
+            "requests": adapter.num_requests,
+            "connections": adapter.num_connections,
+            "reused": max(adapter.num_requests - adapter.num_connections, 0),
+        }
+    for (host, token), counts in list(_async_stats.items()):
+        stats[f"{host} ({_token_label(token)}, async)"] = {
+            "requests": counts["requests"],
+            "connections": counts["connections"],
+            "reused": max(counts["requests"] - counts["connections"], 0),
+        }
+    return stats
+
+
+# ---------------------------------------------------------------
+# ▼▼▼ asyncio版 (Botのイベントループ上で直接待つ) ▼▼▼
+# ---------------------------------------------------------------
+def _get_async_session(url: str, token: Optional[str]) -> aiohttp.ClientSession:
+    host = urlsplit(url).netloc
+    key = (host, token)
+    loop = asyncio.get_running_loop()
+    entry = _async_sessions.get(key)
+    if entry is not None and entry[0] is loop and not entry[1].closed:
+        return entry[1]
+
+    counts = _async_stats.setdefault(key, {"requests": 0, "connections": 0})
+
+    async def on_request_start(session, context, params):
+        counts["requests"] += 1
+
+    async def on_connection_create_end(session, context, params):
+        counts["connections"] += 1
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+
+    connector = aiohttp.TCPConnector(limit_per_host=POOL_MAXSIZE)
+    session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+    _async_sessions[key] = (loop, session)
+    print(f"--- [ODPT CLIENT] New async session for {host} ({_token_label(token)}) ---", flush=True)
+    return session
+
+
+async def get_json_async(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 30,
+                         headers: Optional[Dict[str, str]] = None, if_changed: bool = False) -> Any:
+    """
+    get_json() の asyncio版。通信はイベントループ上で待ち、ハッシュとJSONの解析はスレッドで行う。
+    呼び出し側の except 節をそのまま使えるように、例外は requests の例外に読み替えて投げる。
+    """
+    token = _extract_token(url, params)
+    session = _get_async_session(url, token)
+    with _circuit(url, token), _as_requests_errors(url, timeout):
+        fetched_at, started = time.time(), time.monotonic()
+        async with session.get(url, params=_query(params), headers=headers,
+                               timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status >= 400: _record(url, params, response.status, None, fetched_at, started)
+            response.raise_for_status()
+            body = await response.read()
+            _record(url, params, response.status, body, fetched_at, started)
+
+    return await asyncio.get_running_loop().run_in_executor(None, _decode_if_changed, _body_key(url, params), body, if_changed)
+
+
+async def iter_chunks_async(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 30,
+                            headers: Optional[Dict[str, str]] = None,
+                            chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """iter_chunks() の asyncio版"""
+    token = _extract_token(url, params)
+    session = _get_async_session(url, token)
+    recorder = response_recorder.get_recorder()
+    with _circuit(url, token), _as_requests_errors(url, timeout):
+        fetched_at, started = time.time(), time.monotonic()
+        async with session.get(url, params=_query(params), headers=headers,
+                               timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status >= 400: _record(url, params, response.status, None, fetched_at, started)
+            response.raise_for_status()
+            chunks = [] if recorder is not None else None # 録画するときだけ、本体をつなげて残しておく
+            async for chunk in response.content.iter_chunked(chunk_size):
+                if chunks is not None: chunks.append(chunk)
+                yield chunk
+            if recorder is not None:
+                recorder.record(url, params, response.status, b"".join(chunks), fetched_at, time.monotonic() - started)
+
+
+def _query(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # requests と同じく、値が None のパラメータは送らない
+    return {k: v for k, v in (params or {}).items() if v is not None}
+
+
+@contextmanager
+def _as_requests_errors(url: str, timeout: float) -> Iterator[None]:
+    """aiohttp の例外を requests の例外に読み替える"""
+    try:
+        yield
+    except asyncio.TimeoutError as e:
+        raise requests.exceptions.Timeout(f"timeout after {timeout}s: {url}") from e
+    except aiohttp.ClientResponseError as e:
+        # 呼び出し側がステータスを見られるように、requests の Response に詰め直す
+        response = requests.Response()
+        response.status_code = e.status
+        response.url = url
+        raise requests.exceptions.HTTPError(f"{e.status} {e.message}: {url}", response=response) from e
+    except aiohttp.ClientError as e:
+        raise requests.exceptions.ConnectionError(str(e)) from e
+
+
+async def close_async_sessions() -> None:
+    """今のイベントループに紐づいたセッションを閉じる (Bot終了時など)"""
+    loop = asyncio.get_running_loop()
+    for key, (session_loop, session) in list(_async_sessions.items()):
+        if session_loop is not loop: continue
+        if not session.closed:
+            await session.close()
+        del _async_sessions[key]
@@ -0,0 +1,252 @@
+import codecs
+import json
+import re
+from typing import Dict, Any, List, Optional, Tuple, NamedTuple, Callable
+
+# ---------------------------------------------------------------
+# ▼▼▼ ODPTデータの軽量レコードと、速いJSONデコーダ ▼▼▼
+# ---------------------------------------------------------------
+# JR東の odpt:Train は数百本分あり、これまでは1本ずつ汎用の dict にして
+# "odpt:..." の文字列キーで .get していた。ここでは検知で使う項目だけを
+# 持つ、書き換え不可で __slots__ 付きのレコード (NamedTuple) にそろえる。
+# 既存の判定処理がそのまま動くように、.get("odpt:...") / ["odpt:..."] でも読める。
+
+# --- JSONデコーダ (入っていれば速いものを使う) ---
+try:
+    import orjson
+    JSON_BACKEND = "orjson"
+    _loads = orjson.loads
+    JSON_DECODE_ERRORS: Tuple[type, ...] = (orjson.JSONDecodeError,)
+except ImportError:
+    try:
+        import msgspec
+        JSON_BACKEND = "msgspec"
+        _loads = msgspec.json.decode
+        JSON_DECODE_ERRORS = (msgspec.DecodeError,)
+    except ImportError:
+        JSON_BACKEND = "json"
+        _loads = json.loads
+        JSON_DECODE_ERRORS = (json.JSONDecodeError,)
+
+
+def loads(body: bytes) -> Any:
+    """バイト列をJSONとして読む。失敗時は JSON_DECODE_ERRORS のどれかが飛ぶ。"""
+    return _loads(body)
+
+
+class Train(NamedTuple):
+    """在線情報 (odpt:Train) 1本分。検知で使う項目だけを持つ。"""
+    train_number: Optional[str]
+    railway: Optional[str]
+    operator: Optional[str]
+    delay: int
+    from_station: Optional[str]
+    to_station: Optional[str]
+    rail_direction: Optional[str]
+    train_type: Optional[str]
+    destination_station: Optional[Tuple[str, ...]]
+    train_owner: Optional[str]
+    car_composition: Optional[int]
+    date: Optional[str]   # dc:date
+    valid: Optional[str]  # dct:valid
+
+    @classmethod
+    def from_odpt(cls, item: Dict[str, Any]) -> "Train":
+        get = item.get
+        destination = get("odpt:destinationStation")
+        # 数百本分を毎回作るので、NamedTuple の __new__ を通さずに直接組み立てる
+        return tuple.__new__(cls, (
+            get("odpt:trainNumber"),
+            get("odpt:railway"),
+            get("odpt:operator"),
+            get("odpt:delay") or 0,
+            get("odpt:fromStation"),
+            get("odpt:toStation"),
+            get("odpt:railDirection"),
+            get("odpt:trainType"),
+            tuple(destination) if isinstance(destination, list) else None,
+            get("odpt:trainOwner"),
+            get("odpt:carComposition"),
+            get("dc:date"),
+            get("dct:valid"),
+        ))
+
+    # --- 旧来の dict 風の読み方 (値が無い/null のときは default を返す) ---
+    def get(self, key: str, default: Any = None) -> Any:
+        index = _TRAIN_KEY_INDEX.get(key)
+        if index is None: return default
+        value = tuple.__getitem__(self, index)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            index = _TRAIN_KEY_INDEX.get(key)
+            if index is None: raise KeyError(key)
+            return tuple.__getitem__(self, index)
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key) -> bool:
+        index = _TRAIN_KEY_INDEX.get(key)
+        return index is not None and tuple.__getitem__(self, index) is not None
+
+
+_TRAIN_KEY_INDEX: Dict[str, int] = {
+    key: index for index, key in enumerate([
+        "odpt:trainNumber", "odpt:railway", "odpt:operator", "odpt:delay",
+        "odpt:fromStation", "odpt:toStation", "odpt:railDirection", "odpt:trainType",
+        "odpt:destinationStation", "odpt:trainOwner", "odpt:carComposition",
+        "dc:date", "dct:valid",
+    ])
+}
+
+
+class TrainInformation(NamedTuple):
+    """運行情報 (odpt:TrainInformation) 1路線分。文章は日本語だけを持つ。"""
+    railway: Optional[str]
+    operator: Optional[str]
+    text: Optional[str]    # odpt:trainInformationText (ja)
+    status: Optional[str]  # odpt:trainInformationStatus (ja)
+    cause: Optional[str]   # odpt:trainInformationCause (ja)
+    date: Optional[str]    # dc:date
+
+    @classmethod
+    def from_odpt(cls, item: Dict[str, Any]) -> "TrainInformation":
+        return cls(
+            item.get("odpt:railway"),
+            item.get("odpt:operator"),
+            _ja(item.get("odpt:trainInformationText")),
+            _ja(item.get("odpt:trainInformationStatus")),
+            _ja(item.get("odpt:trainInformationCause")),
+            item.get("dc:date"),
+        )
+
+    # --- 旧来の dict 風の読み方 (多言語項目は {"ja": ...} の形で返す) ---
+    def get(self, key: str, default: Any = None) -> Any:
+        index = _INFO_KEY_INDEX.get(key)
+        if index is None: return default
+        value = tuple.__getitem__(self, index)
+        if value is None: return default
+        return {"ja": value} if key in _INFO_TEXT_KEYS else value
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in _INFO_KEY_INDEX: raise KeyError(key)
+            value = self.get(key)
+            if value is None: raise KeyError(key)
+            return value
+        return tuple.__getitem__(self, key)
+
+
+_INFO_KEY_INDEX: Dict[str, int] = {
+    key: index for index, key in enumerate([
+        "odpt:railway", "odpt:operator", "odpt:trainInformationText",
+        "odpt:trainInformationStatus", "odpt:trainInformationCause", "dc:date",
+    ])
+}
+_INFO_TEXT_KEYS = frozenset({"odpt:trainInformationText", "odpt:trainInformationStatus", "odpt:trainInformationCause"})
+
+
+def _ja(value: Any) -> Optional[str]:
+    return value.get("ja") if isinstance(value, dict) else None
+
+
+def trains_from_json(data: Any) -> List[Train]:
+    """odpt:Train の配列をレコードの配列にする (dict でない要素は捨てる)"""
+    from_odpt = Train.from_odpt
+    return [from_odpt(item) for item in data if isinstance(item, dict)]
+
+
+def train_informations_from_json(data: Any) -> List[TrainInformation]:
+    """odpt:TrainInformation の配列から、路線と日本語の文章がそろったものだけをレコードにする"""
+    records: List[TrainInformation] = []
+    for item in data:
+        if not isinstance(item, dict) or not item.get("odpt:railway"): continue
+        record = TrainInformation.from_odpt(item)
+        if record.text: records.append(record)
+    return records
+
+
+# ---------------------------------------------------------------
+# ▼▼▼ 逐次パーサ (届いた分から1本ずつレコードにする) ▼▼▼
+# ---------------------------------------------------------------
+# 全体を一度に dict の配列にすると、事業者や路線が増えるほど
+# ピーク時のメモリが膨らむ。レスポンス本体を少しずつ受け取り、
+# 配列の要素を1つ読むたびに必要な項目だけのレコードにして、元の dict は捨てる。
+_skip_whitespace = re.compile(r"[ \t\r\n]*").match
+
+
+class ArrayStreamParser:
+    """
+    JSON配列を分割されたバイト列で受け取り、要素 (dict) を1つずつ project に通して返す。
+    配列でないものが来たら ValueError (json.JSONDecodeError を含む) を投げる。
+    """
+    __slots__ = ("_project", "_decoder", "_text", "_buffer", "_pos", "_state")
+
+    def __init__(self, project: Callable[[Dict[str, Any]], Any]):
+        self._project = project
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start" # start → item ⇄ sep → end
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        self._buffer = self._buffer[self._pos:] + self._text.decode(chunk)
+        self._pos = 0
+        return self._drain(final=False)
+
+    def close(self) -> List[Any]:
+        """最後に呼ぶ。配列が閉じていなければ ValueError。"""
+        self._buffer = self._buffer[self._pos:] + self._text.decode(b"", final=True)
+        self._pos = 0
+        records = self._drain(final=True)
+        if self._state != "end":
+            raise ValueError("incomplete JSON array")
+        return records
+
+    def _drain(self, final: bool) -> List[Any]:
+        # 1本あたりの手間がそのまま効くので、属性はローカル変数に移してから回す
+        records: List[Any] = []
+        buffer, pos, state = self._buffer, self._pos, self._state
+        size = len(buffer)
+        raw_decode, project = self._decoder.raw_decode, self._project
+        try:
+            while True:
+                pos = _skip_whitespace(buffer, pos).end()
+                if pos >= size: return records
+                char = buffer[pos]
+
+                if state == "item":
+                    if char == "]":
+                        pos += 1
+                        state = "end"
+                        continue
+                    try:
+                        item, end = raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        if final: raise
+                        return records # 要素の途中で切れている。続きを待つ
+                    if isinstance(item, dict):
+                        records.append(project(item))
+                    elif end >= size and not final:
+                        return records # 数値などは、続きが来ないと終わりが分からない
+                    pos = end
+                    state = "sep"
+                elif state == "sep":
+                    if char == ",": state = "item"
+                    elif char == "]": state = "end"
+                    else: raise ValueError(f"unexpected {char!r} in JSON array")
+                    pos += 1
+                elif state == "start":
+                    if char != "[": raise ValueError(f"expected a JSON array, got {char!r}")
+                    pos += 1
+                    state = "item"
+                else: # end
+                    raise ValueError("trailing data after JSON array")
+        finally:
+            self._pos, self._state = pos, state
+
+
+def train_stream_parser() -> ArrayStreamParser:
+    """odpt:Train の配列を、届いた分から Train レコードにするパーサ"""
+    return ArrayStreamParser(Train.from_odpt)
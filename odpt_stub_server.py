@@ -0,0 +1,270 @@
+"""
+ODPT v4 (odpt:Train / odpt:TrainInformation) のローカル代役サーバ
+
+    python odpt_stub_server.py --port 8765 --trains trains.json --info info.json --latency 0.2 --error-rate 0.05
+    python odpt_stub_server.py --port 8765 --recorded /path/to/ODPT_RECORD_DIR
+
+Bot や検知をこのサーバに向けるには、起動時に表示される環境変数を設定する:
+    ODPT_API_BASE=http://127.0.0.1:8765/api/v4
+    ODPT_CHALLENGE_API_BASE=http://127.0.0.1:8765/api/v4
+
+odpt:operator / odpt:railway などの絞り込み (カンマ区切りで複数可) と
+acl:consumerKey の確認 (--token を指定したときだけ) に対応する。
+応答の遅れ・エラー率・本体の大きさ (列車数の水増し) を設定できる。
+"""
+import abc
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Iterable, Sequence, Tuple
+from urllib.parse import urlsplit, parse_qsl
+
+import response_recorder
+
+API_PREFIX = "/api/v4"
+TRAIN_PATH = f"{API_PREFIX}/odpt:Train"
+INFO_PATH = f"{API_PREFIX}/odpt:TrainInformation"
+
+
+class StubDataset(abc.ABC):
+    """代役サーバが返すデータ。呼ばれるたびに、その時点の全事業者分を返す (どちらかが無ければ作る時点でエラー)。"""
+
+    @abc.abstractmethod
+    def trains(self) -> List[Dict[str, Any]]:
+        """odpt:Train の全事業者分"""
+
+    @abc.abstractmethod
+    def information(self) -> List[Dict[str, Any]]:
+        """odpt:TrainInformation の全事業者分"""
+
+
+class StaticDataset(StubDataset):
+    """決まったデータをそのまま返す (差し替えは set で)"""
+
+    def __init__(self, trains: Optional[List[Dict[str, Any]]] = None,
+                 information: Optional[List[Dict[str, Any]]] = None):
+        self._lock = threading.Lock()
+        self._trains = trains or []
+        self._information = information or []
+
+    def set(self, trains: Optional[List[Dict[str, Any]]] = None,
+            information: Optional[List[Dict[str, Any]]] = None) -> None:
+        with self._lock:
+            if trains is not None: self._trains = trains
+            if information is not None: self._information = information
+
+    def trains(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._trains
+
+    def information(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._information
+
+
+class RecordedDataset(StubDataset):
+    """
+    録画 (response_recorder) の応答を、録画した順に1回ずつ進めながら返す (最後まで行ったら最初に戻る)。
+    事業者ごとの録画は1つの配列にまとめて返す (絞り込みはサーバ側でやり直す)。
+    """
+
+    def __init__(self, directory: str, max_records: int = 2000):
+        self._lock = threading.Lock()
+        # (在線/運行情報) ごとに、録画の各時点での全事業者分の配列
+        self._frames: Dict[str, List[List[Dict[str, Any]]]] = {"train": [], "info": []}
+        self._positions = {"train": 0, "info": 0}
+        latest: Dict[Tuple[str, Optional[str]], List[Dict[str, Any]]] = {}
+        for index, record in enumerate(response_recorder.iter_records(directory)):
+            if index >= max_records: break
+            if record.get("status") != 200 or record.get("body") is None: continue
+            kind = "train" if record["endpoint"].endswith("/odpt:Train") else "info"
+            operator = (record.get("params") or {}).get("odpt:operator")
+            try:
+                latest[(kind, operator)] = json.loads(record["body"])
+            except json.JSONDecodeError:
+                continue
+            # その時点で分かっている事業者分を全部つなげて、1つの時点とする
+            self._frames[kind].append([item for (k, _), items in latest.items() if k == kind for item in items])
+        print(f"--- [STUB] loaded {len(self._frames['train'])} train / {len(self._frames['info'])} info frames from {directory}", flush=True)
+
+    def _next(self, kind: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            frames = self._frames[kind]
+            if not frames: return []
+            frame = frames[self._positions[kind] % len(frames)]
+            self._positions[kind] += 1
+            return frame
+
+    def trains(self) -> List[Dict[str, Any]]:
+        return self._next("train")
+
+    def information(self) -> List[Dict[str, Any]]:
+        return self._next("info")
+
+
+class StubConfig:
+    """代役サーバの振る舞い"""
+    __slots__ = ("latency", "jitter", "error_rate", "error_statuses", "scale", "tokens")
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_statuses: Sequence[int] = (500, 503), scale: int = 1, tokens: Iterable[str] = ()):
+        self.latency = latency                 # 応答までの遅れ (秒)
+        self.jitter = jitter                   # 遅れのゆらぎ (±秒)
+        self.error_rate = error_rate           # エラーを返す割合 (0〜1)
+        self.error_statuses = tuple(error_statuses)
+        self.scale = scale                     # 列車を何倍に水増しするか (本体の大きさの調整)
+        self.tokens = frozenset(tokens)        # 受け付ける acl:consumerKey (空なら確認しない)
+
+
+def _matches(item: Dict[str, Any], filters: List[Tuple[str, List[str]]]) -> bool:
+    for key, values in filters:
+        value = item.get(key)
+        if isinstance(value, list):
+            if not any(v in values for v in value): return False
+        elif value not in values:
+            return False
+    return True
+
+
+def _scaled(trains: List[Dict[str, Any]], scale: int) -> List[Dict[str, Any]]:
+    """列車番号をずらしたコピーを足して、本体を scale 倍にする"""
+    if scale <= 1: return trains
+    result = list(trains)
+    for copy in range(1, scale):
+        for train in trains:
+            clone = dict(train)
+            clone["odpt:trainNumber"] = f"{train.get('odpt:trainNumber')}-{copy}"
+            result.append(clone)
+    return result
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive (本番と同じく接続を使い回せるように)
+    server: "ODPTStubServer"
+
+    def do_GET(self) -> None:
+        stub = self.server
+        config = stub.config
+        parts = urlsplit(self.path)
+        query = parse_qsl(parts.query)
+        stub.count("requests")
+
+        if config.latency or config.jitter:
+            time.sleep(max(config.latency + random.uniform(-config.jitter, config.jitter), 0))
+
+        if parts.path not in (TRAIN_PATH, INFO_PATH):
+            return self._send(404, {"error": "not found"})
+        params = dict(query)
+        if config.tokens and params.get("acl:consumerKey") not in config.tokens:
+            stub.count("unauthorized")
+            return self._send(401, {"error": "invalid acl:consumerKey"})
+        if config.error_rate and random.random() < config.error_rate:
+            stub.count("errors")
+            return self._send(random.choice(config.error_statuses), {"error": "injected failure"})
+
+        if parts.path == TRAIN_PATH:
+            items = _scaled(stub.dataset.trains(), config.scale)
+        else:
+            items = stub.dataset.information()
+        filters = [(key, value.split(",")) for key, value in query if key != "acl:consumerKey"]
+        if filters: items = [item for item in items if _matches(item, filters)]
+        stub.count("ok")
+        self._send(200, items)
+
+    def _send(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count("bytes", len(body))
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass # 1リクエストごとのログは出さない (負荷試験の邪魔になる)
+
+
+class ODPTStubServer(ThreadingHTTPServer):
+    """別スレッドで動く代役サーバ。start() で起動して base_url を環境変数に入れる。"""
+    daemon_threads = True
+
+    def __init__(self, dataset: StubDataset, config: Optional[StubConfig] = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _StubHandler)
+        self.dataset = dataset
+        self.config = config or StubConfig()
+        self.stats: Dict[str, int] = {"requests": 0, "ok": 0, "errors": 0, "unauthorized": 0, "bytes": 0}
+        self._stats_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def environment(self) -> Dict[str, str]:
+        """検知をこのサーバに向けるための環境変数 (odpt_client を import する前に設定する)"""
+        return {"ODPT_API_BASE": self.base_url, "ODPT_CHALLENGE_API_BASE": self.base_url}
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # 取得側がタイムアウトで先に切るのは負荷試験では普通に起きるので、スタックトレースは出さない
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)): return
+        super().handle_error(request, client_address)
+
+    def start(self) -> "ODPTStubServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="odpt-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--recorded", help="録画ディレクトリ (response_recorder) から返す")
+    parser.add_argument("--trains", help="odpt:Train として返すJSONファイル")
+    parser.add_argument("--info", help="odpt:TrainInformation として返すJSONファイル")
+    parser.add_argument("--latency", type=float, default=0.0, help="応答までの遅れ (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅れのゆらぎ (±秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="5xx を返す割合 (0〜1)")
+    parser.add_argument("--scale", type=int, default=1, help="列車を何倍に水増しするか")
+    parser.add_argument("--token", action="append", default=[], help="受け付ける acl:consumerKey (複数可、省略時は確認しない)")
+    args = parser.parse_args()
+
+    if args.recorded:
+        dataset: StubDataset = RecordedDataset(args.recorded)
+    else:
+        def load(path: Optional[str]) -> List[Dict[str, Any]]:
+            if not path: return []
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        dataset = StaticDataset(load(args.trains), load(args.info))
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, scale=args.scale, tokens=args.token)
+    server = ODPTStubServer(dataset, config, args.host, args.port)
+    print(f"--- [STUB] serving ODPT v4 stand-in at {server.base_url} ---", flush=True)
+    for key, value in server.environment().items():
+        print(f"{key}={value}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"--- [STUB] {server.stats} ---", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Iterable
+
+from jr_east_detector import check_jr_east_irregularities_async
+from tama_monorail_info_detector import check_tama_monorail_info_async
+from tokyo_metro_detector import check_tokyo_metro_info_async
+from toei_delay_watcher import check_toei_delay_increase_async
+from toei_detector import check_toei_irregularities_async
+from jr_east_info_detector import check_jr_east_info_async
+from jr_east_delay_watcher import check_delay_increase_async
+from tobu_delay_watcher import check_tobu_delay_increase_async
+from jr_destination_predictor import check_destination_predictions_async
+from toei_info_detector import check_toei_info_async
+import train_snapshot
+import last_good
+import odpt_client
+
+# ---------------------------------------------------------------
+# ▼▼▼ チェックの司令塔 (検知ごとの周期スケジューラ) ▼▼▼
+# ---------------------------------------------------------------
+# 在線情報 (odpt:Train) は数秒おきに変わるが、運行情報 (odpt:TrainInformation) は
+# 1時間に数回しか変わらない。全部を同じ12秒周期で回すのはAPIの無駄なので、
+# 検知ごとに「周期」と「優先度」を登録し、期限が来たものだけを同時に走らせる。
+# 1回の実行 (ティック) には締め切りを設け、超えたチェックは打ち切る。
+# 期限を何回分も過ぎていても、溜まった分をまとめて1回だけ実行する (取りこぼし分は貯めない)。
+# トークンの予算 (request_budget) が残り少ないときは、重要度の低いチェックを後回しにする。
+
+# --- 設定値 ---
+CYCLE_DEADLINE = 40.0       # 1ティックの締め切り (秒)。超えたチェックは打ち切る
+MAX_CONCURRENT_CHECKS = 4   # 同時に走らせるチェックの数
+WORKER_THREADS = 4          # 解析処理 (run_in_executor) に使うスレッドの数
+MIN_SLEEP = 1.0             # ティックの間の最低待ち時間 (秒)
+MIN_ADAPTIVE_GAP = 5.0      # dct:valid に合わせるときでも、これより短い間隔では取りに行かない
+MAX_ADAPTIVE_FACTOR = 4     # dct:valid に合わせて延ばすのは、登録周期のこの倍まで
+LOW_VALUE_PRIORITY = 30     # 優先度がこれ以上 (数字が大きい) のチェックは、予算が残り少なければ後回しにする
+LOW_BUDGET_FACTOR = 4       # 後回しにするときは、登録周期のこの倍だけ待つ
+
+POSITION_INTERVAL = 15      # 在線情報を使う検知
+INFO_INTERVAL = 60          # 運行情報 (JR東・メトロ・都営)
+TAMA_INTERVAL = 120         # 多摩モノ運行情報
+
+
+class CheckStage:
+    """スケジューラに登録された1つのチェック"""
+    __slots__ = ("name", "check", "interval", "priority", "operators", "depends_on", "tokens",
+                 "next_due", "runs", "coalesced", "throttled")
+
+    def __init__(self, name: str, check: Callable[[], Awaitable[Any]], interval: float, priority: int,
+                 operators: Iterable[str] = (), depends_on: Optional[str] = None, token: Optional[str] = None):
+        self.name = name
+        self.check = check
+        self.interval = interval
+        self.priority = priority          # 小さいほど先に枠を取る
+        self.operators = tuple(operators) # 使う在線スナップショットの事業者
+        self.depends_on = depends_on      # 同じティックで走るなら終わるのを待つチェック
+        # 使うトークン (在線スナップショットの取得先の分 + 自分で取りに行く分)
+        tokens = {train_snapshot.SNAPSHOT_SOURCES[operator]["token"] for operator in self.operators}
+        if token is not None: tokens.add(token)
+        self.tokens = tuple(tokens)
+        self.next_due = 0.0               # 0 = 起動直後にすぐ実行
+        self.runs = 0
+        self.coalesced = 0                # まとめて捨てた (取りこぼした) 実行の回数
+        self.throttled = 0                # 予算が残り少ないので後回しにした回数
+
+
+# 登録順 = 通知を並べる順番 (以前の逐次実行と同じ順)
+STAGES: Dict[str, CheckStage] = {}
+
+# 直近ティックの結果 (/status 用)
+last_cycle_report: Dict[str, Any] = {}
+
+# JR遅延監視に渡す、直近のJR運行情報 (運行情報は毎ティックは取りに行かないため)
+_latest_official_info: Dict[str, Dict[str, Any]] = {}
+OFFICIAL_INFO_KEY = "odpt:TrainInformation JR-East"
+
+_worker_pools: Dict[int, ThreadPoolExecutor] = {}
+
+
+def register_stage(name: str, check: Callable[[], Awaitable[Any]], interval: float, priority: int,
+                   operators: Iterable[str] = (), depends_on: Optional[str] = None,
+                   token: Optional[str] = None) -> CheckStage:
+    stage = CheckStage(name, check, interval, priority, operators, depends_on, token)
+    STAGES[name] = stage
+    return stage
+
+
+# --- 依存関係のあるチェック用のつなぎ ---
+async def _check_jr_east_info_stage() -> Any:
+    global _latest_official_info
+    result = await check_jr_east_info_async()
+    if result and result[0] is not None:
+        _latest_official_info = result[1] or {}
+        last_good.remember(OFFICIAL_INFO_KEY, _latest_official_info)
+    else:
+        # 取得に失敗したら、last_good.MAX_STALE_AGE 以内の前回の公式発表で判定を続ける
+        # (空にすると「運転見合わせ」発表済みの路線でも独自の通知を出してしまう)。古さは age で渡す
+        entry = last_good.recall(OFFICIAL_INFO_KEY)
+        _latest_official_info = last_good.StaleDict(entry.value, entry.age) if entry is not None else {}
+    return result
+
+
+async def _check_jr_delay_stage() -> Any:
+    return await check_delay_increase_async(_latest_official_info)
+
+
+JR = train_snapshot.JR_EAST_OPERATOR
+TOEI = train_snapshot.TOEI_OPERATOR
+TOBU = train_snapshot.TOBU_OPERATOR
+CHALLENGE_TOKEN = odpt_client.TOKEN_CHALLENGE
+TOEI_TOKEN = odpt_client.TOKEN_TOEI
+
+register_stage("jr_irregular", check_jr_east_irregularities_async, POSITION_INTERVAL, 10, operators=[JR])      # 1. JR東 非定期
+register_stage("jr_info", _check_jr_east_info_stage, INFO_INTERVAL, 20, token=CHALLENGE_TOKEN)                 # 2. JR東 運行情報
+register_stage("toei_irregular", check_toei_irregularities_async, POSITION_INTERVAL, 10, operators=[TOEI])     # 3. 都営 非定期
+register_stage("tama_info", check_tama_monorail_info_async, TAMA_INTERVAL, 40, token=TOEI_TOKEN)               # 4. 多摩モノ 運行情報
+register_stage("metro_info", check_tokyo_metro_info_async, INFO_INTERVAL, 30, token=TOEI_TOKEN)                # 5. 東京メトロ 運行情報
+register_stage("jr_delay", _check_jr_delay_stage, POSITION_INTERVAL, 10, operators=[JR], depends_on="jr_info") # 6. JR東日本 遅延増加監視
+register_stage("toei_delay", check_toei_delay_increase_async, POSITION_INTERVAL, 10, operators=[TOEI])         # 7. 都営 遅延増加監視
+register_stage("tobu_delay", check_tobu_delay_increase_async, POSITION_INTERVAL, 15, operators=[TOBU])         # 8. 東武 遅延増加監視
+register_stage("dest_prediction", check_destination_predictions_async, POSITION_INTERVAL, 15, operators=[JR])  # 9. JR 行先変更予測
+register_stage("toei_info", check_toei_info_async, INFO_INTERVAL, 30, token=TOEI_TOKEN)                        # 10. 都営 運行情報
+
+
+def _ensure_worker_pool(loop: asyncio.AbstractEventLoop) -> None:
+    """各チェックの run_in_executor(None, ...) が使うスレッド数を抑える"""
+    if id(loop) in _worker_pools: return
+    pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="check-worker")
+    loop.set_default_executor(pool)
+    _worker_pools[id(loop)] = pool
+
+
+def as_messages(result: Any) -> List[str]:
+    """各チェックの戻り値 (リスト / 1通 / (リスト, official_info)) を通知リストにそろえる"""
+    if not result: return []
+    if isinstance(result, tuple): result = result[0]
+    if not result: return []
+    if isinstance(result, str): return [result]
+    return list(result)
+
+
+def _budget_low(stage: CheckStage) -> bool:
+    """このチェックが使うトークンのどれかの予算が残り少ないか"""
+    return any(odpt_client.get_token_budget(token).is_low() for token in stage.tokens)
+
+
+def due_stages(now: Optional[float] = None) -> List[CheckStage]:
+    """
+    期限が来ているチェックを返し、次の期限を進める。溜まっていた回数分はまとめて1回にする。
+    予算が残り少ないトークンを使う、重要度の低いチェックは今回は見送って次の期限を先に延ばす。
+    """
+    if now is None: now = time.monotonic()
+    due: List[CheckStage] = []
+    for stage in STAGES.values():
+        if stage.next_due > now: continue
+        if stage.priority >= LOW_VALUE_PRIORITY and _budget_low(stage):
+            stage.throttled += 1
+            stage.next_due = now + stage.interval * LOW_BUDGET_FACTOR
+            print(f"--- [CYCLE] {stage.name}: token budget running low, postponed for {stage.interval * LOW_BUDGET_FACTOR:g}s ---", flush=True)
+            continue
+        due.append(stage)
+        if stage.next_due == 0.0:
+            stage.next_due = now + stage.interval
+            continue
+        missed = int((now - stage.next_due) // stage.interval)
+        stage.coalesced += missed
+        stage.next_due += (missed + 1) * stage.interval
+    return due
+
+
+def _adapt_to_freshness(stage: CheckStage, now: float) -> None:
+    """在線データの dct:valid が分かっていれば、次回はその更新直後に取りに行く"""
+    waits = [train_snapshot.seconds_until_refresh(operator) for operator in stage.operators]
+    waits = [wait for wait in waits if wait is not None]
+    if not waits: return # 目安が無ければ登録周期のまま
+    wait = min(max(max(waits), MIN_ADAPTIVE_GAP), stage.interval * MAX_ADAPTIVE_FACTOR)
+    stage.next_due = now + wait
+
+
+def seconds_until_next_due(now: Optional[float] = None) -> float:
+    if now is None: now = time.monotonic()
+    if not STAGES: return MIN_SLEEP
+    next_due = min(stage.next_due for stage in STAGES.values())
+    return max(next_due - now, MIN_SLEEP)
+
+
+async def run_check_cycle(stages: Optional[List[CheckStage]] = None, deadline: float = CYCLE_DEADLINE) -> List[str]:
+    """
+    指定されたチェック (省略時は全部) を同時に走らせ、送るべき通知を登録順に並べて返す。
+    締め切りまでに終わらなかったチェックはキャンセルして、ログと last_cycle_report に残す。
+    """
+    global last_cycle_report
+    if stages is None: stages = list(STAGES.values())
+    loop = asyncio.get_running_loop()
+    _ensure_worker_pool(loop)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+    cycle_start = time.monotonic()
+    elapsed: Dict[str, float] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run_stage(stage: CheckStage) -> Any:
+        dependency = tasks.get(stage.depends_on) if stage.depends_on else None
+        if dependency is not None:
+            # 依存先が終わるのだけを待つ (枠は握らずに待つので、他のチェックを止めない)
+            await asyncio.wait([dependency])
+        async with semaphore:
+            stage_start = time.monotonic()
+            try:
+                return await stage.check()
+            finally:
+                stage.runs += 1
+                elapsed[stage.name] = round(time.monotonic() - stage_start, 3)
+
+    # 在線データは枠の外で先に取りに行く (各チェックは同じサイクルのスナップショットを待つだけ)
+    train_snapshot.start_new_cycle()
+    operators = sorted({operator for stage in stages for operator in stage.operators})
+    prefetch = asyncio.ensure_future(train_snapshot.prefetch_snapshots_async(operators)) if operators else None
+    waiting = [prefetch] if prefetch is not None else []
+
+    # 優先度の高い順に起動する (Semaphore は待った順に枠を渡すので、この順で枠が埋まる)
+    for stage in sorted(stages, key=lambda s: s.priority):
+        tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+    waiting.extend(tasks.values())
+
+    remaining = deadline - (time.monotonic() - cycle_start)
+    _, pending = await asyncio.wait(waiting, timeout=max(remaining, 0))
+
+    # --- 締め切り超過分はキャンセル ---
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    all_notifications: List[str] = []
+    report: Dict[str, Dict[str, Any]] = {}
+    ordered = [name for name in STAGES if name in tasks]
+    for name in ordered:
+        task = tasks[name]
+        entry = {"status": "ok", "seconds": elapsed.get(name)}
+        if task in pending:
+            entry["status"] = "timeout"
+        elif task.exception() is not None:
+            entry["status"] = "error"
+            entry["error"] = repr(task.exception())
+            print(f"--- [CYCLE] ERROR: {name} failed: {task.exception()!r}", flush=True)
+        else:
+            all_notifications.extend(as_messages(task.result()))
+        report[name] = entry
+        if entry["status"] == "ok":
+            _adapt_to_freshness(STAGES[name], time.monotonic())
+
+    # 先取りの失敗も、チェックと同じくログと報告に残す (取得の失敗そのものは各スナップショットが受け止めている)
+    prefetch_entry: Optional[Dict[str, Any]] = None
+    if prefetch is not None:
+        prefetch_entry = {"status": "ok", "operators": operators}
+        if prefetch in pending:
+            prefetch_entry["status"] = "timeout"
+        elif prefetch.exception() is not None:
+            prefetch_entry["status"] = "error"
+            prefetch_entry["error"] = repr(prefetch.exception())
+            print(f"--- [CYCLE] ERROR: snapshot prefetch failed: {prefetch.exception()!r}", flush=True)
+
+    timed_out = [name for name in ordered if tasks[name] in pending]
+    if timed_out:
+        # スレッドに渡した解析処理そのものは止められないので、結果を捨てるだけになる
+        print(f"--- [CYCLE] WARNING: deadline ({deadline:g}s) exceeded, cancelled: {', '.join(timed_out)}", flush=True)
+
+    last_cycle_report = {
+        "finished_at": time.time(),
+        "seconds": round(time.monotonic() - cycle_start, 3),
+        "deadline": deadline,
+        "timed_out": timed_out,
+        "stages": report,
+        "prefetch": prefetch_entry,
+    }
+    return all_notifications
+
+
+async def run_due_checks(deadline: float = CYCLE_DEADLINE) -> List[str]:
+    """期限が来ているチェックだけを実行する。1つも無ければ空リストを返す。"""
+    stages = due_stages()
+    if not stages: return []
+    return await run_check_cycle(stages, deadline)
+
+
+async def send_notifications(channel: Any, messages: List[str]) -> None:
+    """通知を並んだ順に1通ずつ送り、送るのにかかった時間を last_cycle_report に残す"""
+    if not messages: return
+    send_start = time.monotonic()
+    for message in messages:
+        await channel.send(message)
+    last_cycle_report["sent"] = len(messages)
+    last_cycle_report["send_seconds"] = round(time.monotonic() - send_start, 3)
+
+
+def get_schedule_stats() -> Dict[str, Dict[str, Any]]:
+    now = time.monotonic()
+    return {
+        stage.name: {
+            "interval": stage.interval,
+            "priority": stage.priority,
+            "runs": stage.runs,
+            "coalesced": stage.coalesced,
+            "throttled": stage.throttled,
+            "next_due_in": round(max(stage.next_due - now, 0), 1),
+        }
+        for stage in STAGES.values()
+    }
@@ -0,0 +1,240 @@
+"""
+録画した ODPT 応答 (response_recorder) を仮想時間で再生し、全検知に流すツール
+
+    python replay.py <録画ディレクトリ> --log notifications.jsonl
+
+通信もスケジューラも使わず、録画の順に各検知の同期版へ直接データを渡すので、
+CPU の許す限りの速さで進む。時刻は clock の仮想時間 (録画時の受信時刻) を使うため、
+クールダウンや掃除も録画当時と同じように働く。
+同じ録画からは同じ通知ログ (と同じダイジェスト) ができる。
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import timezone, timedelta
+from typing import Dict, Any, List, Optional, Iterable, Callable, Tuple
+
+import clock
+import odpt_client
+import odpt_records
+import response_recorder
+import train_information
+import train_snapshot
+import snapshot_diff
+from periodic_checks import as_messages
+from jr_east_detector import check_jr_east_irregularities
+from jr_east_info_detector import check_jr_east_info
+from jr_east_delay_watcher import check_delay_increase
+from jr_destination_predictor import check_destination_predictions
+from toei_detector import check_toei_irregularities
+from toei_delay_watcher import check_toei_delay_increase
+from tobu_delay_watcher import check_tobu_delay_increase
+from toei_info_detector import check_toei_info
+from tokyo_metro_detector import check_tokyo_metro_info
+from tama_monorail_info_detector import check_tama_monorail_info
+
+JST = timezone(timedelta(hours=+9)) # 日本時間
+JR_INFO_OPERATOR = "odpt.Operator:jre-is"
+
+
+class _NullWriter:
+    """検知のログ出力を捨てる (print の量が再生速度を左右するため)"""
+    def write(self, text: str) -> int: return len(text)
+    def flush(self) -> None: pass
+
+
+class ReplayEngine:
+    """録画を1件ずつ受け取り、対応する検知に流して通知を集める"""
+
+    def __init__(self, quiet: bool = True):
+        self.quiet = quiet
+        self.notifications: List[Dict[str, Any]] = []
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_calls: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.records = 0
+        self.skipped = 0
+        self.first_time: Optional[float] = None
+        self.last_time: Optional[float] = None
+        self._cycle = 0
+        self._previous_date: Dict[str, float] = {}   # 事業者ごとの前回の dc:date (unchanged の判定)
+        self._diff_bases: Dict[str, Any] = {}        # 事業者ごとの差分の比較相手 (最後に更新のあったスナップショット)
+        self._previous_info: Dict[str, Any] = {}     # 事業者ごとの前回の運行情報 (NOT_MODIFIED の判定)
+        self._official_info: Dict[str, Any] = {}     # JR遅延監視に渡す直近のJR運行情報
+
+        official = lambda snapshot: check_delay_increase(self._official_info, snapshot)
+        # 在線情報の事業者ごとに、流す検知 (名前は periodic_checks のステージ名にそろえる)
+        self.train_checks: Dict[str, List[Tuple[str, Callable[[Any], Any]]]] = {
+            train_snapshot.JR_EAST_OPERATOR: [
+                ("jr_irregular", check_jr_east_irregularities),
+                ("jr_delay", official),
+                ("dest_prediction", check_destination_predictions),
+            ],
+            train_snapshot.TOEI_OPERATOR: [
+                ("toei_irregular", check_toei_irregularities),
+                ("toei_delay", check_toei_delay_increase),
+            ],
+            train_snapshot.TOBU_OPERATOR: [
+                ("tobu_delay", check_tobu_delay_increase),
+            ],
+        }
+        # 運行情報の事業者ごとの検知
+        self.info_checks: Dict[str, Tuple[str, Callable[[Any], Any]]] = {
+            JR_INFO_OPERATOR: ("jr_info", self._check_jr_info),
+            train_information.TOKYO_METRO_OPERATOR: ("metro_info", check_tokyo_metro_info),
+            train_information.TOEI_OPERATOR: ("toei_info", check_toei_info),
+            train_information.TAMA_MONORAIL_OPERATOR: ("tama_info", check_tama_monorail_info),
+        }
+
+    # --- 録画1件の振り分け ---
+    def feed(self, record: Dict[str, Any]) -> None:
+        self.records += 1
+        # 仮想時間は受信し終わった時刻で進める (録画の並び = 受信順なので、戻らないようにする)
+        received = record.get("fetched_at", 0) + record.get("latency", 0)
+        if self.last_time is not None: received = max(received, self.last_time)
+        if self.first_time is None: self.first_time = received
+        self.last_time = received
+        clock.set_virtual_time(received)
+
+        if record.get("status") != 200 or record.get("body") is None:
+            self.skipped += 1 # 取得失敗のサイクル。検知は何もしない (本番と同じ)
+            return
+        endpoint, params = record.get("endpoint", ""), record.get("params") or {}
+        operator = params.get("odpt:operator")
+        if endpoint.endswith("/odpt:Train") and operator in self.train_checks:
+            self._feed_trains(operator, record["body"], received)
+        elif endpoint.endswith("/odpt:TrainInformation"):
+            self._feed_information(operator, record["body"])
+        else:
+            self.skipped += 1 # 路線別の取得など、全体のスナップショットにならないもの
+
+    def _feed_trains(self, operator: str, body: str, received: float) -> None:
+        self._cycle += 1
+        try:
+            snapshot = train_snapshot.snapshot_from_json(operator, odpt_records.loads(body), received, self._cycle)
+        except (ValueError, *odpt_records.JSON_DECODE_ERRORS):
+            self.skipped += 1
+            return
+        previous = self._previous_date.get(operator)
+        if previous is not None and snapshot.data_date is not None:
+            snapshot.unchanged = snapshot.data_date <= previous
+        if snapshot.data_date is not None: self._previous_date[operator] = snapshot.data_date
+        if not snapshot.unchanged:
+            # 本番の _store_snapshot と同じく、前回からの差分を付けてから流す
+            snapshot_diff.defer(snapshot, self._diff_bases.get(operator))
+            self._diff_bases[operator] = snapshot
+        for name, check in self.train_checks[operator]:
+            self._run(name, check, snapshot)
+
+    def _feed_information(self, operator: Optional[str], body: str) -> None:
+        try:
+            info_data = odpt_records.loads(body)
+        except odpt_records.JSON_DECODE_ERRORS:
+            self.skipped += 1
+            return
+        if operator is None or "," in operator:
+            # まとめ取り (train_information) の録画は、事業者ごとに分けて流す
+            # (odpt:operator で3事業者を並べたものと、絞り込みなしで取っていた頃の録画)
+            parts = train_information.partition_by_operator(info_data).items()
+        else:
+            parts = [(operator, info_data)]
+        for part_operator, items in parts:
+            if part_operator not in self.info_checks: continue
+            # 本番の if_changed と同じく、前回と同じ中身なら NOT_MODIFIED を渡す
+            if self._previous_info.get(part_operator) == items:
+                items = odpt_client.NOT_MODIFIED
+            else:
+                self._previous_info[part_operator] = items
+            name, check = self.info_checks[part_operator]
+            self._run(name, check, items)
+
+    def _check_jr_info(self, info_data: Any) -> Any:
+        result = check_jr_east_info(info_data)
+        if result and result[0] is not None: self._official_info = result[1] or {}
+        return result
+
+    def _run(self, name: str, check: Callable[[Any], Any], data: Any) -> None:
+        output = _NullWriter() if self.quiet else sys.stdout
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(output):
+                result = check(data)
+        except Exception as e:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            print(f"--- [REPLAY] ERROR: {name} raised {e!r}", flush=True)
+            return
+        finally:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + time.perf_counter() - start
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+        for message in as_messages(result):
+            self.notifications.append({
+                "time": clock.now(JST).isoformat(timespec="seconds"),
+                "stage": name,
+                "message": message,
+            })
+
+    def run(self, records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            for record in records:
+                self.feed(record)
+        finally:
+            clock.use_real_time()
+        return self.summary(time.perf_counter() - start)
+
+    # --- 結果 ---
+    def log_lines(self) -> List[str]:
+        return [json.dumps(entry, ensure_ascii=False, sort_keys=True) for entry in self.notifications]
+
+    def digest(self) -> str:
+        """通知ログのダイジェスト。検知を変更したときに、結果が変わったかどうかをこれで比べる"""
+        hasher = hashlib.sha256()
+        for line in self.log_lines():
+            hasher.update(line.encode("utf-8") + b"\n")
+        return hasher.hexdigest()
+
+    def summary(self, wall_seconds: float) -> Dict[str, Any]:
+        span = (self.last_time - self.first_time) if self.records else 0.0
+        return {
+            "records": self.records,
+            "skipped": self.skipped,
+            "virtual_seconds": round(span, 1),
+            "wall_seconds": round(wall_seconds, 3),
+            "speedup": round(span / wall_seconds, 1) if wall_seconds > 0 else None,
+            "notifications": len(self.notifications),
+            "digest": self.digest(),
+            "errors": self.errors,
+            "stages": {
+                name: {"calls": self.stage_calls[name], "seconds": round(seconds, 4)}
+                for name, seconds in sorted(self.stage_seconds.items())
+            },
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="ODPT_RECORD_DIR に指定していた録画ディレクトリ")
+    parser.add_argument("--log", help="通知ログ (1行1件のJSON) の書き出し先")
+    parser.add_argument("--verbose", action="store_true", help="検知のログ出力も表示する")
+    args = parser.parse_args()
+
+    # 文字列の hash が毎回変わると、set を回す順番が変わって通知の並びが揺れる
+    if os.environ.get("PYTHONHASHSEED") != "0":
+        os.environ["PYTHONHASHSEED"] = "0"
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    engine = ReplayEngine(quiet=not args.verbose)
+    summary = engine.run(response_recorder.iter_records(args.directory))
+    if args.log:
+        with open(args.log, "w", encoding="utf-8") as f:
+            for line in engine.log_lines():
+                f.write(line + "\n")
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from typing import Deque, Dict, Any, Optional
+
+import requests
+
+# ---------------------------------------------------------------
+# ▼▼▼ トークンごとのリクエスト予算 ▼▼▼
+# ---------------------------------------------------------------
+# ODPTのトークンは2本 (JR東・東武用のチャレンジ用と、都営・メトロ・多摩モノ用)。
+# これまではトークンごとに1分・1日で何回呼んでいるかを誰も数えていなかった。
+# 通信のたびにここで数え、予算を超える呼び出しは通信せずに断る。
+# 予算が残り少なくなったら、司令塔 (periodic_checks) が重要度の低いチェックを後回しにする。
+
+JST = timezone(timedelta(hours=+9)) # 日本時間 (1日の予算は日本時間の0時に戻す)
+
+
+def _limit_from_env(name: str, default: int) -> Optional[int]:
+    """環境変数の上限を読む。未設定なら default、空か 0 なら制限なし (None)"""
+    value = os.getenv(name)
+    if value is None: return default
+    value = value.strip()
+    if not value or value == "0": return None
+    return int(value)
+
+
+# --- 設定値 ---
+# キーは odpt_client の統計表示用のトークン名。ここに無いトークンは数えるだけで制限しない
+# 環境変数 ODPT_BUDGET_<トークン名>_PER_MINUTE / _PER_DAY で上書きできる (空か 0 で制限なし)
+BUDGETS: Dict[str, Dict[str, Optional[int]]] = {
+    "challenge": {
+        "per_minute": _limit_from_env('ODPT_BUDGET_CHALLENGE_PER_MINUTE', 60),
+        "per_day": _limit_from_env('ODPT_BUDGET_CHALLENGE_PER_DAY', 40000),
+    },
+    "toei": {
+        "per_minute": _limit_from_env('ODPT_BUDGET_TOEI_PER_MINUTE', 60),
+        "per_day": _limit_from_env('ODPT_BUDGET_TOEI_PER_DAY', 40000),
+    },
+}
+LOW_BUDGET_RATIO = 0.2 # 残りがこの割合を切ったら「残り少ない」
+
+
+class BudgetExceededError(requests.exceptions.ConnectionError):
+    """予算を使い切ったので通信しなかった (既存の except RequestException で受けられる)"""
+
+
+class TokenBudget:
+    """1本のトークンの、1分間 (直近60秒) と1日 (日本時間) の呼び出し回数"""
+    __slots__ = ("name", "per_minute", "per_day", "_recent", "_day", "_day_count",
+                 "total", "rejected", "_lock")
+
+    def __init__(self, name: str, per_minute: Optional[int] = None, per_day: Optional[int] = None):
+        self.name = name
+        self.per_minute = per_minute # None = 制限なし
+        self.per_day = per_day
+        self._recent: Deque[float] = deque() # 直近60秒の呼び出し時刻 (time.monotonic)
+        self._day = ""
+        self._day_count = 0
+        self.total = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _roll(self, now: float) -> None:
+        while self._recent and now - self._recent[0] >= 60:
+            self._recent.popleft()
+        today = datetime.now(JST).strftime('%Y-%m-%d')
+        if today != self._day:
+            self._day, self._day_count = today, 0
+
+    def acquire(self) -> None:
+        """通信の前に呼ぶ。予算を超えるなら BudgetExceededError を投げる (数には入れない)。"""
+        with self._lock:
+            now = time.monotonic()
+            self._roll(now)
+            if self.per_minute is not None and len(self._recent) >= self.per_minute:
+                self.rejected += 1
+                wait = 60 - (now - self._recent[0])
+                raise BudgetExceededError(f"per-minute budget exhausted for {self.name} token (retry in {wait:.0f}s)")
+            if self.per_day is not None and self._day_count >= self.per_day:
+                self.rejected += 1
+                raise BudgetExceededError(f"daily budget exhausted for {self.name} token")
+            self._recent.append(now)
+            self._day_count += 1
+            self.total += 1
+
+    def remaining_ratio(self) -> float:
+        """1分・1日のうち、厳しい方の残りの割合 (0〜1)"""
+        with self._lock:
+            self._roll(time.monotonic())
+            ratios = [1.0]
+            if self.per_minute: ratios.append((self.per_minute - len(self._recent)) / self.per_minute)
+            if self.per_day: ratios.append((self.per_day - self._day_count) / self.per_day)
+            return max(min(ratios), 0.0)
+
+    def is_low(self) -> bool:
+        return self.remaining_ratio() < LOW_BUDGET_RATIO
+
+    def snapshot(self) -> Dict[str, Any]:
+        remaining = self.remaining_ratio()
+        with self._lock:
+            return {
+                "last_minute": len(self._recent),
+                "per_minute": self.per_minute,
+                "today": self._day_count,
+                "per_day": self.per_day,
+                "remaining_ratio": round(remaining, 3),
+                "total": self.total,
+                "rejected": self.rejected,
+            }
+
+
+_budgets: Dict[str, TokenBudget] = {}
+_budgets_lock = threading.Lock()
+
+
+def get_budget(name: str) -> TokenBudget:
+    """トークン名ごとの予算を返す (BUDGETS に無ければ、数えるだけのもの)"""
+    with _budgets_lock:
+        budget = _budgets.get(name)
+        if budget is None:
+            limits = BUDGETS.get(name, {})
+            budget = _budgets[name] = TokenBudget(name, limits.get("per_minute"), limits.get("per_day"))
+    return budget
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    with _budgets_lock:
+        budgets = list(_budgets.values())
+    return {budget.name: budget.snapshot() for budget in budgets}
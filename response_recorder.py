@@ -0,0 +1,271 @@
+import atexit
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, Optional, Iterator, List
+from urllib.parse import urlsplit, parse_qsl
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ---------------------------------------------------------------
+# ▼▼▼ ODPT応答の録画係 (任意) ▼▼▼
+# ---------------------------------------------------------------
+# 検知の調整やベンチマークには本物の通信データが欲しい。
+# 環境変数 ODPT_RECORD_DIR を設定したときだけ、odpt_client が受け取った応答を
+# 1行1件のJSON (エンドポイント・パラメータ (トークンは伏せる)・取得時刻・所要時間・本体) にして、
+# 圧縮したファイルに追記していく。
+# 書き込みと圧縮は専用のスレッドでやるので、通信する側はキューに入れるだけで待たない。
+# ファイルは大きさと経過時間で切り替え、全体の容量を超えたら古いものから消す。
+
+JST = timezone(timedelta(hours=+9)) # 日本時間
+
+# --- 設定値 ---
+RECORD_DIR = os.getenv('ODPT_RECORD_DIR') # 設定されていれば録画する
+COMPRESSION = "zstd" if zstandard is not None else "gzip"
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024   # 1ファイルの大きさの上限 (圧縮後)
+SEGMENT_MAX_AGE = 60 * 60              # 1ファイルに書き続ける時間の上限 (秒)
+MAX_TOTAL_BYTES = 512 * 1024 * 1024    # 録画全体の容量の上限。超えたら古いファイルから消す
+QUEUE_SIZE = 256                       # 書き込み待ちの上限。あふれた分は捨てる (通信側を待たせない)
+
+SEGMENT_PREFIX = "odpt-"
+REDACTED = "***"
+_STOP = object()
+
+
+def _redact_params(url: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """URLのクエリとパラメータをまとめ、トークンを伏せる"""
+    merged: Dict[str, Any] = dict(parse_qsl(urlsplit(url).query))
+    merged.update({k: v for k, v in (params or {}).items() if v is not None})
+    if "acl:consumerKey" in merged:
+        merged["acl:consumerKey"] = REDACTED
+    return merged
+
+
+def _endpoint(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+class _Segment:
+    """書き込み中の1ファイル"""
+    __slots__ = ("path", "opened_at", "raw", "writer", "records")
+
+    def __init__(self, directory: str, sequence: int):
+        extension = "zst" if COMPRESSION == "zstd" else "gz"
+        name = f"{SEGMENT_PREFIX}{datetime.now(JST):%Y%m%d-%H%M%S}-{sequence:04d}.jsonl.{extension}"
+        self.path = os.path.join(directory, name)
+        self.opened_at = time.monotonic()
+        self.raw = open(self.path, "wb")
+        if COMPRESSION == "zstd":
+            self.writer = zstandard.ZstdCompressor(level=3).stream_writer(self.raw, closefd=False)
+        else:
+            self.writer = gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=6)
+        self.records = 0
+
+    def write(self, line: bytes) -> None:
+        self.writer.write(line)
+        self.records += 1
+
+    def size(self) -> int:
+        return self.raw.tell() # 圧縮器の中に溜まっている分は入らないので目安
+
+    def is_full(self) -> bool:
+        return self.size() >= SEGMENT_MAX_BYTES or time.monotonic() - self.opened_at >= SEGMENT_MAX_AGE
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        finally:
+            if not self.raw.closed: self.raw.close() # 圧縮器の書き出しに失敗しても、ファイルは閉じる
+
+
+class ResponseRecorder:
+    """キューに入った応答を、専用スレッドで圧縮ファイルに書き出す"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=QUEUE_SIZE)
+        self._segment: Optional[_Segment] = None
+        self._sequence = 0
+        self.written = 0
+        self.dropped = 0
+        self.deleted_segments = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="odpt-recorder", daemon=True)
+        self._thread.start()
+        print(f"--- [RECORDER] recording ODPT responses to {directory} ({COMPRESSION}) ---", flush=True)
+
+    def record(self, url: str, params: Optional[Dict[str, Any]], status: int, body: Optional[bytes],
+               fetched_at: float, latency: float) -> None:
+        """通信した側から呼ぶ。キューに入れるだけで、JSON化も圧縮もしない。"""
+        try:
+            self._queue.put_nowait((url, params, status, body, fetched_at, latency))
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """溜まっている分を書き切ってからファイルを閉じる"""
+        if not self._thread.is_alive(): return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # --- ここから下は録画スレッドの中だけで動く ---
+    def _run(self) -> None:
+        # 再起動のたびに書きかけのファイルが1つずつ増えるので、最初のファイルを開く前にも上限を確かめる
+        self._check_disk_cap()
+        while True:
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                item = None # 通信が無い間も、時間でのファイル切り替えは進める
+            if item is _STOP: break
+            try:
+                if item is not None: self._write(item)
+                if self._segment is not None and self._segment.is_full(): self._rotate()
+            except OSError as e:
+                print(f"--- [RECORDER] ERROR: {e}", flush=True)
+                self._discard_segment() # 壊れたファイルは使い続けず、次の書き込みで新しいファイルを開く
+        if self._segment is not None:
+            try:
+                self._segment.close()
+            except OSError as e:
+                print(f"--- [RECORDER] ERROR: {e}", flush=True)
+            self._segment = None
+        self._check_disk_cap()
+
+    def _write(self, item: tuple) -> None:
+        url, params, status, body, fetched_at, latency = item
+        line = json.dumps({
+            "endpoint": _endpoint(url),
+            "params": _redact_params(url, params),
+            "fetched_at": fetched_at,
+            "latency": round(latency, 4),
+            "status": status,
+            "body": body.decode("utf-8", "replace") if body is not None else None,
+        }, ensure_ascii=False)
+        if self._segment is None:
+            self._sequence += 1
+            self._segment = _Segment(self.directory, self._sequence)
+        self._segment.write(line.encode("utf-8") + b"\n")
+        self.written += 1
+
+    def _rotate(self) -> None:
+        segment, self._segment = self._segment, None
+        segment.close()
+        print(f"--- [RECORDER] closed {os.path.basename(segment.path)} ({segment.records} responses) ---", flush=True)
+        self._enforce_disk_cap()
+
+    def _discard_segment(self) -> None:
+        segment, self._segment = self._segment, None
+        if segment is None: return
+        try:
+            segment.close()
+        except OSError:
+            pass # 書けなくなったファイルなので、閉じられなくても諦める
+        print(f"--- [RECORDER] abandoned {os.path.basename(segment.path)} after a write error ---", flush=True)
+
+    def _check_disk_cap(self) -> None:
+        """ファイルを切り替えるとき以外 (起動直後・終了時) に上限を確かめる"""
+        try:
+            self._enforce_disk_cap()
+        except OSError as e:
+            print(f"--- [RECORDER] ERROR: {e}", flush=True)
+
+    def _enforce_disk_cap(self) -> None:
+        segments = list_segments(self.directory)
+        total = sum(os.path.getsize(path) for path in segments)
+        for path in segments: # 名前 = 作った時刻順なので、古いものから消す
+            if total <= MAX_TOTAL_BYTES: break
+            size = os.path.getsize(path)
+            os.remove(path)
+            total -= size
+            self.deleted_segments += 1
+            print(f"--- [RECORDER] disk cap reached, deleted {os.path.basename(path)} ---", flush=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        segments = list_segments(self.directory)
+        return {
+            "directory": self.directory,
+            "compression": COMPRESSION,
+            "written": self.written,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(path) for path in segments),
+            "deleted_segments": self.deleted_segments,
+        }
+
+
+_recorder: Optional[ResponseRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def start(directory: str) -> ResponseRecorder:
+    """録画を始める (ODPT_RECORD_DIR を使わずに、ベンチマークなどから明示的に始めるとき)"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = ResponseRecorder(directory)
+    return _recorder
+
+
+def stop() -> None:
+    global _recorder
+    with _recorder_lock:
+        recorder, _recorder = _recorder, None
+    if recorder is not None: recorder.stop()
+
+
+def get_recorder() -> Optional[ResponseRecorder]:
+    """録画中なら録画係を返す (録画しないなら None)"""
+    if _recorder is None and RECORD_DIR:
+        return start(RECORD_DIR)
+    return _recorder
+
+
+def get_stats() -> Optional[Dict[str, Any]]:
+    return _recorder.snapshot() if _recorder is not None else None
+
+
+atexit.register(stop)
+
+
+# ---------------------------------------------------------------
+# ▼▼▼ 読み出し (再生・ベンチマーク用) ▼▼▼
+# ---------------------------------------------------------------
+def list_segments(directory: str) -> List[str]:
+    """録画ファイルを古い順に返す"""
+    if not os.path.isdir(directory): return []
+    names = sorted(name for name in os.listdir(directory)
+                   if name.startswith(SEGMENT_PREFIX) and name.endswith((".jsonl.gz", ".jsonl.zst")))
+    return [os.path.join(directory, name) for name in names]
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8")
+    return gzip.open(path, "rt", encoding="utf-8")
+
+
+def iter_records(directory: str) -> Iterator[Dict[str, Any]]:
+    """録画した応答を古い順に1件ずつ返す (書き込み途中で切れた最後の行は捨てる)"""
+    for path in list_segments(directory):
+        try:
+            with _open_text(path) as stream:
+                for line in stream:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+        except (OSError, EOFError) as e:
+            print(f"--- [RECORDER] WARNING: could not read {os.path.basename(path)}: {e}", flush=True)
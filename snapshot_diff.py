@@ -0,0 +1,202 @@
+import itertools
+import threading
+from itertools import compress
+from operator import attrgetter, ne
+from typing import Dict, Any, List, Optional, Tuple
+
+# ---------------------------------------------------------------
+# ▼▼▼ 前回のスナップショットとの差分 (サイクルごとに1回だけ作る) ▼▼▼
+# ---------------------------------------------------------------
+# 非定期検知・遅延監視・行先予測は、それぞれ全列車をなめて「新しく出てきたか」
+# 「動いたか」「遅延が変わったか」を自分で見直していた。ここで前回と今回を1回だけ比べ、
+# 路線ごとに 出現 / 消滅 / 移動 / 遅延の変化 / 種別・行先などの変化 に分けて配る
+# (移動・遅延・種別などは、その路線で最初に見られたときに比べる。使わない分は比べない)。
+# 利用者は「前回自分が見たスナップショットからの差分か」を generation で確かめ、
+# 違えば (初回・途中で失敗した・同じ列番が2本ある など) 今までどおり全部を見る。
+# 比べるのは最初に changes_of() されたとき (解析スレッドで1回だけ)。差分を作るのは全列車を
+# 1回なめるくらいの手間がかかるので、それより安く済む遅延監視は、他の利用者が作ったときだけ使う。
+
+_generations = itertools.count(1)
+_lock = threading.Lock()
+
+
+_train_number = attrgetter("train_number")
+_location = attrgetter("from_station", "to_station")
+_delay = attrgetter("delay")
+# 非定期検知の専門家が見る項目 (これが変わらなければ判定も変わらない)
+_profile = attrgetter("train_type", "destination_station", "rail_direction", "car_composition")
+
+
+def _changed(trains: Any, previous: List[Any], key: Any) -> List[Any]:
+    """並びをそろえた前回の列車と比べて、key の値が変わった列車"""
+    return list(compress(trains, map(ne, map(key, trains), map(key, previous))))
+
+
+class RailwayChanges:
+    """1路線分の変化。どれも今回の列車 (vanished だけは前回の列車)、並びはスナップショットの順"""
+    __slots__ = ("appeared", "vanished", "positions", "_trains", "_aligned", "_moved", "_delay_changed", "_retyped")
+
+    def __init__(self, positions: Dict[str, int], trains: Any = (), aligned: Any = ()):
+        self.appeared: List[Any] = []  # 前回この路線にいなかった列番
+        self.vanished: List[Any] = []  # 今回この路線にいない列番
+        self.positions = positions     # 列番 → snapshot.for_railway(路線) の中での位置
+        self._trains = trains
+        self._aligned = aligned        # 今回の並びにそろえた前回の列車 (前回いなかった列車は自分自身 = 変化なし)
+        self._moved: Optional[List[Any]] = None
+        self._delay_changed: Optional[List[Any]] = None
+        self._retyped: Optional[List[Any]] = None
+
+    @property
+    def moved(self) -> List[Any]:
+        """fromStation / toStation が変わった"""
+        if self._moved is None: self._moved = _changed(self._trains, self._aligned, _location)
+        return self._moved
+
+    @property
+    def delay_changed(self) -> List[Any]:
+        """遅延 (秒) が変わった"""
+        if self._delay_changed is None: self._delay_changed = _changed(self._trains, self._aligned, _delay)
+        return self._delay_changed
+
+    @property
+    def retyped(self) -> List[Any]:
+        """種別・行先・方向・両数のどれかが変わった"""
+        if self._retyped is None: self._retyped = _changed(self._trains, self._aligned, _profile)
+        return self._retyped
+
+
+_NO_CHANGES = RailwayChanges({})
+
+
+class SnapshotDiff:
+    """
+    1つのスナップショットの、前回からの差分 (changes_of(snapshot))。base_generation が前回分の generation。
+    列番が重なっている路線は for_railway が None を返す (利用者はその路線を全部見る)。
+    """
+    __slots__ = ("generation", "base_generation", "railways", "rows", "complete", "_positions")
+
+    def __init__(self, positions: Dict[str, Optional[Dict[str, int]]], rows: Optional[Dict[str, int]]):
+        self.generation = next(_generations)
+        self.base_generation: Optional[int] = None # 比べた相手が無ければ None
+        self.railways: Dict[str, Optional[RailwayChanges]] = {}
+        self.rows = rows # 列番 → snapshot.trains の中での行 (事業者全体で列番が重なっていれば None)
+        self.complete = False # 前回と比べてあり、前回も今回も事業者全体で列番が重なっていない
+        self._positions = positions # 路線 → (列番 → 位置)。次の回の比較に使う。列番が重なっていれば None
+
+    def for_railway(self, line_id: str) -> Optional[RailwayChanges]:
+        return self.railways.get(line_id, _NO_CHANGES)
+
+    def summary(self) -> Dict[str, int]:
+        counts = {"appeared": 0, "vanished": 0, "moved": 0, "delay_changed": 0, "retyped": 0}
+        for changes in self.railways.values():
+            if changes is None: continue
+            for name in counts: counts[name] += len(getattr(changes, name))
+        return counts
+
+
+def _number_index(trains: Any) -> Optional[Dict[str, int]]:
+    """列番 → 位置。列番の無い列車は入れない。同じ列番が2本あれば None"""
+    numbers = list(map(_train_number, trains))
+    index = dict(zip(numbers, range(len(numbers))))
+    unnumbered = numbers.count(None) + numbers.count("")
+    if len(index) != len(numbers) - unnumbered + (None in index) + ("" in index): return None
+    index.pop(None, None)
+    index.pop("", None)
+    return index
+
+
+def _index(snapshot: Any) -> Tuple[Dict[str, Optional[Dict[str, int]]], Optional[Dict[str, int]]]:
+    """路線ごとの 列番 → 位置 と、事業者全体の 列番 → 行"""
+    positions = {line_id: _number_index(line_trains) for line_id, line_trains in snapshot.by_railway.items()}
+    return positions, _number_index(snapshot.trains)
+
+
+def diff_snapshots(base: Any, current: Any) -> SnapshotDiff:
+    """current と base (前回の利用者が見たスナップショット、無ければ None) を比べる"""
+    positions, rows = _index(current)
+    diff = SnapshotDiff(positions, rows)
+    base_diff = computed_changes(base) if base is not None else None
+    if base_diff is None: return diff
+    diff.base_generation = base_diff.generation
+    base_positions = base_diff._positions
+
+    for line_id in positions.keys() | base_positions.keys():
+        line_positions = positions.get(line_id, {})
+        previous_positions = base_positions.get(line_id, {})
+        if line_positions is None or previous_positions is None:
+            diff.railways[line_id] = None
+            continue
+        line_trains = current.for_railway(line_id)
+        previous_trains = base.for_railway(line_id)
+        aligned = list(map(previous_positions.get, map(_train_number, line_trains)))
+        appeared: List[Any] = []
+        if None in aligned:
+            appeared = [train for train, position in zip(line_trains, aligned) if position is None and train.train_number]
+            aligned = [train if position is None else previous_trains[position] for train, position in zip(line_trains, aligned)]
+        else:
+            aligned = list(map(previous_trains.__getitem__, aligned))
+        changes = RailwayChanges(line_positions, line_trains, aligned)
+        changes.appeared = appeared
+        if len(previous_positions) != len(line_positions) - len(changes.appeared):
+            changes.vanished = [previous_trains[position] for train_number, position in previous_positions.items()
+                                if train_number not in line_positions]
+        diff.railways[line_id] = changes
+    diff.complete = rows is not None and base_diff.rows is not None
+    return diff
+
+
+class PendingDiff:
+    """スナップショットに付けておく、まだ作っていない差分 (snapshot.diff_state)"""
+    __slots__ = ("base", "result", "done")
+
+    def __init__(self, base: Any):
+        self.base = base # 比べる相手。差分を作ったら手放す
+        self.result: Optional[SnapshotDiff] = None
+        self.done = False
+
+
+def defer(snapshot: Any, base: Any) -> None:
+    """スナップショットを保存するときに呼ぶ。base (前回の更新のあったスナップショット) と比べるのは使われたとき"""
+    with _lock:
+        previous = getattr(base, "diff_state", None)
+        if previous is not None and not previous.done:
+            # 前回分は誰も使わなかったので、もう作らない (前々回のスナップショットを持ち続けないように)
+            previous.base = None
+            previous.done = True
+        snapshot.diff_state = PendingDiff(base)
+
+
+def changes_of(snapshot: Any) -> Optional[SnapshotDiff]:
+    """snapshot の差分 (まだなら、ここで作る)。defer() されていなければ None"""
+    state = getattr(snapshot, "diff_state", None)
+    if state is None: return None
+    if not state.done:
+        with _lock:
+            if not state.done:
+                state.result = diff_snapshots(state.base, snapshot)
+                state.base = None
+                state.done = True
+    return state.result
+
+
+def computed_changes(snapshot: Any) -> Optional[SnapshotDiff]:
+    """もう作ってあれば snapshot の差分、まだなら None (ここでは作らない)"""
+    state = getattr(snapshot, "diff_state", None)
+    return state.result if state is not None and state.done else None
+
+
+def changes_since(snapshot: Any, generation: Optional[int], compute: bool = True) -> Optional[SnapshotDiff]:
+    """
+    利用者が前回見た generation からの差分なら返す。そうでなければ None (全部見直す)。
+    compute=False なら、まだ誰も作っていないときも None。
+    """
+    # 前回の記録が無くても作っておく (次の回は、これと比べた差分が使える)
+    changes = changes_of(snapshot) if compute else computed_changes(snapshot)
+    if changes is None or generation is None or changes.base_generation != generation: return None
+    return changes
+
+
+def generation_of(snapshot: Any) -> Optional[int]:
+    """利用者が見終えたときに記録する値 (差分が作られていなければ None = 次の回は全部見る)"""
+    changes = computed_changes(snapshot)
+    return changes.generation if changes is not None else None
@@ -0,0 +1,365 @@
+"""
+本物に近い odpt:Train / odpt:TrainInformation を作る合成データ生成器 (負荷試験・ベンチマーク用)
+
+    python synthetic_odpt.py --trains 6000 --steps 240 --stoppage ChuoRapid:40 --record /tmp/synthetic
+    python synthetic_odpt.py --trains 6000 --serve --port 8765
+
+列車数・路線の配分・遅延の分布を指定でき、運転見合わせ (決まった toStation の手前で
+odpt:delay が増え続ける列車と、その後続) を仕込める。運行情報の文章は
+jr_east_info_detector の正規表現が読める形 (「○○駅～○○駅間で△△の影響で、運転を見合わせています。」など) で作る。
+路線・駅・定期の行先は各検知モジュールの辞書から取るので、定期列車は「定期」と判定される。
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+from odpt_records import Train, trains_from_json
+
+JST = timezone(timedelta(hours=+9)) # 日本時間
+
+JR_EAST_OPERATOR = "odpt.Operator:JR-East"
+TOEI_OPERATOR = "odpt.Operator:Toei"
+TOBU_OPERATOR = "odpt.Operator:Tobu"
+JR_INFO_OPERATOR = "odpt.Operator:jre-is"
+
+# 遅延 (秒) の分布。引数は乱数生成器
+DELAY_DISTRIBUTIONS: Dict[str, Callable[[random.Random], int]] = {
+    "punctual": lambda rng: 0 if rng.random() < 0.95 else 60,
+    "normal": lambda rng: 0 if rng.random() < 0.7 else 60 * min(int(rng.expovariate(1 / 2.0)) + 1, 15),
+    "disrupted": lambda rng: 0 if rng.random() < 0.3 else 60 * min(int(rng.expovariate(1 / 8.0)) + 1, 60),
+}
+
+CAUSES = ["人身事故", "線路内人立入", "車両点検", "信号トラブル", "急病人救護", "踏切安全確認"]
+
+
+class LineProfile:
+    """1路線分の、駅の並びと定期の運行パターン"""
+    __slots__ = ("railway", "operator", "stations", "station_names", "trips", "number_suffix")
+
+    def __init__(self, railway: str, operator: str, stations: List[str], station_names: Dict[str, str],
+                 trips: List[Tuple[str, Optional[str], str]], number_suffix: str):
+        self.railway = railway
+        self.operator = operator
+        self.stations = stations             # 駅の英語名 (odpt.Station の末尾) を路線の順に
+        self.station_names = station_names   # 英語名 → 日本語名
+        self.trips = trips                   # (種別, 方向 (None = 上下どちらでも), 行先の英語名)
+        self.number_suffix = number_suffix
+
+    def station_id(self, name: str) -> str:
+        company, line = self.railway.split(":")[-1].rsplit(".", 1)
+        return f"odpt.Station:{company}.{line}.{name}"
+
+
+def _profiles_from(lines: List[Dict[str, Any]], operator: str, station_dict: Dict[str, str],
+                   station_lists: Dict[str, Dict[str, Any]], default_type: str, number_suffix: str) -> List[LineProfile]:
+    ja_to_en = {ja: en for en, ja in station_dict.items()}
+    profiles: List[LineProfile] = []
+    for config in lines:
+        railway = config["id"]
+        trips: List[Tuple[str, Optional[str], str]] = []
+        for first, dest in sorted(config.get("regular_trips", ())): # set のままだと実行ごとに順番が変わる
+            if first.startswith("odpt.TrainType:"): trips.append((first, None, dest))
+            else: trips.append((default_type, first, dest)) # 山手線などは (方向, 行先)
+        stations = [ja_to_en[ja] for ja in station_lists.get(railway, {}).get("stations", []) if ja in ja_to_en]
+        if len(stations) < 2: stations = sorted({dest for _, _, dest in trips})
+        if len(stations) < 2 or not trips: continue
+        profiles.append(LineProfile(railway, operator, stations, station_dict, trips, number_suffix))
+    return profiles
+
+
+def default_profiles(operator: str = JR_EAST_OPERATOR) -> List[LineProfile]:
+    """各検知モジュールの監視対象路線から、路線の一覧を作る"""
+    if operator == JR_EAST_OPERATOR:
+        from jr_east_detector import JR_LINES_TO_MONITOR, STATION_DICT
+        from jr_east_info_detector import JR_LINE_PREDICTION_DATA
+        return _profiles_from(JR_LINES_TO_MONITOR, operator, STATION_DICT, JR_LINE_PREDICTION_DATA,
+                              "odpt.TrainType:JR-East.Local", "M")
+    if operator == TOEI_OPERATOR:
+        from toei_detector import TOEI_LINES_TO_MONITOR, STATION_DICT
+        return _profiles_from(TOEI_LINES_TO_MONITOR, operator, STATION_DICT, {}, "odpt.TrainType:Toei.Local", "T")
+    if operator == TOBU_OPERATOR:
+        from tobu_delay_watcher import TOBU_LINE_NAMES, TOBU_STATION_DICT, TOBU_LINE_PREDICTION_DATA
+        lines = []
+        ja_to_en = {ja: en for en, ja in TOBU_STATION_DICT.items()}
+        for railway in TOBU_LINE_NAMES:
+            names = [ja_to_en[ja] for ja in TOBU_LINE_PREDICTION_DATA.get(railway, {}).get("stations", []) if ja in ja_to_en]
+            if len(names) >= 2:
+                lines.append({"id": railway, "regular_trips": {("odpt.TrainType:Tobu.Local", names[0]), ("odpt.TrainType:Tobu.Local", names[-1])}})
+        return _profiles_from(lines, operator, TOBU_STATION_DICT, TOBU_LINE_PREDICTION_DATA, "odpt.TrainType:Tobu.Local", "")
+    raise ValueError(f"unknown operator: {operator}")
+
+
+class Stoppage:
+    """運転見合わせ。先頭の列車が toStation の手前で止まり、遅延が毎回 rise 秒ずつ増える。"""
+    __slots__ = ("railway", "start_step", "end_step", "rise", "followers", "cause", "resume_steps")
+
+    def __init__(self, railway: str, start_step: int, end_step: Optional[int] = None, rise: int = 60,
+                 followers: int = 4, cause: str = "人身事故", resume_steps: Optional[int] = None):
+        self.railway = railway
+        self.start_step = start_step
+        self.end_step = end_step           # None = 最後まで止まったまま
+        self.rise = rise                   # 1回ごとに増える遅延 (秒)
+        self.followers = followers         # 一緒に止まる後続列車の数
+        self.cause = cause
+        self.resume_steps = resume_steps   # 見合わせ開始から、運転再開見込が発表されるまでの回数
+
+    def active(self, step: int) -> bool:
+        return step >= self.start_step and (self.end_step is None or step < self.end_step)
+
+
+class _SyntheticTrain:
+    __slots__ = ("number", "line", "trip", "direction", "start", "base_delay")
+
+    def __init__(self, number: str, line: LineProfile, trip: Tuple[str, Optional[str], str],
+                 direction: str, start: int, base_delay: int):
+        self.number = number
+        self.line = line
+        self.trip = trip
+        self.direction = direction
+        self.start = start
+        self.base_delay = base_delay
+
+
+class SyntheticNetwork:
+    """
+    1事業者分の合成データ。step (0, 1, 2, ...) ごとに在線情報と運行情報を返す。
+    同じ引数なら、何度作っても同じデータになる。
+    """
+
+    def __init__(self, operator: str = JR_EAST_OPERATOR, num_trains: int = 600,
+                 line_mix: Optional[Dict[str, float]] = None, delay_distribution: str = "normal",
+                 irregular_rate: float = 0.02, seed: int = 1, interval: int = 15,
+                 start_time: Optional[float] = None, profiles: Optional[List[LineProfile]] = None):
+        self.operator = operator
+        self.interval = interval
+        self.start_time = start_time if start_time is not None else datetime(2025, 1, 6, 7, 0, tzinfo=JST).timestamp()
+        self.stoppages: List[Stoppage] = []
+        rng = random.Random(seed)
+        delay_of = DELAY_DISTRIBUTIONS[delay_distribution]
+
+        self.lines = profiles if profiles is not None else default_profiles(operator)
+        if line_mix: # {路線ID (末尾だけでも可): 重み}。書かれていない路線は走らせない
+            weights = [line_mix.get(line.railway, line_mix.get(line.railway.split(".")[-1], 0)) for line in self.lines]
+        else:
+            weights = [1.0] * len(self.lines)
+        if not any(weights): raise ValueError("line_mix does not match any line")
+
+        # --- 列車の割り当て (路線ごとに番号順) ---
+        self.trains: List[_SyntheticTrain] = []
+        for index in range(num_trains):
+            line = rng.choices(self.lines, weights)[0]
+            trip = rng.choice(line.trips)
+            if rng.random() < irregular_rate:
+                trip = (trip[0], trip[1], rng.choice(line.stations)) # 定期にない行先 (非定期の検知対象)
+            direction = trip[1] or rng.choice(["odpt.RailDirection:Inbound", "odpt.RailDirection:Outbound"])
+            start = rng.randrange(len(line.stations) - 1)
+            self.trains.append(_SyntheticTrain(f"{index}{line.number_suffix}", line, trip, direction, start, delay_of(rng)))
+
+    def add_stoppage(self, railway: str, start_step: int, **options: Any) -> Stoppage:
+        """運転見合わせを仕込む (railway は路線IDか、その末尾 (例: "ChuoRapid"))"""
+        for line in self.lines:
+            if railway in (line.railway, line.railway.split(".")[-1]):
+                stoppage = Stoppage(line.railway, start_step, **options)
+                self.stoppages.append(stoppage)
+                return stoppage
+        raise ValueError(f"unknown railway: {railway}")
+
+    def time_at(self, step: int) -> float:
+        return self.start_time + step * self.interval
+
+    def _iso(self, step: int) -> str:
+        return datetime.fromtimestamp(self.time_at(step), JST).isoformat()
+
+    # --- odpt:Train ---
+    def trains_at(self, step: int) -> List[Dict[str, Any]]:
+        date, valid = self._iso(step), self._iso(step + 1)
+        stopped = self._stopped_trains(step)
+        result: List[Dict[str, Any]] = []
+        for train in self.trains:
+            line = train.line
+            stations = line.stations
+            hold = stopped.get(train.number)
+            if hold is not None:
+                position, delay = hold
+                moving = True # 駅間で止まっている (toStation は変わらない)
+            else:
+                position = (train.start + step // 2) % (len(stations) - 1)
+                delay = train.base_delay
+                moving = step % 2 == 1
+            train_type, _, destination = train.trip
+            result.append({
+                "@id": f"urn:ucode:synthetic:{line.operator}:{train.number}",
+                "@type": "odpt:Train",
+                "dc:date": date,
+                "dct:valid": valid,
+                "owl:sameAs": f"odpt.Train:{line.railway.split(':')[-1]}.{train.number}",
+                "odpt:operator": line.operator,
+                "odpt:railway": line.railway,
+                "odpt:trainNumber": train.number,
+                "odpt:trainType": train_type,
+                "odpt:delay": delay,
+                "odpt:fromStation": line.station_id(stations[position]),
+                "odpt:toStation": line.station_id(stations[position + 1]) if moving else None,
+                "odpt:railDirection": train.direction,
+                "odpt:destinationStation": [line.station_id(destination)],
+                "odpt:originStation": [line.station_id(stations[0])],
+                "odpt:carComposition": 10,
+            })
+        return result
+
+    def _stopped_trains(self, step: int) -> Dict[str, Tuple[int, int]]:
+        """止まっている列車: 列車番号 → (駅の位置, 遅延)"""
+        stopped: Dict[str, Tuple[int, int]] = {}
+        for stoppage in self.stoppages:
+            if not stoppage.active(step): continue
+            on_line = [train for train in self.trains if train.line.railway == stoppage.railway]
+            elapsed = step - stoppage.start_step + 1
+            for order, train in enumerate(on_line[:stoppage.followers + 1]):
+                # 見合わせ開始時の位置で止め、後続は1本ごとに少しずつ遅れて止まったことにする
+                position = (train.start + stoppage.start_step // 2) % (len(train.line.stations) - 1)
+                delay = train.base_delay + max(elapsed - order, 0) * stoppage.rise
+                stopped[train.number] = (position, delay)
+        return stopped
+
+    # --- odpt:TrainInformation ---
+    def information_at(self, step: int) -> List[Dict[str, Any]]:
+        date = self._iso(step)
+        info_operator = JR_INFO_OPERATOR if self.operator == JR_EAST_OPERATOR else self.operator
+        texts: Dict[str, Tuple[str, str, Optional[str]]] = {}
+        for stoppage in self.stoppages:
+            if step < stoppage.start_step: continue
+            texts[stoppage.railway] = self._stoppage_text(stoppage, step)
+        items: List[Dict[str, Any]] = []
+        for line in self.lines:
+            status, text, cause = texts.get(line.railway, ("平常運転", "平常どおり運転しています。", None))
+            item: Dict[str, Any] = {
+                "@type": "odpt:TrainInformation",
+                "dc:date": date,
+                "odpt:operator": info_operator,
+                "odpt:railway": line.railway,
+                "odpt:trainInformationStatus": {"ja": status},
+                "odpt:trainInformationText": {"ja": text},
+            }
+            if cause: item["odpt:trainInformationCause"] = {"ja": cause}
+            items.append(item)
+        return items
+
+    def _stoppage_text(self, stoppage: Stoppage, step: int) -> Tuple[str, str, Optional[str]]:
+        """(状況, 文章, 原因)。jr_east_info_detector の「○○駅～○○駅間で△△の影響で」の形にそろえる。"""
+        lead = next(train for train in self.trains if train.line.railway == stoppage.railway)
+        stations = lead.line.stations
+        position = (lead.start + stoppage.start_step // 2) % (len(stations) - 1)
+        name = lambda en: lead.line.station_names.get(en, en)
+        section = f"{name(stations[position])}駅～{name(stations[position + 1])}駅間"
+        started = datetime.fromtimestamp(self.time_at(stoppage.start_step), JST)
+        head = f"{started.hour}時{started.minute:02d}分頃、{section}で{stoppage.cause}の影響で、"
+
+        if not stoppage.active(step): # 再開後
+            return "遅延", f"{head}遅れが出ています。", stoppage.cause
+        if stoppage.resume_steps is not None and step >= stoppage.start_step + stoppage.resume_steps:
+            # 見込み時刻は発表した時点で決まり、その後は変わらない
+            resume = datetime.fromtimestamp(self.time_at(stoppage.start_step + stoppage.resume_steps) + 30 * 60, JST)
+            return ("運転再開見込",
+                    f"{head}運転を見合わせています。運転再開は{resume.hour}時{resume.minute:02d}分頃を見込んでいます。",
+                    stoppage.cause)
+        return "運転見合わせ", f"{head}運転を見合わせています。", stoppage.cause
+
+    def records_at(self, step: int) -> List[Train]:
+        """検知にそのまま渡せるレコードの形で返す"""
+        return trains_from_json(self.trains_at(step))
+
+    def payload(self, step: int) -> bytes:
+        return json.dumps(self.trains_at(step), ensure_ascii=False).encode("utf-8")
+
+
+def _stub_dataset(networks: List[SyntheticNetwork], speed: float):
+    """代役サーバ (odpt_stub_server) 用: 実時間 × speed で step を進める"""
+    from odpt_stub_server import StubDataset
+
+    class SyntheticDataset(StubDataset):
+        def __init__(self):
+            self.started = time.monotonic()
+
+        def _step(self) -> int:
+            return int((time.monotonic() - self.started) * speed / networks[0].interval)
+
+        def trains(self) -> List[Dict[str, Any]]:
+            step = self._step()
+            return [train for network in networks for train in network.trains_at(step)]
+
+        def information(self) -> List[Dict[str, Any]]:
+            step = self._step()
+            return [item for network in networks for item in network.information_at(step)]
+
+    return SyntheticDataset()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operator", action="append", choices=["JR-East", "Toei", "Tobu"], help="作る事業者 (複数可、省略時は JR-East)")
+    parser.add_argument("--trains", type=int, default=600, help="1事業者あたりの列車数")
+    parser.add_argument("--lines", help="路線の配分 (例: ChuoRapid=3,Yamanote=1)")
+    parser.add_argument("--delay", choices=sorted(DELAY_DISTRIBUTIONS), default="normal", help="遅延の分布")
+    parser.add_argument("--irregular-rate", type=float, default=0.02, help="定期にない行先の列車の割合")
+    parser.add_argument("--stoppage", action="append", default=[], help="運転見合わせ (路線:開始step[:終了step])")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=240, help="--record で書き出す回数 (15秒ごと)")
+    parser.add_argument("--record", help="録画 (response_recorder 形式) として書き出すディレクトリ (replay.py で再生できる)")
+    parser.add_argument("--serve", action="store_true", help="代役サーバとして配信する")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--speed", type=float, default=1.0, help="--serve のとき、実時間の何倍で進めるか")
+    args = parser.parse_args()
+
+    operators = {"JR-East": JR_EAST_OPERATOR, "Toei": TOEI_OPERATOR, "Tobu": TOBU_OPERATOR}
+    line_mix = None
+    if args.lines:
+        line_mix = {name: float(weight) for name, weight in (part.split("=") for part in args.lines.split(","))}
+    networks = []
+    for name in args.operator or ["JR-East"]:
+        networks.append(SyntheticNetwork(operators[name], args.trains, line_mix if name == "JR-East" else None,
+                                         args.delay, args.irregular_rate, args.seed))
+    for spec in args.stoppage:
+        railway, *steps = spec.split(":")
+        end = int(steps[1]) if len(steps) > 1 else None
+        for network in networks:
+            try:
+                network.add_stoppage(railway, int(steps[0]) if steps else 0, end_step=end, resume_steps=20)
+                break
+            except ValueError:
+                continue
+
+    if args.record:
+        import response_recorder
+        recorder = response_recorder.start(args.record)
+        for step in range(args.steps):
+            for network in networks:
+                fetched_at = network.time_at(step)
+                base = "https://api-challenge.odpt.org/api/v4" if network.operator != TOEI_OPERATOR else "https://api.odpt.org/api/v4"
+                recorder.record(f"{base}/odpt:Train", {"odpt:operator": network.operator}, 200, network.payload(step), fetched_at, 0.5)
+                if network.operator == JR_EAST_OPERATOR and step % 4 == 0:
+                    info = json.dumps(network.information_at(step), ensure_ascii=False).encode("utf-8")
+                    recorder.record(f"{base}/odpt:TrainInformation", {"odpt:operator": JR_INFO_OPERATOR}, 200, info, fetched_at + 1, 0.2)
+            while recorder.snapshot()["queued"] > response_recorder.QUEUE_SIZE // 2:
+                time.sleep(0.01) # 捨てられないように、書き込みが追いつくのを待つ
+        response_recorder.stop()
+        print(f"--- [SYNTHETIC] wrote {args.steps} steps to {args.record} ---", flush=True)
+
+    if args.serve:
+        from odpt_stub_server import ODPTStubServer
+        server = ODPTStubServer(_stub_dataset(networks, args.speed), port=args.port)
+        print(f"--- [SYNTHETIC] serving at {server.base_url} ---", flush=True)
+        for key, value in server.environment().items():
+            print(f"{key}={value}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
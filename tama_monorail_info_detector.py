@@ -1,35 +1,24 @@
-import os
-import requests
-
-# .envから都営地下鉄・多摩モノレール用のトークンを読み込む
-API_TOKEN = os.getenv('ODPT_TOKEN_TOEI')
-# APIエンドポイント（運行情報用）
-API_ENDPOINT = "https://api.odpt.org/api/v4/odpt:TrainInformation"
+import odpt_client
+import train_information
 
 # 最後に取得した運行情報のテキストを保存しておく変数
 # これと違う情報が来たら「変化あり」と判断します
 last_tama_monorail_status = ""
 
-def check_tama_monorail_info():
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-
+def check_tama_monorail_info(info_data=None):
     """
     多摩モノレールの運行情報をチェックし、変化があれば通知用メッセージを返す関数
     """
     global last_tama_monorail_status # ファイル内で共通の変数を使うことを宣言
 
     try:
-        # APIリクエストのためのパラメータを設定
-        params = {
-            "odpt:operator": "odpt.Operator:TamaMonorail",
-            "acl:consumerKey": API_TOKEN
-        }
-        operator_id = "odpt.Operator:TamaMonorail"
-        target_url = f"{API_ENDPOINT}?odpt:operator={operator_id}&acl:consumerKey={API_TOKEN}"
-        response = requests.get(target_url, headers=headers, timeout=30)
-        info_data = response.json()
+        if info_data is None: # ★ asyncio版から渡されていなければ、ここで取得する
+            # メトロ・都営と共通のまとめ取りから、多摩モノの分だけを受け取る
+            info_data = train_information.get_operator_information(train_information.TAMA_MONORAIL_OPERATOR)
+
+        # 前回とまったく同じ中身なら、変化なし
+        if info_data is odpt_client.NOT_MODIFIED:
+            return None
 
         # データが空、または情報テキストがない場合は何もしない
         if not info_data or "odpt:trainInformationText" not in info_data[0]:
@@ -53,4 +42,14 @@ def check_tama_monorail_info():
 
     except Exception as e:
         print(f"--- [TAMA] ERROR: {e} ---", flush=True)
-        return None
\ No newline at end of file
+        train_information.forget(train_information.TAMA_MONORAIL_OPERATOR) # 次は同じ中身でも見直す
+        return None
+
+async def check_tama_monorail_info_async():
+    # 通信はイベントループ上で待つ。比較は文字列1つだけなので、そのままループ上でやる
+    try:
+        info_data = await train_information.get_operator_information_async(train_information.TAMA_MONORAIL_OPERATOR)
+    except Exception as e:
+        print(f"--- [TAMA] ERROR: {e} ---", flush=True)
+        return None
+    return check_tama_monorail_info(info_data)
\ No newline at end of file
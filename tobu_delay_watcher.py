@@ -1,10 +1,15 @@
 import os
+import odpt_client
 import requests
 import time
+import clock
+import asyncio
 from typing import Dict, Any, List, Optional
+from train_snapshot import get_train_snapshot, get_train_snapshot_async, TOBU_OPERATOR
+from delay_tracker import DelayTracker, TrackedTrain
 
 API_TOKEN = os.getenv('ODPT_TOKEN_CHALLENGE') # JRと同じトークン
-API_ENDPOINT = "https://api-challenge.odpt.org/api/v4/odpt:Train" # JRと同じエンドポイント
+API_ENDPOINT = f"{odpt_client.CHALLENGE_API_BASE}/odpt:Train" # JRと同じエンドポイント
 
 # --- 東武線用の「駅名」と「路線名」辞書 ---
 # ★★★ 今は仮で主要駅しか入ってないから、君の旧Botデータや知識で追加してね！ ★★★
@@ -99,10 +104,6 @@ TOBU_LINE_PREDICTION_DATA = {
 
 }
 
-    
-# --- 監視対象の列車情報を保持する辞書 ---
-tracked_delayed_trains: Dict[str, Dict[str, Any]] = {}
-line_cooldown_tracker: Dict[str, float] = {}
 
 # --- 設定値 (JR版と同じ) ---
 DELAY_THRESHOLD_SECONDS = 3 * 60
@@ -123,162 +124,128 @@ def _find_nearest_turning_station(station_list: List[str], turning_stations: set
         current_index += direction
     return None
 
-# --- メイン関数 (名前を tobu に変更) ---
-def check_tobu_delay_increase() -> Optional[List[str]]:
-    global tracked_delayed_trains, line_cooldown_tracker
-    notification_messages: List[str] = []
-    current_time = time.time()
-    trains_found_this_cycle: set = set()
 
-    try:
-        # 1. 全列車データを取得 (OperatorをTobuに指定)
-        params = {"odpt:operator": "odpt.Operator:Tobu", "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=45)
-        response.raise_for_status()
-        train_data = response.json()
-        if not isinstance(train_data, list): return None
+def _build_prediction_message(line_name_jp: str, location_name_jp: str, station_list: List[str], turning_stations: set) -> str:
+    """折返し区間予測の文章"""
+    turn_back_1, turn_back_2 = None, None
+    # 止まっている駅のインデックスを探す
+    if location_name_jp in station_list:
+        idx = station_list.index(location_name_jp)
+        # 両方向に折り返し駅を探す
+        turn_back_1 = _find_nearest_turning_station(station_list, turning_stations, idx - 1, -1)
+        turn_back_2 = _find_nearest_turning_station(station_list, turning_stations, idx + 1, 1)
 
-        for train in train_data:
-            train_number: Optional[str] = train.get("odpt:trainNumber")
-            current_delay: int = train.get("odpt:delay", 0)
-            line_id: Optional[str] = train.get("odpt:railway")
-            current_location_id: Optional[str] = train.get("odpt:toStation") or train.get("odpt:fromStation")
+    # --- メッセージ作成 ---
+    message_title = f"【{line_name_jp} 折返し区間予測】"
+    running_sections = []
+    line_start, line_end = station_list[0], station_list[-1]
 
-            if not all([train_number, line_id, current_location_id]): continue
-            if train_number is None: continue
-            trains_found_this_cycle.add(train_number)
+    if turn_back_1 and turn_back_1 != line_start:
+        running_sections.append(f"・{line_start}～{turn_back_1}")
+    if turn_back_2 and turn_back_2 != line_end:
+        running_sections.append(f"・{turn_back_2}～{line_end}")
 
-            if train_number in tracked_delayed_trains:
-                tracking_info = tracked_delayed_trains[train_number]
-                moved = current_location_id != tracking_info["last_location_id"]
-                recovered = current_delay < DELAY_THRESHOLD_SECONDS
+    # (原因テキストは遅延検知では特定できないので、簡易版)
+    reason_text = f"\nこれは、{location_name_jp}駅付近でのトラブル対処が長引いている影響です。"
+    disclaimer = "\n状況により折返し運転が実施されない場合があります。"
 
-                # ▼▼▼ リセット処理 (再開通知) ▼▼▼
-                if moved or recovered:
-                    if tracking_info.get("notified_initial", False):
-                        line_name_jp = TOBU_LINE_NAMES.get(line_id, line_id.split('.')[-1])
-                        location_name_en = tracking_info["last_location_id"].split('.')[-1]
-                        location_name_jp = TOBU_STATION_DICT.get(location_name_en, location_name_en)
-                        reason = "運転再開を確認" if moved else "遅延が回復"
-                        message = f"【{line_name_jp} 運転再開】\n{location_name_jp}駅付近で停止していた列車の{reason}しました。(遅延: {int(current_delay / 60)}分)"
-                        notification_messages.append(message)
-                        print(f"--- [TOBU DELAY WATCH] !!! RESUMPTION NOTICE for Train {train_number} !!! Reason: {reason}", flush=True)
-                    del tracked_delayed_trains[train_number]
-                
-                # ▼▼▼ 遅延増加処理 (通知判定) ▼▼▼
-                elif current_delay > tracking_info["last_delay"]:
-                    tracking_info["consecutive_increase_count"] += 1
-                    tracking_info["last_delay"] = current_delay
-                    tracking_info["last_seen_time"] = current_time
-                    count = tracking_info["consecutive_increase_count"]
-                    
-                    print(f"--- [TOBU DELAY WATCH] Train {train_number}: Count {count} at {current_location_id}", flush=True)
+    final_message = message_title
+    if running_sections: final_message += f"\n" + "\n".join(running_sections)
+    else: final_message += "\n(運転区間不明)"
+    final_message += reason_text
+    final_message += disclaimer
+    return final_message
 
-                    line_name_jp = TOBU_LINE_NAMES.get(line_id, line_id.split('.')[-1])
-                    location_name_en = current_location_id.split('.')[-1]
-                    location_name_jp = TOBU_STATION_DICT.get(location_name_en, location_name_en)
 
-                    # --- 最初の通知判定 (公式情報のチェックはなし) ---
-                    if count >= INCREASE_COUNT_THRESHOLD and not tracking_info.get("notified_initial", False):
-                        last_notification_time = line_cooldown_tracker.get(line_id, 0)
-                        if current_time - last_notification_time > COOLDOWN_SECONDS:
-                            message = (
-                                f"【{line_name_jp} 運転見合わせ】\n"
-                                f"{line_name_jp}は{location_name_jp}駅付近で何らかのトラブルが発生した可能性があります。"
-                                f"今後の情報にご注意ください。(現在遅延: {int(current_delay / 60)}分)"
-                            )
-                            notification_messages.append(message)
-                            line_cooldown_tracker[line_id] = current_time
-                            tracking_info["notified_initial"] = True
-                            print(f"--- [TOBU DELAY WATCH] !!! INITIAL NOTICE SENT for Train {train_number} !!!", flush=True)
-                        else:
-                            print(f"--- [TOBU DELAY WATCH] Train {train_number}: Initial threshold reached, but line {line_name_jp} in cooldown.", flush=True)
-                            #tracking_info["notified_initial"] = True # フラグは立てる
-                    
-                    # --- 再通知（エスカレーション）判定 ---
-                    if count >= ESCALATION_NOTICE_THRESHOLD and tracking_info.get("notified_initial", False) and not tracking_info.get("notified_escalated", False):
-                         message = (
-                             f"【{line_name_jp} 運転見合わせ継続中】\n"
-                             f"{location_name_jp}駅付近でのトラブル対応が長引いている可能性があります。"
-                             f"(遅延: {int(current_delay / 60)}分)" 
-                         )
-                         notification_messages.append(message)
-                         tracking_info["notified_escalated"] = True
-                         print(f"--- [TOBU DELAY WATCH] !!! ESCALATION NOTICE SENT for Train {train_number} !!!", flush=True)
+class TobuDelayTracker(DelayTracker):
+    """東武の通知判定 (公式情報のチェックはなし。カウント12で折返し区間予測)"""
 
-                    #カウント12    
-                    if count >= PREDICTION_THRESHOLD and tracking_info.get("notified_initial", False) and not tracking_info.get("notified_predicted", False):
-                        
-                        # この路線のカルテがあるか確認
-                        if line_id in TOBU_LINE_PREDICTION_DATA:
-                            line_data = TOBU_LINE_PREDICTION_DATA[line_id]
-                            station_list = line_data.get("stations", [])
-                            turning_stations = line_data.get("turning_stations", set())
+    def on_reset(self, cycle, train_number, record, train, moved, recovered):
+        if record.notified_initial:
+            line_name_jp = TOBU_LINE_NAMES.get(record.line_id, record.line_id.split('.')[-1])
+            location_name_en = record.last_location_id.split('.')[-1]
+            location_name_jp = TOBU_STATION_DICT.get(location_name_en, location_name_en)
+            reason = "運転再開を確認" if moved else "遅延が回復"
+            message = f"【{line_name_jp} 運転再開】\n{location_name_jp}駅付近で停止していた列車の{reason}しました。(遅延: {int(train.delay / 60)}分)"
+            cycle.messages.append(message)
+            print(f"--- [TOBU DELAY WATCH] !!! RESUMPTION NOTICE for Train {train_number} !!! Reason: {reason}", flush=True)
 
-                            if station_list and turning_stations:
-                                turn_back_1, turn_back_2 = None, None
-                                try:
-                                    # 止まっている駅のインデックスを探す
-                                    if location_name_jp in station_list:
-                                        idx = station_list.index(location_name_jp)
-                                        # 両方向に折り返し駅を探す
-                                        turn_back_1 = _find_nearest_turning_station(station_list, turning_stations, idx - 1, -1)
-                                        turn_back_2 = _find_nearest_turning_station(station_list, turning_stations, idx + 1, 1)
-                                
-                                    # --- メッセージ作成 ---
-                                    message_title = f"【{line_name_jp} 折返し区間予測】"
-                                    running_sections = []
-                                    line_start, line_end = station_list[0], station_list[-1]
+    def on_increase(self, cycle, train_number, record, train):
+        count = record.consecutive_increase_count
+        line_id = record.line_id
+        current_location_id = record.last_location_id
+        current_delay = train.delay
+        print(f"--- [TOBU DELAY WATCH] Train {train_number}: Count {count} at {current_location_id}", flush=True)
 
-                                    if turn_back_1 and turn_back_1 != line_start:
-                                        running_sections.append(f"・{line_start}～{turn_back_1}")
-                                    if turn_back_2 and turn_back_2 != line_end:
-                                        running_sections.append(f"・{turn_back_2}～{line_end}")
+        line_name_jp = TOBU_LINE_NAMES.get(line_id, line_id.split('.')[-1])
+        location_name_en = current_location_id.split('.')[-1]
+        location_name_jp = TOBU_STATION_DICT.get(location_name_en, location_name_en)
 
-                                    # (原因テキストは遅延検知では特定できないので、簡易版)
-                                    reason_text = f"\nこれは、{location_name_jp}駅付近でのトラブル対処が長引いている影響です。"
-                                    disclaimer = "\n状況により折返し運転が実施されない場合があります。"
-                                    
-                                    final_message = message_title
-                                    if running_sections: final_message += f"\n" + "\n".join(running_sections)
-                                    else: final_message += "\n(運転区間不明)"
-                                    final_message += reason_text
-                                    final_message += disclaimer
-                                    
-                                    notification_messages.append(final_message)
-                                    tracking_info["notified_predicted"] = True # 予測通知フラグを立てる
-                                    print(f"--- [TOBU DELAY WATCH] !!! PREDICTION NOTICE SENT for Train {train_number} !!!", flush=True)
+        # --- 最初の通知判定 (公式情報のチェックはなし) ---
+        if count >= INCREASE_COUNT_THRESHOLD and not record.notified_initial:
+            last_notification_time = line_cooldown_tracker.get(line_id, 0)
+            if cycle.now - last_notification_time > COOLDOWN_SECONDS:
+                message = (
+                    f"【{line_name_jp} 運転見合わせ】\n"
+                    f"{line_name_jp}は{location_name_jp}駅付近で何らかのトラブルが発生した可能性があります。"
+                    f"今後の情報にご注意ください。(現在遅延: {int(current_delay / 60)}分)"
+                )
+                cycle.messages.append(message)
+                line_cooldown_tracker[line_id] = cycle.now
+                record.notified_initial = True
+                print(f"--- [TOBU DELAY WATCH] !!! INITIAL NOTICE SENT for Train {train_number} !!!", flush=True)
+            else:
+                print(f"--- [TOBU DELAY WATCH] Train {train_number}: Initial threshold reached, but line {line_name_jp} in cooldown.", flush=True)
 
-                                except Exception as e:
-                                    print(f"--- [TOBU DELAY WATCH] ERROR during prediction logic: {e}", flush=True)
-                        else:
-                            print(f"--- [TOBU DELAY WATCH] Prediction threshold reached, but no map found for {line_name_jp}.", flush=True)
-                            tracking_info["notified_predicted"] = True
-                
-                else: # 遅延が横ばい or 微減
-                    tracking_info["last_seen_time"] = current_time
-            
-            # ▼▼▼ 新規追跡処理 ▼▼▼
-            elif current_delay >= DELAY_THRESHOLD_SECONDS:
-                
-                 tracked_delayed_trains[train_number] = {
-                     "line_id": line_id, "last_location_id": current_location_id,
-                     "last_delay": current_delay, "consecutive_increase_count": 1,
-                     "last_seen_time": current_time,
-                     "notified_initial": False, "notified_escalated": False,
-                     "notified_predicted": False # ★予測フラグの初期値
-                 }
+        # --- 再通知（エスカレーション）判定 ---
+        if count >= ESCALATION_NOTICE_THRESHOLD and record.notified_initial and not record.notified_escalated:
+            message = (
+                f"【{line_name_jp} 運転見合わせ継続中】\n"
+                f"{location_name_jp}駅付近でのトラブル対応が長引いている可能性があります。"
+                f"(遅延: {int(current_delay / 60)}分)"
+            )
+            cycle.messages.append(message)
+            record.notified_escalated = True
+            print(f"--- [TOBU DELAY WATCH] !!! ESCALATION NOTICE SENT for Train {train_number} !!!", flush=True)
 
-        # 4. 古い記録の掃除
-        trains_to_remove = [
-            train_num for train_num, info in tracked_delayed_trains.items()
-            if train_num not in trains_found_this_cycle and current_time - info["last_seen_time"] > CLEANUP_THRESHOLD_SECONDS
-        ]
-        for train_num in trains_to_remove:
-            del tracked_delayed_trains[train_num]
-            print(f"--- [DELAY WATCH] Train {train_num}: Removing track (timeout).", flush=True)
+        #カウント12
+        if count >= PREDICTION_THRESHOLD and record.notified_initial and not record.notified_predicted:
+            # この路線のカルテがあるか確認
+            if line_id in TOBU_LINE_PREDICTION_DATA:
+                line_data = TOBU_LINE_PREDICTION_DATA[line_id]
+                station_list = line_data.get("stations", [])
+                turning_stations = line_data.get("turning_stations", set())
 
-        return notification_messages
+                if station_list and turning_stations:
+                    try:
+                        cycle.messages.append(_build_prediction_message(line_name_jp, location_name_jp, station_list, turning_stations))
+                        record.notified_predicted = True # 予測通知フラグを立てる
+                        print(f"--- [TOBU DELAY WATCH] !!! PREDICTION NOTICE SENT for Train {train_number} !!!", flush=True)
+                    except Exception as e:
+                        print(f"--- [TOBU DELAY WATCH] ERROR during prediction logic: {e}", flush=True)
+            else:
+                print(f"--- [TOBU DELAY WATCH] Prediction threshold reached, but no map found for {line_name_jp}.", flush=True)
+                record.notified_predicted = True
+
+    def on_expire(self, cycle, train_number, record):
+        print(f"--- [DELAY WATCH] Train {train_number}: Removing track (timeout).", flush=True)
+
+
+_tracker = TobuDelayTracker("tobu_delay", DELAY_THRESHOLD_SECONDS, CLEANUP_THRESHOLD_SECONDS)
+# --- 監視対象の列車情報を保持する辞書 (列番 → delay_tracker.TrackedTrain) ---
+tracked_delayed_trains: Dict[str, TrackedTrain] = _tracker.tracked
+line_cooldown_tracker: Dict[str, float] = {}
+
+# --- メイン関数 (名前を tobu に変更) ---
+def check_tobu_delay_increase(snapshot=None) -> Optional[List[str]]:
+    try:
+        # 1. 全列車データを取得 (OperatorをTobuに指定したスナップショット)
+        if snapshot is None:
+            snapshot = get_train_snapshot(TOBU_OPERATOR)
+        if snapshot is None: return None
+        if snapshot.unchanged: return [] # 前回からデータが更新されていない
+        # 2. 追跡の更新・通知判定・古い記録の掃除 (delay_tracker の共通エンジン)
+        return _tracker.process(snapshot)
 
     except requests.exceptions.RequestException as req_err:
         print(f"--- [TOBU DELAY WATCH] ERROR: Network error: {req_err}", flush=True)
@@ -287,4 +254,11 @@ def check_tobu_delay_increase() -> Optional[List[str]]:
         import traceback
         print(f"--- [TOBU DELAY WATCH] ERROR: Unexpected error: {e}", flush=True)
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+async def check_tobu_delay_increase_async() -> Optional[List[str]]:
+    # 通信はイベントループ上で待ち、追跡処理だけをスレッドに回す
+    snapshot = await get_train_snapshot_async(TOBU_OPERATOR)
+    if snapshot is None: return None
+    if snapshot.unchanged: return []
+    return await asyncio.get_running_loop().run_in_executor(None, check_tobu_delay_increase, snapshot)
\ No newline at end of file
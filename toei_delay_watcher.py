@@ -1,7 +1,12 @@
 import os
+import odpt_client
 import requests
 import time
+import clock
+import asyncio
 from typing import Dict, Any, List, Optional
+from train_snapshot import get_train_snapshot, get_train_snapshot_async, TOEI_OPERATOR
+from delay_tracker import DelayTracker, TrackedTrain
 
 # --- toei_detector.py から共通データをインポート ---
 try:
@@ -20,12 +25,7 @@ except ImportError:
 # 都営地下鉄用のトークン
 API_TOKEN = os.getenv('ODPT_TOKEN_TOEI')
 # 在線情報のエンドポイント (JRと同じ)
-API_ENDPOINT = "https://api.odpt.org/api/v4/odpt:Train" 
-
-# --- 監視対象の列車情報を保持する辞書 ---
-tracked_delayed_trains: Dict[str, Dict[str, Any]] = {}
-# --- 路線ごとの通知クールダウン用辞書 ---
-line_cooldown_tracker: Dict[str, float] = {}
+API_ENDPOINT = f"{odpt_client.API_BASE}/odpt:Train" 
 
 # --- 設定値 (JR版と同じ値を流用) ---
 DELAY_THRESHOLD_SECONDS = 3 * 60  # 3分 (180秒)
@@ -34,119 +34,84 @@ ESCALATION_NOTICE_THRESHOLD = 10
 CLEANUP_THRESHOLD_SECONDS = 15 * 60 # 15分
 COOLDOWN_SECONDS = 30 * 60 # 30分
 
+
+class ToeiDelayTracker(DelayTracker):
+    """都営の通知判定 (公式情報は見ない。最初の通知と継続の再通知は elif でどちらか一方)"""
+
+    def on_reset(self, cycle, train_number, record, train, moved, recovered):
+        if record.notified_initial:
+            line_name_jp = TOEI_LINE_NAMES.get(record.line_id, record.line_id.split('.')[-1])
+            location_name_en = record.last_location_id.split('.')[-1]
+            location_name_jp = STATION_DICT.get(location_name_en, location_name_en)
+            reason = "運転再開を確認" if moved else "遅延が回復"
+            message = f"【{line_name_jp} 運転再開】\n{location_name_jp}駅付近で停止していた列車の{reason}しました。(遅延: {int(train.delay / 60)}分)"
+            cycle.messages.append(message)
+            print(f"--- [TOEI DELAY WATCH] !!! RESUMPTION NOTICE for Train {train_number} !!! Reason: {reason}", flush=True)
+        if moved: print(f"--- [TOEI DELAY WATCH] Train {train_number}: Reset (moved).", flush=True)
+        if recovered: print(f"--- [TOEI DELAY WATCH] Train {train_number}: Reset (delay recovered).", flush=True)
+
+    def on_increase(self, cycle, train_number, record, train):
+        count = record.consecutive_increase_count
+        line_id = record.line_id
+        current_location_id = record.last_location_id
+        current_delay = train.delay
+        print(f"--- [TOEI DELAY WATCH] Train {train_number}: Count {count}/{INCREASE_COUNT_THRESHOLD} at {current_location_id}", flush=True)
+
+        line_name_jp = TOEI_LINE_NAMES.get(line_id, line_id.split('.')[-1])
+        location_name_en = current_location_id.split('.')[-1]
+        location_name_jp = STATION_DICT.get(location_name_en, location_name_en)
+
+        # --- 最初の通知判定 ---
+        if count >= INCREASE_COUNT_THRESHOLD and not record.notified_initial:
+            last_notification_time = line_cooldown_tracker.get(line_id, 0)
+            if cycle.now - last_notification_time > COOLDOWN_SECONDS:
+                message = (
+                    f"【{line_name_jp} 運転見合わせ】\n"
+                    f"{line_name_jp}は{location_name_jp}駅付近で何らかのトラブルが発生した可能性があります。"
+                    f"今後の情報にご注意ください。(現在遅延: {int(current_delay / 60)}分)"
+                )
+                cycle.messages.append(message)
+                line_cooldown_tracker[line_id] = cycle.now
+                record.notified_initial = True
+                print(f"--- [TOEI DELAY WATCH] !!! INITIAL NOTICE SENT for Train {train_number} !!!", flush=True)
+            else:
+                print(f"--- [TOEI DELAY WATCH] Train {train_number}: Initial threshold reached, but line {line_name_jp} in cooldown.", flush=True)
+
+        # --- 再通知（エスカレーション）判定 ---
+        elif count >= ESCALATION_NOTICE_THRESHOLD and record.notified_initial and not record.notified_escalated:
+            message = (
+                f"【{line_name_jp} 運転見合わせ継続中】\n"
+                f"{location_name_jp}駅付近でのトラブル対応が長引いている可能性があります。"
+                f"(遅延: {int(current_delay / 60)}分)" # 遅延時間も追加
+            )
+            cycle.messages.append(message)
+            record.notified_escalated = True # ★再通知フラグを立てる
+            print(f"--- [DELAY WATCH] !!! ESCALATION NOTICE SENT for Train {train_number} !!!", flush=True)
+
+    def on_expire(self, cycle, train_number, record):
+        print(f"--- [TOEI DELAY WATCH] Train {train_number}: Removing track (timeout).", flush=True)
+
+
+_tracker = ToeiDelayTracker("toei_delay", DELAY_THRESHOLD_SECONDS, CLEANUP_THRESHOLD_SECONDS)
+# --- 監視対象の列車情報を保持する辞書 (列番 → delay_tracker.TrackedTrain) ---
+tracked_delayed_trains: Dict[str, TrackedTrain] = _tracker.tracked
+# --- 路線ごとの通知クールダウン用辞書 ---
+line_cooldown_tracker: Dict[str, float] = {}
+
 # --- メイン関数 ---
-def check_toei_delay_increase() -> Optional[List[str]]:
+def check_toei_delay_increase(snapshot=None) -> Optional[List[str]]:
     """
     都営地下鉄の全列車を監視し、遅延が同一箇所で増加し続けている
     運転見合わせの可能性のある列車を検知して通知メッセージを返す。
     """
-    global tracked_delayed_trains, line_cooldown_tracker
-    notification_messages: List[str] = []
-    current_time = time.time()
-    trains_found_this_cycle: set = set()
-
     try:
-        # 1. 全列車データを取得 (OperatorをToeiに指定)
-        params = {"odpt:operator": "odpt.Operator:Toei", "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=45)
-        response.raise_for_status()
-        train_data = response.json()
-        if not isinstance(train_data, list): return None
-
-        for train in train_data:
-            train_number: Optional[str] = train.get("odpt:trainNumber")
-            current_delay: int = train.get("odpt:delay", 0)
-            line_id: Optional[str] = train.get("odpt:railway")
-            current_location_id: Optional[str] = train.get("odpt:toStation") or train.get("odpt:fromStation")
-
-            if not all([train_number, line_id, current_location_id]): continue
-            if train_number is None: continue
-
-            trains_found_this_cycle.add(train_number)
-
-            # 2. 遅延列車を記録・更新
-            if train_number in tracked_delayed_trains:
-                tracking_info = tracked_delayed_trains[train_number]
-                moved = current_location_id != tracking_info["last_location_id"]
-                recovered = current_delay < DELAY_THRESHOLD_SECONDS
-
-                # ▼▼▼ リセット処理 (再開通知) ▼▼▼
-                if moved or recovered:
-                    if tracking_info.get("notified_initial", False):
-                        line_name_jp = TOEI_LINE_NAMES.get(line_id, line_id.split('.')[-1])
-                        location_name_en = tracking_info["last_location_id"].split('.')[-1]
-                        location_name_jp = STATION_DICT.get(location_name_en, location_name_en)
-                        reason = "運転再開を確認" if moved else "遅延が回復"
-                        message = f"【{line_name_jp} 運転再開】\n{location_name_jp}駅付近で停止していた列車の{reason}しました。(遅延: {int(current_delay / 60)}分)"
-                        notification_messages.append(message)
-                        print(f"--- [TOEI DELAY WATCH] !!! RESUMPTION NOTICE for Train {train_number} !!! Reason: {reason}", flush=True)
-                    if moved: print(f"--- [TOEI DELAY WATCH] Train {train_number}: Reset (moved).", flush=True)
-                    if recovered: print(f"--- [TOEI DELAY WATCH] Train {train_number}: Reset (delay recovered).", flush=True)
-                    del tracked_delayed_trains[train_number]
-                
-                # ▼▼▼ 遅延増加処理 (通知判定) ▼▼▼
-                elif current_delay > tracking_info["last_delay"]:
-                    tracking_info["consecutive_increase_count"] += 1
-                    tracking_info["last_delay"] = current_delay
-                    tracking_info["last_seen_time"] = current_time
-                    count = tracking_info["consecutive_increase_count"]
-                    print(f"--- [TOEI DELAY WATCH] Train {train_number}: Count {count}/{INCREASE_COUNT_THRESHOLD} at {current_location_id}", flush=True)
-
-                    line_name_jp = TOEI_LINE_NAMES.get(line_id, line_id.split('.')[-1])
-                    location_name_en = current_location_id.split('.')[-1]
-                    location_name_jp = STATION_DICT.get(location_name_en, location_name_en)
-
-                    # --- 最初の通知判定 ---
-                    if count >= INCREASE_COUNT_THRESHOLD and not tracking_info.get("notified_initial", False):
-                        last_notification_time = line_cooldown_tracker.get(line_id, 0)
-                        if current_time - last_notification_time > COOLDOWN_SECONDS:
-                            message = (
-                                f"【{line_name_jp} 運転見合わせ】\n"
-                                f"{line_name_jp}は{location_name_jp}駅付近で何らかのトラブルが発生した可能性があります。"
-                                f"今後の情報にご注意ください。(現在遅延: {int(current_delay / 60)}分)"
-                            )
-                            notification_messages.append(message)
-                            line_cooldown_tracker[line_id] = current_time
-                            tracking_info["notified_initial"] = True
-                            print(f"--- [TOEI DELAY WATCH] !!! INITIAL NOTICE SENT for Train {train_number} !!!", flush=True)
-                        else:
-                            print(f"--- [TOEI DELAY WATCH] Train {train_number}: Initial threshold reached, but line {line_name_jp} in cooldown.", flush=True)
-                    
-                    # --- 再通知（エスカレーション）判定 ---
-                    elif count >= ESCALATION_NOTICE_THRESHOLD and tracking_info.get("notified_initial", False) and not tracking_info.get("notified_escalated", False):
-                         message = (
-                             f"【{line_name_jp} 運転見合わせ継続中】\n"
-                             f"{location_name_jp}駅付近でのトラブル対応が長引いている可能性があります。"
-                             f"(遅延: {int(current_delay / 60)}分)" # 遅延時間も追加
-                         )
-                         notification_messages.append(message)
-                         tracking_info["notified_escalated"] = True # ★再通知フラグを立てる
-                         print(f"--- [DELAY WATCH] !!! ESCALATION NOTICE SENT for Train {train_number} !!!", flush=True)
-                 
-
-                else: # 遅延が横ばい or 微減
-                    tracking_info["last_seen_time"] = current_time
-            
-            # ▼▼▼ 新規追跡処理 ▼▼▼
-            elif current_delay >= DELAY_THRESHOLD_SECONDS:
-                 
-                 tracked_delayed_trains[train_number] = {
-                     "line_id": line_id, "last_location_id": current_location_id,
-                     "last_delay": current_delay, "consecutive_increase_count": 1,
-                     "last_seen_time": current_time,
-                     "notified_initial": False, "notified_escalated": False
-                 }
-
-        # 4. 古い記録の掃除
-        trains_to_remove = [
-            train_num for train_num, info in tracked_delayed_trains.items()
-            if train_num not in trains_found_this_cycle and current_time - info["last_seen_time"] > CLEANUP_THRESHOLD_SECONDS
-        ]
-        for train_num in trains_to_remove:
-            del tracked_delayed_trains[train_num]
-            print(f"--- [TOEI DELAY WATCH] Train {train_num}: Removing track (timeout).", flush=True)
-
-        return notification_messages
+        # 1. 全列車データを取得 (toei_detector と同じスナップショットを見る)
+        if snapshot is None:
+            snapshot = get_train_snapshot(TOEI_OPERATOR)
+        if snapshot is None: return None
+        if snapshot.unchanged: return [] # 前回からデータが更新されていない
+        # 2. 追跡の更新・通知判定・古い記録の掃除 (delay_tracker の共通エンジン)
+        return _tracker.process(snapshot)
 
     except requests.exceptions.RequestException as req_err:
         print(f"--- [TOEI DELAY WATCH] ERROR: Network error: {req_err}", flush=True)
@@ -155,4 +120,11 @@ def check_toei_delay_increase() -> Optional[List[str]]:
         import traceback
         print(f"--- [TOEI DELAY WATCH] ERROR: Unexpected error: {e}", flush=True)
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+async def check_toei_delay_increase_async() -> Optional[List[str]]:
+    # 通信はイベントループ上で待ち、追跡処理だけをスレッドに回す
+    snapshot = await get_train_snapshot_async(TOEI_OPERATOR)
+    if snapshot is None: return None
+    if snapshot.unchanged: return []
+    return await asyncio.get_running_loop().run_in_executor(None, check_toei_delay_increase, snapshot)
\ No newline at end of file
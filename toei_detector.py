@@ -1,12 +1,15 @@
 import os
-import requests
+import odpt_client
 import re # 必要に応じて
-from typing import Dict, Any, List, Optional
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple
+import notified_store
+from train_snapshot import get_train_snapshot, get_train_snapshot_async, TOEI_OPERATOR
 
 # .envから都営地下鉄用のトークンを読み込む
 API_TOKEN = os.getenv('ODPT_TOKEN_TOEI')
 # 都営地下鉄用のAPIエンドポイント
-API_ENDPOINT = "https://api.odpt.org/api/v4/odpt:Train" # JRと同じURLでOK
+API_ENDPOINT = f"{odpt_client.API_BASE}/odpt:Train" # JRと同じURLでOK
 
 # --- 辞書定義 (都営地下鉄用に調整) ---
 # 駅名辞書はJRと共通のものを使うか、必要なら都営専用を追加
@@ -214,34 +217,32 @@ TOEI_LINES_TO_MONITOR = [
     },
 ]
 
-notified_trains = set() # 通知済みリストは共通
+notified_trains = notified_store.get_store("toei_irregular") # 通知済みリスト (運行日 (4時切り替え) ごと、期限と上限付き)
 
 # --- データを取ってくる係 (ほぼJRと同じ) ---
-def fetch_toei_train_data(line_config):
-    try:
-        # operatorではなくrailwayで指定する方が確実
-        params = {"odpt:railway": line_config["id"], "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=30)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"--- [TOEI FETCH] {line_config['name']} データ取得エラー: {e}", flush=True)
+def fetch_toei_train_data(line_config, snapshot=None):
+    # ★ 路線ごとには取りに行かず、サイクル共通のスナップショットから切り出す
+    if snapshot is None:
+        snapshot = get_train_snapshot(TOEI_OPERATOR)
+    if snapshot is None:
+        print(f"--- [TOEI FETCH] {line_config['name']} データ取得エラー: snapshot unavailable", flush=True)
         return None
+    return snapshot.for_railway(line_config["id"])
 
 # --- データを判定する係 (JRのprocess_irregularitiesとほぼ同じ構造) ---
 def process_toei_irregularities(train_data: List[Dict[str, Any]], line_config: Dict[str, Any]) -> List[str]:
     irregular_messages: List[str] = []
     
     for train in train_data:
-        train_type_id: Optional[str] = train.get("odpt:trainType")
-        train_number: Optional[str] = train.get("odpt:trainNumber")
+        train_type_id: Optional[str] = train.train_type
+        train_number: Optional[str] = train.train_number
         line_id: str = line_config["id"] # 路線IDを先に取得
         
         if not all([train_type_id, train_number, line_id]): continue
         if train_number is None: continue
 
         # 行き先リストを取得
-        dest_station_id_list: Optional[List[str]] = train.get("odpt:destinationStation")
+        dest_station_id_list: Optional[Tuple[str, ...]] = train.destination_station
 
         is_irregular = False
         train_type_jp: str = "" # まず空で初期化
@@ -337,11 +338,22 @@ def process_toei_irregularities(train_data: List[Dict[str, Any]], line_config: D
     return irregular_messages
 
 # --- 司令塔に提供する、唯一の機能 ---
-def check_toei_irregularities() -> List[str]:
+def check_toei_irregularities(snapshot=None) -> List[str]:
     all_irregular_trains: List[str] = []
+    if snapshot is None:
+        snapshot = get_train_snapshot(TOEI_OPERATOR)
+    if snapshot is None: return all_irregular_trains
+    if snapshot.unchanged: return all_irregular_trains # 前回からデータが更新されていない
     for line_config in TOEI_LINES_TO_MONITOR:
-        train_data = fetch_toei_train_data(line_config)
+        train_data = fetch_toei_train_data(line_config, snapshot)
         if train_data is not None:
             irregular_list = process_toei_irregularities(train_data, line_config)
             all_irregular_trains.extend(irregular_list)
-    return all_irregular_trains
\ No newline at end of file
+    return all_irregular_trains
+
+async def check_toei_irregularities_async() -> List[str]:
+    # 通信はイベントループ上で待ち、判定処理だけをスレッドに回す
+    snapshot = await get_train_snapshot_async(TOEI_OPERATOR)
+    if snapshot is None: return []
+    if snapshot.unchanged: return []
+    return await asyncio.get_running_loop().run_in_executor(None, check_toei_irregularities, snapshot)
\ No newline at end of file
@@ -1,13 +1,15 @@
 import os
 import requests
+import odpt_client
+import train_information
+from odpt_records import TrainInformation, train_informations_from_json
 import re
+import asyncio
 import unicodedata # ★ 全角数字を半角にするため
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
 # --- 基本設定 ---
-API_TOKEN = os.getenv('ODPT_TOKEN_TOEI') # ★ 都営用のトークン
-API_ENDPOINT = "https://api.odpt.org/api/v4/odpt:TrainInformation"
 
 # ---------------------------------------------------------------
 # ▼▼▼ 路線ごとの「カルテ棚」エリア ▼▼▼
@@ -98,23 +100,26 @@ def _find_nearest_turning_station(station_list: List[str], turning_stations: set
     return None
 
 # --- メイン関数 (都営版) ---
-def check_toei_info() -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]]:
+def check_toei_info(info_data: Any = None) -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]]:
     global last_toei_statuses, current_official_info
     notification_messages: List[str] = []
+    previous_official_info = current_official_info
     current_official_info = {} # 毎回復活させる
     
     try:
-        params = {"odpt:operator": "odpt.Operator:Toei", "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=30)
-        response.raise_for_status()
-        try: info_data: Any = response.json()
-        except requests.exceptions.JSONDecodeError as json_err: return None, {}
+        if info_data is None: # ★ asyncio版から渡されていなければ、ここで取得する
+            # メトロ・多摩モノと共通のまとめ取りから、都営の分だけを受け取る
+            try: info_data = train_information.get_operator_information(train_information.TOEI_OPERATOR)
+            except requests.exceptions.JSONDecodeError as json_err: return None, {}
+        # 前回とまったく同じ中身なら、辞書を作り直さずに前回の結果をそのまま使う
+        if info_data is odpt_client.NOT_MODIFIED:
+            current_official_info = previous_official_info
+            return [], current_official_info
         if not isinstance(info_data, list): return None, {}
 
-        info_dict: Dict[str, Dict[str, Any]] = {}
-        for item in info_data:
-             if isinstance(item, dict) and item.get("odpt:railway") and isinstance(item.get("odpt:trainInformationText"), dict) and item.get("odpt:trainInformationText", {}).get("ja"):
-                 info_dict[item["odpt:railway"]] = item
+        info_dict: Dict[str, TrainInformation] = {}
+        for item in train_informations_from_json(info_data): # 路線と日本語の文章がそろったものだけ
+            info_dict[item.railway] = item
 
         for line_id, line_info in info_dict.items():
             
@@ -267,8 +272,19 @@ def check_toei_info() -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]]:
         import traceback
         print(f"--- [TOEI INFO] ERROR: Unexpected error occurred in check_toei_info: {e}", flush=True)
         traceback.print_exc()
+        train_information.forget(train_information.TOEI_OPERATOR) # 次は同じ中身でも解析し直す
         return None, {}
 
 # --- 遅延検知にステータスを渡すための関数 ---
 def get_current_official_info() -> Dict[str, Dict[str, Any]]:
-    return current_official_info
\ No newline at end of file
+    return current_official_info
+
+async def check_toei_info_async() -> Optional[tuple[List[str], Dict[str, Dict[str, Any]]]]:
+    # 通信はイベントループ上で待ち、解析処理だけをスレッドに回す
+    try:
+        info_data = await train_information.get_operator_information_async(train_information.TOEI_OPERATOR)
+    except requests.exceptions.RequestException as req_err:
+        print(f"--- [TOEI INFO] ERROR: Network error: {req_err}", flush=True)
+        return None, {}
+    if info_data is odpt_client.NOT_MODIFIED: return check_toei_info(info_data) # スレッドに回すまでもない
+    return await asyncio.get_running_loop().run_in_executor(None, check_toei_info, info_data)
\ No newline at end of file
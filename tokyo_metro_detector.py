@@ -1,11 +1,13 @@
 import os
 import requests
+import odpt_client
+import train_information
+from odpt_records import TrainInformation, train_informations_from_json
 import re
+import asyncio
 from typing import Dict, Any, List, Optional
 
 # --- 基本設定 ---
-API_TOKEN = os.getenv('ODPT_TOKEN_TOEI')
-API_ENDPOINT = "https://api.odpt.org/api/v4/odpt:TrainInformation"
 
 # --- 駅名と折り返し可能駅のリスト
 GINZA_LINE_STATIONS = [
@@ -173,23 +175,23 @@ def _find_nearest_turning_station(station_list: List[str], turning_stations: set
 # (メトロでは _find_nearest_hub は不要なので削除)
 
 # --- メイン関数 (丸ノ内線ロジック復活、ハブロジック削除) ---
-def check_tokyo_metro_info() -> Optional[List[str]]:
+def check_tokyo_metro_info(info_data: Any = None) -> Optional[List[str]]:
     global last_metro_statuses
     notification_messages: List[str] = []
     SIMULATE_CHIYODA_ACCIDENT = False # シミュレーションフラグ
 
     try:
-        params = {"odpt:operator": "odpt.Operator:TokyoMetro", "acl:consumerKey": API_TOKEN}
-        response = requests.get(API_ENDPOINT, params=params, timeout=30)
-        response.raise_for_status()
-        try: info_data: Any = response.json()
-        except requests.exceptions.JSONDecodeError as json_err: return None
+        if info_data is None: # ★ asyncio版から渡されていなければ、ここで取得する
+            # 都営・多摩モノと共通のまとめ取りから、メトロの分だけを受け取る
+            try: info_data = train_information.get_operator_information(train_information.TOKYO_METRO_OPERATOR)
+            except requests.exceptions.JSONDecodeError as json_err: return None
+        # 前回とまったく同じ中身なら、辞書を作り直さずに終わる
+        if info_data is odpt_client.NOT_MODIFIED: return []
         if not isinstance(info_data, list): return None
 
-        info_dict: Dict[str, Dict[str, Any]] = {}
-        for item in info_data:
-             if isinstance(item, dict) and item.get("odpt:railway") and isinstance(item.get("odpt:trainInformationText"), dict) and item.get("odpt:trainInformationText", {}).get("ja"):
-                 info_dict[item["odpt:railway"]] = item
+        info_dict: Dict[str, TrainInformation] = {}
+        for item in train_informations_from_json(info_data): # 路線と日本語の文章がそろったものだけ
+            info_dict[item.railway] = item
 
         for line_id, line_info in info_dict.items():
             current_status: str = line_info["odpt:trainInformationText"]["ja"]
@@ -298,4 +300,13 @@ def check_tokyo_metro_info() -> Optional[List[str]]:
     except requests.exceptions.RequestException as req_err: return None
     except Exception as e:
         print(f"--- [METRO] ERROR: An unexpected error occurred in check_tokyo_metro_info: {e}", flush=True)
-        return None
\ No newline at end of file
+        train_information.forget(train_information.TOKYO_METRO_OPERATOR) # 次は同じ中身でも解析し直す
+        return None
+
+async def check_tokyo_metro_info_async() -> Optional[List[str]]:
+    # 通信はイベントループ上で待ち、解析処理だけをスレッドに回す
+    try:
+        info_data = await train_information.get_operator_information_async(train_information.TOKYO_METRO_OPERATOR)
+    except requests.exceptions.RequestException as req_err: return None
+    if info_data is odpt_client.NOT_MODIFIED: return check_tokyo_metro_info(info_data) # スレッドに回すまでもない
+    return await asyncio.get_running_loop().run_in_executor(None, check_tokyo_metro_info, info_data)
\ No newline at end of file
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+from typing import Dict, Any, List, Optional
+
+import requests
+import odpt_client
+import train_snapshot
+
+# ---------------------------------------------------------------
+# ▼▼▼ 運行情報 (odpt:TrainInformation) のまとめ取り ▼▼▼
+# ---------------------------------------------------------------
+# 東京メトロ・都営・多摩モノの運行情報は、どれも api.odpt.org の同じエンドポイントを
+# 同じトークンで取りに行き、違うのは odpt:operator の絞り込みだけだった。
+# 1サイクルにつき1回だけ、3事業者をカンマ区切りで odpt:operator に並べてまとめて取得し、
+# 事業者ごとに仕分けて配る (ODPT API の絞り込みはカンマ区切りで複数の値を受け付ける)。
+# 絞らずに取ると、このトークンで見える他の事業者の分まで毎サイクル落としてくることになる。
+# サイクルの数え方は在線スナップショット (train_snapshot) と共通。
+
+TOKYO_METRO_OPERATOR = "odpt.Operator:TokyoMetro"
+TOEI_OPERATOR = "odpt.Operator:Toei"
+TAMA_MONORAIL_OPERATOR = "odpt.Operator:TamaMonorail"
+
+COMBINED_ENDPOINT = f"{odpt_client.API_BASE}/odpt:TrainInformation"
+COMBINED_OPERATORS = (TOKYO_METRO_OPERATOR, TOEI_OPERATOR, TAMA_MONORAIL_OPERATOR)
+
+# --- 設定値 ---
+TIMEOUT = 30
+
+# --- サイクル管理 ---
+_fetched_cycle = -1
+_partitions: Dict[str, List[Dict[str, Any]]] = {}     # このサイクルの、事業者ごとの運行情報
+_failure: Optional[requests.exceptions.RequestException] = None # このサイクルの取得失敗 (同じサイクル内で何度も待たないように)
+_handed_out: Dict[str, List[Dict[str, Any]]] = {}     # 各事業者の検知に最後に渡した中身
+_fetch_count = 0
+_lock = threading.Lock()
+_async_lock: Optional[asyncio.Lock] = None
+
+
+def partition_by_operator(info_data: Any) -> Dict[str, List[Dict[str, Any]]]:
+    """事業者ごとに仕分ける (元の並び順は保つ)"""
+    if not isinstance(info_data, list):
+        raise requests.exceptions.JSONDecodeError(f"unexpected payload type: {type(info_data).__name__}", "", 0)
+    partitions: Dict[str, List[Dict[str, Any]]] = {operator: [] for operator in COMBINED_OPERATORS}
+    for item in info_data:
+        if not isinstance(item, dict): continue
+        items = partitions.get(item.get("odpt:operator"))
+        if items is not None: items.append(item)
+    return partitions
+
+
+def _store(info_data: Any, cycle: int) -> None:
+    global _fetched_cycle, _partitions, _failure, _fetch_count
+    # 全体が前回と同じ (NOT_MODIFIED) なら、前回の仕分けをそのまま使う
+    if info_data is not odpt_client.NOT_MODIFIED:
+        _partitions = partition_by_operator(info_data)
+    _fetched_cycle, _failure = cycle, None
+    _fetch_count += 1
+    summary = ", ".join(f"{operator.split(':')[-1]}={len(items)}" for operator, items in _partitions.items())
+    print(f"--- [TRAIN INFO] combined fetch: {summary} ---", flush=True)
+
+
+def _fetch_failed(error: requests.exceptions.RequestException, cycle: int) -> None:
+    # 前回のデータ (last_good) では代用しない。メトロ・都営・多摩モノの検知は「前回から変わったか」を
+    # 通知するだけで、その結果で判定を変える利用者もいない。前回のデータを渡しても「変化なし」になるだけなので、
+    # 失敗として数えて、次のサイクルで取り直す
+    global _fetched_cycle, _failure
+    print(f"--- [TRAIN INFO] 運行情報のまとめ取りに失敗: {error}", flush=True)
+    _fetched_cycle, _failure = cycle, error
+
+
+def _hand_out(operator: str) -> Any:
+    """
+    事業者の分を返す。その事業者の検知に前回渡したものと中身が同じなら NOT_MODIFIED。
+    (他の事業者だけが変わっても、変わっていない事業者の検知は解析を省ける)
+    """
+    if _failure is not None: raise _failure
+    items = _partitions.get(operator, [])
+    if _handed_out.get(operator) == items: return odpt_client.NOT_MODIFIED
+    _handed_out[operator] = items
+    return items
+
+
+def forget(operator: str) -> None:
+    """検知が渡された中身の処理に失敗したときに呼ぶ。次は同じ中身でも NOT_MODIFIED にせず、もう一度渡す。"""
+    _handed_out.pop(operator, None)
+
+
+def _params() -> Dict[str, Any]:
+    return {"odpt:operator": ",".join(COMBINED_OPERATORS), "acl:consumerKey": odpt_client.TOKEN_TOEI}
+
+
+def get_operator_information(operator: str) -> Any:
+    """
+    このサイクルの、指定事業者の odpt:TrainInformation (dict のリスト) を返す。
+    まだ取得していなければ、ここで全事業者分を1回だけ取得する。
+    中身が前回と同じなら odpt_client.NOT_MODIFIED、取得失敗なら RequestException を投げる。
+    """
+    with _lock:
+        cycle = train_snapshot.current_cycle()
+        if _fetched_cycle != cycle:
+            try:
+                _store(odpt_client.get_json(COMBINED_ENDPOINT, params=_params(), timeout=TIMEOUT, if_changed=True), cycle)
+            except requests.exceptions.RequestException as e:
+                _fetch_failed(e, cycle)
+        return _hand_out(operator)
+
+
+async def get_operator_information_async(operator: str) -> Any:
+    """get_operator_information の asyncio版。同じサイクルの他の事業者の取得を待つだけで、二重には取りに行かない。"""
+    global _async_lock
+    if _async_lock is None:
+        _async_lock = asyncio.Lock()
+    async with _async_lock:
+        cycle = train_snapshot.current_cycle()
+        if _fetched_cycle != cycle:
+            try:
+                info_data = await odpt_client.get_json_async(COMBINED_ENDPOINT, params=_params(), timeout=TIMEOUT, if_changed=True)
+                _store(info_data, cycle)
+            except requests.exceptions.RequestException as e:
+                _fetch_failed(e, cycle)
+        return _hand_out(operator)
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        "fetches": _fetch_count,
+        "cycle": _fetched_cycle,
+        "failed": _failure is not None,
+        "items": {operator: len(items) for operator, items in _partitions.items()},
+    }
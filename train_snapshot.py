@@ -0,0 +1,319 @@
+import asyncio
+import contextlib
+import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple, Mapping, Iterable
+
+import requests
+import odpt_client
+import snapshot_diff
+from odpt_records import Train, trains_from_json, train_stream_parser
+
+# ---------------------------------------------------------------
+# ▼▼▼ 在線情報 (odpt:Train) のスナップショット配給係 ▼▼▼
+# ---------------------------------------------------------------
+# 1サイクルにつき、事業者ごとに1回だけ全列車データを取得して、
+# odpt:railway ごとに仕分けたものを全員に配る。
+# (JR東の路線別取得・遅延監視・行先予測がそれぞれ同じデータを取りに行かないように)
+# 同じサイクルの利用者は全員、まったく同じ (書き換え不可の) データを見る。
+# 前回からの差分 (snapshot_diff) も一緒に配る (最初に使われたときに1回だけ作る)。
+
+JR_EAST_OPERATOR = "odpt.Operator:JR-East"
+TOEI_OPERATOR = "odpt.Operator:Toei"
+TOBU_OPERATOR = "odpt.Operator:Tobu"
+
+# 事業者ごとの取得先
+SNAPSHOT_SOURCES: Dict[str, Dict[str, Any]] = {
+    JR_EAST_OPERATOR: {
+        "endpoint": f"{odpt_client.CHALLENGE_API_BASE}/odpt:Train",
+        "token": odpt_client.TOKEN_CHALLENGE,
+        "timeout": 45,
+    },
+    TOEI_OPERATOR: {
+        "endpoint": f"{odpt_client.API_BASE}/odpt:Train",
+        "token": odpt_client.TOKEN_TOEI,
+        "timeout": 45,
+    },
+    TOBU_OPERATOR: {
+        "endpoint": f"{odpt_client.CHALLENGE_API_BASE}/odpt:Train",
+        "token": odpt_client.TOKEN_CHALLENGE,
+        "timeout": 45,
+    },
+}
+
+# --- 設定値 ---
+REFRESH_MARGIN = 2 # dct:valid を過ぎてから取りに行くまでの余裕 (秒)。配信側の更新待ち
+PARSE_BATCH_BYTES = 1024 * 1024 # asyncio版で、受け取った断片をこれだけためてから解析スレッドに渡す (バイト)
+
+
+def _parse_odpt_time(value: Any) -> Optional[float]:
+    """ODPTの日時 (例: 2025-01-01T10:00:00+09:00) をUNIX時刻にする"""
+    if not isinstance(value, str): return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class TrainSnapshot:
+    """ある時点の、1事業者分の在線情報 (読み取り専用)。SnapshotBuilder で作る。"""
+    __slots__ = ("operator", "trains", "by_railway", "max_delay_by_railway", "fetched_at", "cycle",
+                 "data_date", "valid_until", "unchanged", "diff_state")
+
+    def __init__(self, operator: str, trains: Tuple[Train, ...], by_railway: Mapping[str, Tuple[Train, ...]],
+                 max_delay_by_railway: Mapping[str, int], fetched_at: float, cycle: int,
+                 data_date: Optional[float], valid_until: Optional[float]):
+        self.operator = operator
+        self.trains = trains
+        self.by_railway = by_railway
+        self.max_delay_by_railway = max_delay_by_railway # 路線ごとの最大遅延 (秒)
+        self.fetched_at = fetched_at
+        self.cycle = cycle
+        self.data_date = data_date       # 一番新しい dc:date (配信側がデータを作った時刻)
+        self.valid_until = valid_until   # まだ有効な dct:valid のうち一番早いもの (= 次の更新の目安)
+        self.unchanged = False # 前回から dc:date が進んでいなければ True (後続の判定は省略してよい)
+        self.diff_state: Optional[snapshot_diff.PendingDiff] = None # 前回からの差分 (snapshot_diff.changes_of で取り出す)
+
+    @property
+    def age(self) -> float:
+        """何秒前に取得したデータか"""
+        return max(time.time() - self.fetched_at, 0.0)
+
+    def for_railway(self, line_id: str) -> Tuple[Train, ...]:
+        return self.by_railway.get(line_id, ())
+
+
+class SnapshotBuilder:
+    """
+    列車を1本ずつ受け取りながら、路線ごとの仕分け・最大遅延・鮮度の集計を1回の走査で済ませる。
+    逐次パーサから届いた順に add していけば、dict の配列を丸ごと持つ必要がない。
+    """
+    __slots__ = ("operator", "fetched_at", "cycle", "_trains", "_by_railway", "_max_delay",
+                 "_data_date", "_valid_until", "_last_date", "_last_valid")
+
+    def __init__(self, operator: str, fetched_at: float, cycle: int):
+        self.operator = operator
+        self.fetched_at = fetched_at
+        self.cycle = cycle
+        self._trains: List[Train] = []
+        self._by_railway: Dict[str, List[Train]] = {}
+        self._max_delay: Dict[str, int] = {}
+        self._data_date: Optional[float] = None
+        self._valid_until: Optional[float] = None
+        # dc:date / dct:valid はほぼ全列車で同じ文字列なので、直前と同じなら解析を省く
+        self._last_date: Optional[str] = None
+        self._last_valid: Optional[str] = None
+
+    def add(self, train: Train) -> None:
+        self._trains.append(train)
+
+        if train.date is not None and train.date != self._last_date:
+            self._last_date = train.date
+            published = _parse_odpt_time(train.date)
+            if published is not None and (self._data_date is None or published > self._data_date):
+                self._data_date = published
+        if train.valid is not None and train.valid != self._last_valid:
+            self._last_valid = train.valid
+            valid = _parse_odpt_time(train.valid)
+            if valid is not None and valid > self.fetched_at and (self._valid_until is None or valid < self._valid_until):
+                self._valid_until = valid
+
+        line_id = train.railway
+        if not line_id: return
+        line_trains = self._by_railway.get(line_id)
+        if line_trains is None:
+            self._by_railway[line_id] = [train]
+            self._max_delay[line_id] = train.delay
+        else:
+            line_trains.append(train)
+            if train.delay > self._max_delay[line_id]: self._max_delay[line_id] = train.delay
+
+    def add_all(self, trains: Iterable[Train]) -> None:
+        for train in trains: self.add(train)
+
+    def build(self) -> TrainSnapshot:
+        # 各列車は書き換え不可のレコード、仕分けもタプルにする (誰かが書き換えると、他の利用者の見え方が変わってしまうため)
+        return TrainSnapshot(
+            self.operator,
+            tuple(self._trains),
+            MappingProxyType({line_id: tuple(line_trains) for line_id, line_trains in self._by_railway.items()}),
+            MappingProxyType(self._max_delay),
+            self.fetched_at, self.cycle, self._data_date, self._valid_until,
+        )
+
+
+def snapshot_from_json(operator: str, train_data: Any, fetched_at: float, cycle: int) -> TrainSnapshot:
+    """デコード済みの odpt:Train の配列からスナップショットを作る"""
+    if not isinstance(train_data, list):
+        raise ValueError(f"unexpected payload type: {type(train_data).__name__}")
+    builder = SnapshotBuilder(operator, fetched_at, cycle)
+    builder.add_all(trains_from_json(train_data))
+    return builder.build()
+
+
+# --- サイクル管理 ---
+_current_cycle = 0
+_snapshots: Dict[str, TrainSnapshot] = {}
+_failed_cycle: Dict[str, int] = {} # 取得に失敗したサイクル (同じサイクル内で何度も待たないように)
+_unchanged_counts: Dict[str, int] = {} # dc:date が進んでいなかった回数
+_diff_bases: Dict[str, TrainSnapshot] = {} # 差分の比較相手 (最後に更新のあったスナップショット = 利用者が最後に見たもの)
+_locks: Dict[str, threading.Lock] = {operator: threading.Lock() for operator in SNAPSHOT_SOURCES}
+_async_locks: Dict[str, asyncio.Lock] = {}
+
+
+def start_new_cycle() -> None:
+    """司令塔がサイクルの頭で呼ぶ。これ以降の取得は新しいデータになる。"""
+    global _current_cycle
+    _current_cycle += 1
+
+
+def current_cycle() -> int:
+    return _current_cycle
+
+
+def _cached_snapshot(operator: str, cycle: int) -> Tuple[bool, Optional[TrainSnapshot]]:
+    """(このサイクルで取得済みか, スナップショット) を返す"""
+    snapshot = _snapshots.get(operator)
+    if snapshot is not None and snapshot.cycle == cycle:
+        return True, snapshot
+    if _failed_cycle.get(operator) == cycle:
+        return True, None
+    return False, None
+
+
+def _store_snapshot(snapshot: TrainSnapshot) -> TrainSnapshot:
+    operator = snapshot.operator
+    previous = _snapshots.get(operator)
+    if previous is not None and previous.data_date is not None and snapshot.data_date is not None:
+        snapshot.unchanged = snapshot.data_date <= previous.data_date
+    _snapshots[operator] = snapshot
+    if snapshot.unchanged:
+        _unchanged_counts[operator] = _unchanged_counts.get(operator, 0) + 1
+        print(f"--- [SNAPSHOT] {operator}: dc:date not advanced, skipping downstream checks ---", flush=True)
+        return snapshot
+    snapshot_diff.defer(snapshot, _diff_bases.get(operator))
+    _diff_bases[operator] = snapshot
+    print(f"--- [SNAPSHOT] {operator}: {len(snapshot.trains)} trains / {len(snapshot.by_railway)} lines ---", flush=True)
+    return snapshot
+
+
+def seconds_until_refresh(operator: str) -> Optional[float]:
+    """直近のデータの dct:valid から、次に取りに行くべきまでの秒数を返す (目安が無ければ None)"""
+    snapshot = _snapshots.get(operator)
+    if snapshot is None or snapshot.valid_until is None: return None
+    wait = snapshot.valid_until + REFRESH_MARGIN - time.time()
+    return wait if wait > 0 else None
+
+
+def get_freshness_stats() -> Dict[str, Dict[str, Any]]:
+    stats: Dict[str, Dict[str, Any]] = {}
+    for operator, snapshot in list(_snapshots.items()):
+        changes = snapshot_diff.computed_changes(_diff_bases.get(operator))
+        stats[operator] = {
+            "data_date": snapshot.data_date,
+            "valid_until": snapshot.valid_until,
+            "fetched_at": snapshot.fetched_at,
+            "unchanged": snapshot.unchanged,
+            "unchanged_count": _unchanged_counts.get(operator, 0),
+            "age": round(snapshot.age, 1),
+            "stale": _failed_cycle.get(operator, -1) > snapshot.cycle, # これより後の取得に失敗している
+            "changes": changes.summary() if changes is not None else None, # 最後に更新のあった回の、前回からの変化の数
+        }
+    return stats
+
+
+def _fetch_failed(operator: str, cycle: int, error: Exception) -> None:
+    print(f"--- [SNAPSHOT] {operator} の在線データ取得に失敗: {error}", flush=True)
+    _failed_cycle[operator] = cycle
+
+
+def get_train_snapshot(operator: str) -> Optional[TrainSnapshot]:
+    """
+    このサイクルのスナップショットを返す。まだ無ければここで1回だけ取得する。
+    取得に失敗したときは None (前回のデータの古さは get_freshness_stats で分かる)。
+    """
+    source = SNAPSHOT_SOURCES[operator]
+    with _locks[operator]:
+        cycle = _current_cycle
+        done, snapshot = _cached_snapshot(operator, cycle)
+        if done: return snapshot
+
+        try:
+            # 本体は少しずつ受け取り、1本読むたびに仕分けまで済ませる (dict の配列は作らない)
+            params = {"odpt:operator": operator, "acl:consumerKey": source["token"]}
+            parser = train_stream_parser()
+            builder = SnapshotBuilder(operator, time.time(), cycle)
+            # 途中で読めなくなっても、接続とブレーカーの記録は閉じてから抜ける
+            with contextlib.closing(odpt_client.iter_chunks(source["endpoint"], params=params, timeout=source["timeout"])) as chunks:
+                for chunk in chunks:
+                    builder.add_all(parser.feed(chunk))
+            builder.add_all(parser.close())
+            return _store_snapshot(builder.build())
+        except (requests.exceptions.RequestException, ValueError) as e:
+            _fetch_failed(operator, cycle, e)
+            return None
+
+
+def _discard_result(future: "asyncio.Future[Any]") -> None:
+    """結果を使わなくなった解析の例外を読んでおく (未回収の警告を出さないように)"""
+    if not future.cancelled(): future.exception()
+
+
+async def get_train_snapshot_async(operator: str) -> Optional[TrainSnapshot]:
+    """
+    get_train_snapshot の asyncio版。通信はイベントループ上で待ち、届いた断片を PARSE_BATCH_BYTES ずつ
+    解析スレッドに渡して、JSONの解析と仕分けはそちらで行う (ループを止めず、受信待ちの間はスレッドも使わない)。
+    """
+    source = SNAPSHOT_SOURCES[operator]
+    lock = _async_locks.get(operator)
+    if lock is None:
+        lock = _async_locks[operator] = asyncio.Lock()
+    async with lock:
+        cycle = _current_cycle
+        done, snapshot = _cached_snapshot(operator, cycle)
+        if done: return snapshot
+
+        try:
+            params = {"odpt:operator": operator, "acl:consumerKey": source["token"]}
+            loop = asyncio.get_running_loop()
+            parser = train_stream_parser()
+            builder = SnapshotBuilder(operator, time.time(), cycle)
+
+            def parse(body: bytes) -> None:
+                builder.add_all(parser.feed(body))
+
+            def finish(body: bytes) -> TrainSnapshot:
+                parse(body)
+                builder.add_all(parser.close())
+                return builder.build()
+
+            # 解析は1度に1つだけ (前の分が終わってから次を渡すので、parser と builder を同時に触らない)
+            parsing: Optional[asyncio.Future] = None
+            buffered: List[bytes] = []
+            size = 0
+            try:
+                # 途中で読めなくなっても、ジェネレータを閉じて接続とブレーカーの枠を返してから抜ける
+                async with contextlib.aclosing(odpt_client.iter_chunks_async(source["endpoint"], params=params, timeout=source["timeout"])) as stream:
+                    async for chunk in stream:
+                        buffered.append(chunk)
+                        size += len(chunk)
+                        if size < PARSE_BATCH_BYTES: continue
+                        if parsing is not None: await parsing
+                        parsing = loop.run_in_executor(None, parse, b"".join(buffered))
+                        buffered, size = [], 0
+                if parsing is not None: await parsing
+            except BaseException:
+                if parsing is not None: parsing.add_done_callback(_discard_result)
+                raise
+            return _store_snapshot(await loop.run_in_executor(None, finish, b"".join(buffered)))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            _fetch_failed(operator, cycle, e)
+            return None
+
+
+async def prefetch_snapshots_async(operators: Optional[List[str]] = None) -> None:
+    """サイクルの頭で、指定された事業者 (省略時は全事業者) のスナップショットを同時に取りに行く"""
+    if operators is None: operators = list(SNAPSHOT_SOURCES)
+    await asyncio.gather(*(get_train_snapshot_async(operator) for operator in operators))